@@ -0,0 +1,150 @@
+# admissao.py
+# Controle de admissão das rotas de ingestão: um balde de fichas por
+# dispositivo (cada leitura gasta uma ficha) e um teto global de
+# requisições gravando + rodando ML-2/ML-3 ao mesmo tempo. Quem passa do
+# limite recebe 429 com Retry-After antes de tocar no banco, e o esp.py
+# espera esse tempo antes de reenviar; assim uma placa em laço apertado
+# não empurra a latência das outras para cima.
+
+import math
+import os
+import threading
+import time
+
+# -------------------------
+# Configurações (variáveis de ambiente)
+# -------------------------
+TAXA = float(os.getenv("ECOVITA_ADMISSAO_TAXA", "5"))          # leituras/s por dispositivo; 0 desliga
+RAJADA = float(os.getenv("ECOVITA_ADMISSAO_RAJADA", "200"))    # fichas do balde cheio
+INFERENCIA_MAX = int(os.getenv("ECOVITA_INFERENCIA_MAX", "8"))  # requisições em gravação + ML; 0 desliga
+INFERENCIA_ESPERA_S = float(os.getenv("ECOVITA_INFERENCIA_ESPERA_MS", "100")) / 1000
+LIMPEZA_A_CADA = 1000   # admissões entre varreduras dos baldes parados
+
+
+class _Balde:
+    __slots__ = ("fichas", "atualizado")
+
+    def __init__(self, fichas, agora):
+        self.fichas = fichas
+        self.atualizado = agora
+
+
+class BaldesDispositivo:
+    """
+    Token bucket por origem (device_id ou IP). Um lote maior que a rajada
+    passa se o balde estiver cheio e deixa o saldo negativo: o dispositivo
+    espera a dívida ser paga antes do próximo envio.
+    """
+
+    def __init__(self, taxa=TAXA, rajada=RAJADA):
+        self.taxa = taxa
+        self.rajada = rajada
+        self._baldes = {}
+        self._lock = threading.Lock()
+        self._ate_limpeza = LIMPEZA_A_CADA
+
+        # Métricas
+        self.admitidas = 0
+        self.recusadas = 0
+
+    @property
+    def ativo(self):
+        return self.taxa > 0
+
+    def admitir(self, origem, custo=1):
+        """0 se admitido (fichas já descontadas), senão os segundos até haver fichas."""
+        if not self.ativo:
+            return 0.0
+        agora = time.monotonic()
+        with self._lock:
+            balde = self._baldes.get(origem)
+            if balde is None:
+                balde = self._baldes[origem] = _Balde(self.rajada, agora)
+            else:
+                balde.fichas = min(self.rajada, balde.fichas + (agora - balde.atualizado) * self.taxa)
+                balde.atualizado = agora
+            necessario = min(custo, self.rajada)
+            if balde.fichas < necessario:
+                self.recusadas += custo
+                return (necessario - balde.fichas) / self.taxa
+            balde.fichas -= custo
+            self.admitidas += custo
+            self._ate_limpeza -= 1
+            if self._ate_limpeza <= 0:
+                self._limpar(agora)
+        return 0.0
+
+    def _limpar(self, agora):
+        # Balde parado há tempo suficiente para encher é igual a um balde novo
+        cheio_apos = self.rajada / self.taxa
+        for origem in [o for o, b in self._baldes.items() if agora - b.atualizado >= cheio_apos]:
+            del self._baldes[origem]
+        self._ate_limpeza = LIMPEZA_A_CADA
+
+    def status(self):
+        return {
+            "taxa_por_s": self.taxa,
+            "rajada": self.rajada,
+            "origens": len(self._baldes),
+            "admitidas": self.admitidas,
+            "recusadas": self.recusadas,
+        }
+
+
+class LimiteInferencia:
+    """Teto global de requisições gravando + inferindo; espera uma vaga por até espera_s."""
+
+    def __init__(self, maximo=INFERENCIA_MAX, espera_s=INFERENCIA_ESPERA_S):
+        self.maximo = maximo
+        self.espera_s = espera_s
+        self._vagas = threading.BoundedSemaphore(maximo) if maximo > 0 else None
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.em_uso = 0
+        self.pico = 0
+        self.recusadas = 0
+
+    def tentar(self):
+        """Toma uma vaga só se houver uma livre agora (sem esperar nem contar recusa)."""
+        if self._vagas is None:
+            return True
+        if not self._vagas.acquire(blocking=False):
+            return False
+        with self._lock:
+            self.em_uso += 1
+            self.pico = max(self.pico, self.em_uso)
+        return True
+
+    def entrar(self):
+        """True com a vaga tomada; False se nenhuma abriu a tempo."""
+        if self._vagas is None:
+            return True
+        if not self._vagas.acquire(timeout=self.espera_s):
+            with self._lock:
+                self.recusadas += 1
+            return False
+        with self._lock:
+            self.em_uso += 1
+            self.pico = max(self.pico, self.em_uso)
+        return True
+
+    def sair(self):
+        if self._vagas is None:
+            return
+        with self._lock:
+            self.em_uso -= 1
+        self._vagas.release()
+
+    def status(self):
+        return {
+            "maximo": self.maximo,
+            "em_uso": self.em_uso,
+            "pico": self.pico,
+            "recusadas": self.recusadas,
+        }
+
+
+def retry_after(espera_s):
+    """Valor do cabeçalho Retry-After (segundos inteiros, no mínimo 1)."""
+    return str(max(1, math.ceil(espera_s)))
@@ -1,56 +1,293 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from banco import SessionLocal, SiteDado, SensorLeitura, init_db
+from bd import (
+    SessionLocal, SessionLeitura, SessionAsync, SessionLeituraAsync, SiteDado, SensorLeitura, MLResultado,
+    ML3Resultado, Dispositivo, Teste, CAMPOS_COM_EXTREMOS, DB_ASSINCRONO, init_db,
+    engine, engine_leitura, engine_async, engine_leitura_async
+)
+from feed import difusor
+from ingestao import FilaIngestao, FilaCheia, INGESTAO_ASSINCRONA
+from ouvinte import OuvinteLinhas
+from cache import CacheRespostas
+from idempotencia import JanelaSequencias, SeqReiniciada, chave
+from admissao import BaldesDispositivo, LimiteInferencia, retry_after
+from frota import RegistroFrota
+from metricas import Metricas, MedirRequisicoes, Histograma, uso_pool, TIPO_CONTEUDO
+from microlote import FAIXAS_LOTE
+from esquemas import (
+    LeituraEntrada, SiteDadoEntrada, LeituraSaida, SiteDadoSaida, MLResultadoSaida, LeituraProcessada,
+    SiteDadoInserido, IdsGravados, Pagina, RespostaORJSON, mensagem_validacao,
+    DispositivoEntrada, DispositivoSaida, PainelDispositivo
+)
+from consultas import (
+    filtrar, filtrar_gas, paginar, paginar_async, exportar_leituras, agregar_leituras, agregar_rollups, agregar_gases,
+    COLUNAS_EXPORTACAO, LIMITE_PADRAO, LIMITE_MAX
+)
+from arquivo import leituras_arquivadas
+from binario import TIPO_BINARIO, FormatoInvalido, decodificar
+from inferencia import (
+    modelos, prever_toxicidade, prever_gases, validar_contexto,
+    prever_gases_lote, validar_contexto_lote
+)
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
+from typing import Optional
+import asyncio
+import json
+import time
+import zlib
 
 app = FastAPI(title="Ecovita API")
 
+# Contadores e latências por rota e por etapa da ingestão (GET /metrics)
+metricas = Metricas()
+metricas.medir_commits()
+app.add_middleware(MedirRequisicoes, metricas=metricas)
+
+# Respostas de /site_dados e /ml_resultados com ETag, invalidadas por gravações nas tabelas
+cache_respostas = CacheRespostas()
+
+# Teste em andamento em cada pilha, herdado pelas leituras da placa (frota.py)
+frota = RegistroFrota(SessionLeitura)
+
 # ----------------------
 # DEPENDÊNCIA DO BANCO
 # ----------------------
 def get_db():
+    # SessionLocal não expira no commit: a resposta é montada dos valores
+    # já em memória, sem um SELECT por objeto para recarregá-los
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+def get_db_leitura():
+    """Sessão do pool somente-leitura (rotas GET não disputam a conexão de escrita)."""
+    db = SessionLeitura()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_db_async():
+    """AsyncSession de escrita (ECOVITA_DB_ASSINCRONO=1)."""
+    async with SessionAsync() as db:
+        yield db
+
+async def get_db_leitura_async():
+    async with SessionLeituraAsync() as db:
+        yield db
+
+def pagina(query, modelo, cursor, limit, arquivadas=None):
+    """Resposta paginada comum às rotas de listagem."""
+    try:
+        itens, proximo = paginar(query, modelo, cursor, limit, arquivadas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        # Devolve a conexão ao pool já aqui: a validação do response_model de
+        # uma rota síncrona espera outra vaga no threadpool, e com todas as
+        # vagas ocupadas por rotas esperando conexão, o pool travava.
+        query.session.close()
+    return {"itens": itens, "next_cursor": proximo}
+
+async def pagina_async(db, consulta, modelo, cursor, limit, arquivadas=None):
+    try:
+        itens, proximo = await paginar_async(db, consulta, modelo, cursor, limit, arquivadas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"itens": itens, "next_cursor": proximo}
+
+# Com ECOVITA_DB_ASSINCRONO=1, as rotas de ingestão e listagem passam a ser
+# as versões async do fim do arquivo (mesmo caminho, mesma resposta); as
+# demais rotas seguem síncronas no threadpool.
+def sincrona(registrar):
+    return (lambda rota: rota) if DB_ASSINCRONO else registrar
+
+def assincrona(registrar):
+    return registrar if DB_ASSINCRONO else (lambda rota: rota)
+
 @app.on_event("startup")
 def startup():
     init_db()  # Cria tabelas se não existirem
+    modelos.carregar()  # Carrega e aquece ML-1/ML-2/ML-3 uma única vez
+    if fila_ingestao is not None:
+        fila_ingestao.iniciar()
+
+@app.on_event("startup")
+async def iniciar_ouvinte():
+    # Servidores TCP/UDP no mesmo event loop do uvicorn
+    if ouvinte.ativo:
+        await ouvinte.iniciar()
+
+@app.on_event("shutdown")
+async def parar_ouvinte():
+    # Antes de parar a fila assíncrona, que ainda recebe o que o ouvinte tinha
+    if ouvinte.ativo:
+        await ouvinte.parar()
+
+@app.on_event("shutdown")
+def shutdown():
+    if fila_ingestao is not None:
+        fila_ingestao.parar()  # Grava o que ainda estiver na fila
 
 # ----------------------
 # ROTAS DO SITE
 # ----------------------
-@app.get("/site_dados")
-def listar_site_dados(db: Session = Depends(get_db)):
-    return db.query(SiteDado).all()
-
-@app.post("/site_dados")
-def inserir_site_dado(dado: dict, db: Session = Depends(get_db)):
-    novo = SiteDado(
-        composto_verde=dado["composto_verde"],
-        peso_verde_kg=dado["peso_verde_kg"],
-        composto_marrom=dado["composto_marrom"],
-        peso_marrom_kg=dado["peso_marrom_kg"],
-        temp_alvo_c=dado["temp_alvo_c"],
-        umidade_alvo_pct=dado["umidade_alvo_pct"],
-        data_registro=datetime.now()
-    )
+@sincrona(app.get("/site_dados", response_model=Pagina[SiteDadoSaida]))
+def listar_site_dados(
+    request: Request,
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: Session = Depends(get_db_leitura)
+):
+    """Responde 304 se If-None-Match trouxer o ETag atual (sem tocar no banco)."""
+    def gerar():
+        query = filtrar(db.query(SiteDado), SiteDado, id_teste, de, ate, device_id=device_id)
+        return pagina(query, SiteDado, cursor, limit)
+    return cache_respostas.responder(request, ["site_dados"], Pagina[SiteDadoSaida], gerar)
+
+@app.post("/site_dados", response_model=SiteDadoInserido)
+def inserir_site_dado(dado: SiteDadoEntrada, db: Session = Depends(get_db)):
+    novo = SiteDado(**dado.model_dump(), id_teste=frota.teste(dado.device_id), data_registro=datetime.now())
     db.add(novo)
     db.commit()
-    db.refresh(novo)
 
     # Roda ML-1 (toxicidade)
-    ml1_res = prever_toxicidade(novo, db)
+    with metricas.etapa("ml1"):
+        ml1_res = prever_toxicidade(novo, db)
 
     return {"inserido": novo, "ml1_resultado": ml1_res}
 
 # ----------------------
 # ROTAS DO ESP32
 # ----------------------
-@app.post("/esp32/leitura")
-def receber_leitura(dado: dict, db: Session = Depends(get_db)):
+def validar_leitura(dado: dict):
+    """
+    Valida com LeituraEntrada os dicts que não passam pelo corpo JSON das
+    rotas (binário decodificado, protocolo de linhas); 422 se inválido.
+    """
+    try:
+        LeituraEntrada.model_validate(dado)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=mensagem_validacao(e))
+
+def nova_leitura(dado: dict, agora: datetime, id_leitura: int = None) -> SensorLeitura:
+    """
+    Monta um SensorLeitura a partir do JSON enviado pelo ESP32. Resumos
+    agregados no ESP32 (amostras > 1) trazem as médias nos campos
+    principais e os blocos min/max/ultimo, guardados em resumo. A leitura
+    herda o teste em andamento na pilha da placa (PUT /dispositivos).
+    """
+    gases = dado.get("gases", {})
+    minimo, maximo = dado.get("min") or {}, dado.get("max") or {}
+    resumo = {k: dado[k] for k in ("min", "max", "ultimo") if dado.get(k)}
+    return SensorLeitura(
+        id=id_leitura,
+        id_teste=frota.teste(dado.get("device_id")),
+        temperatura=dado["temperatura"],
+        umidade=dado["umidade"],
+        o2=dado.get("o2", 0.0),
+        ph=dado.get("ph", 7.0),
+        gases=gases if isinstance(gases, str) else json.dumps(gases, ensure_ascii=False),
+        data_registro=agora,
+        amostras=dado.get("amostras", 1),
+        **{f"{c}_min": minimo.get(c) for c in CAMPOS_COM_EXTREMOS},
+        **{f"{c}_max": maximo.get(c) for c in CAMPOS_COM_EXTREMOS},
+        resumo=json.dumps(resumo, ensure_ascii=False) if resumo else None,
+        device_id=dado.get("device_id"),
+        seq=dado.get("seq"),
+    )
+
+def inferir_lote(novas: list, db: Session):
+    """
+    Roda ML-2 e ML-3 sobre leituras já gravadas (um forward pass por modelo).
+    A etapa ml3 inclui o commit dos ML3Resultado, também contado em "commit".
+    """
+    with metricas.etapa("ml2"):
+        ml2_res = prever_gases_lote(novas, db)
+    with metricas.etapa("ml3"):
+        ml3_res = validar_contexto_lote(novas, db)
+    difusor.publicar(novas, ml3_res)
+    return ml2_res, ml3_res
+
+# Reenvios com o mesmo (device_id, seq) são descartados antes de gravar ou inferir
+sequencias = JanelaSequencias(SessionLeitura)
+
+# Modo assíncrono (ECOVITA_INGESTAO_ASSINCRONA=1): as rotas respondem 202
+# e a thread gravadora faz o commit em grupo e chama inferir_lote depois.
+fila_ingestao = (FilaIngestao(SessionLocal, nova_leitura, inferir_lote, sequencias.gravar)
+                 if INGESTAO_ASSINCRONA else None)
+
+# Admissão (admissao.py): token bucket por dispositivo e teto global de
+# requisições gravando + inferindo; o excesso recebe 429 com Retry-After
+baldes = BaldesDispositivo()
+limite_inferencia = LimiteInferencia()
+
+def admitir(request: Request, dados: list):
+    """429 se a origem (device_id da leitura, senão o IP) passou da taxa; cada leitura gasta uma ficha."""
+    origem = next((d["device_id"] for d in dados if d.get("device_id")), None)
+    espera = baldes.admitir(origem or (request.client.host if request.client else ""), len(dados))
+    if espera:
+        raise HTTPException(status_code=429, detail="Limite de envio do dispositivo excedido",
+                            headers={"Retry-After": retry_after(espera)})
+
+def conferir_seqs(dados: list):
+    """
+    sequencias.repetidas; 409 se a placa recomeçou a numeração (regravada ou
+    índice da flash apagado), com a próxima seq livre em X-Proxima-Seq.
+    """
+    try:
+        return sequencias.repetidas(dados)
+    except SeqReiniciada as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"X-Proxima-Seq": str(e.proxima)})
+
+def sobrecarregada(dados: list):
+    # As seqs reservadas voltam para a janela: o reenvio não é repetição
+    sequencias.liberar([chave(dado) for dado in dados])
+    return HTTPException(status_code=429, detail="API sobrecarregada",
+                         headers={"Retry-After": retry_after(limite_inferencia.espera_s)})
+
+@contextmanager
+def vaga_inferencia(dados: list):
+    """Vaga no teto de gravação + ML-2/ML-3 (espera até ECOVITA_INFERENCIA_ESPERA_MS)."""
+    if not limite_inferencia.entrar():
+        raise sobrecarregada(dados)
+    try:
+        yield
+    finally:
+        limite_inferencia.sair()
+
+@asynccontextmanager
+async def vaga_inferencia_async(dados: list):
+    # Só vai para uma thread esperar se não houver vaga livre de imediato
+    if not limite_inferencia.tentar() and not await run_in_threadpool(limite_inferencia.entrar):
+        raise sobrecarregada(dados)
+    try:
+        yield
+    finally:
+        limite_inferencia.sair()
+
+def enfileirar(dados: list):
+    try:
+        ids = fila_ingestao.enfileirar_lote(dados)
+    except FilaCheia:
+        sequencias.liberar([chave(dado) for dado in dados])
+        raise HTTPException(status_code=503, detail="Fila de ingestão cheia", headers={"Retry-After": "1"})
+    return ids
+
+@sincrona(app.post("/esp32/leitura", response_model=LeituraProcessada))
+def receber_leitura(entrada: LeituraEntrada, request: Request, db: Session = Depends(get_db)):
     """
     Espera JSON do ESP32 no formato:
     {
@@ -60,24 +297,34 @@ def receber_leitura(dado: dict, db: Session = Depends(get_db)):
         "ph": 6.8,
         "gases": {"NH3":10,"CH4":3}
     }
+    No modo assíncrono responde 202 com o id reservado para a leitura.
+    Com device_id e seq, um reenvio do mesmo seq responde 200 com
+    duplicada=true, sem gravar nem rodar os modelos; uma seq muito abaixo
+    da última aceita (placa regravada) responde 409 com X-Proxima-Seq.
+    Acima da taxa do dispositivo ou com a API saturada, responde 429 com
+    Retry-After.
     """
-    nova = SensorLeitura(
-        temperatura=dado["temperatura"],
-        umidade=dado["umidade"],
-        o2=dado.get("o2", 0.0),
-        ph=dado.get("ph", 7.0),
-        gases=dado.get("gases", {}),
-        data_registro=datetime.now()
-    )
-    db.add(nova)
-    db.commit()
-    db.refresh(nova)
+    dado = entrada.para_dict()
+    admitir(request, [dado])
+    if conferir_seqs([dado])[0]:
+        return {"duplicada": True}
+    if fila_ingestao is not None:
+        id_leitura = enfileirar([dado])[0]
+        return JSONResponse(status_code=202, content={"id": id_leitura, "status": "enfileirada"})
 
-    # Roda ML-2 (perfil de gases)
-    ml2_res = prever_gases(nova, db)
+    with vaga_inferencia([dado]):
+        nova = nova_leitura(dado, datetime.now())
+        if not sequencias.gravar(db, [nova]):
+            return {"duplicada": True}
 
-    # Roda ML-3 (coerência de contexto)
-    ml3_res = validar_contexto(nova, ml2_res, db)
+        # Roda ML-2 (perfil de gases)
+        with metricas.etapa("ml2"):
+            ml2_res = prever_gases(nova, db)
+
+        # Roda ML-3 (coerência de contexto)
+        with metricas.etapa("ml3"):
+            ml3_res = validar_contexto(nova, db)
+    difusor.publicar([nova], [ml3_res])
 
     return {
         "leitura": nova,
@@ -85,13 +332,538 @@ def receber_leitura(dado: dict, db: Session = Depends(get_db)):
         "ml3_validacao": ml3_res
     }
 
-@app.get("/esp32/leitura")
-def listar_leituras(db: Session = Depends(get_db)):
-    return db.query(SensorLeitura).all()
+@sincrona(app.post("/esp32/leituras/lote", response_model=list[LeituraProcessada]))
+def receber_leituras_lote(entradas: list[LeituraEntrada], request: Request, db: Session = Depends(get_db)):
+    """
+    Recebe um array de leituras no mesmo formato de /esp32/leitura.
+    Todas são gravadas numa única transação e ML-2/ML-3 rodam uma vez
+    sobre o lote inteiro. Retorna um resultado por item, na mesma ordem
+    (duplicada=true para os reenvios de um (device_id, seq) já aceito).
+    No modo assíncrono responde 202 com os ids reservados.
+    """
+    dados = [entrada.para_dict() for entrada in entradas]
+    admitir(request, dados)
+    repetidas = conferir_seqs(dados)
+    novos = [dado for dado, repetida in zip(dados, repetidas) if not repetida]
+    if fila_ingestao is not None:
+        ids = enfileirar(novos)
+        return JSONResponse(status_code=202, content={
+            "ids": ids, "status": "enfileiradas", "duplicadas": len(dados) - len(novos)})
+
+    with vaga_inferencia(novos):
+        return processadas(repetidas, *gravar_lote(novos, db))
+
+def gravar_lote(dados: list, db: Session):
+    """
+    Grava as leituras (já filtradas por sequencias.repetidas) num único
+    commit e roda a inferência sobre o lote. As três listas seguem a ordem
+    de dados, com None nas leituras que outro worker já tinha gravado.
+    """
+    if not dados:
+        return [], [], []
+    agora = datetime.now()
+    novas = [nova_leitura(dado, agora) for dado in dados]
+    gravadas = sequencias.gravar(db, novas)
+    ml2_res, ml3_res = inferir_lote(gravadas, db)
+    return alinhar(novas, gravadas, ml2_res, ml3_res)
+
+def alinhar(novas, gravadas, ml2_res, ml3_res):
+    if len(gravadas) == len(novas):
+        return novas, ml2_res, ml3_res
+    resultados = {id(n): (n, r2, r3) for n, r2, r3 in zip(gravadas, ml2_res, ml3_res)}
+    return tuple(map(list, zip(*(resultados.get(id(n), (None, None, None)) for n in novas))))
+
+def processadas(repetidas, novas, ml2_res, ml3_res):
+    """Um LeituraProcessada por item recebido; as repetidas vêm só com duplicada=True."""
+    gravadas = iter(zip(novas, ml2_res, ml3_res))
+    saida = []
+    for repetida in repetidas:
+        nova, r2, r3 = (None, None, None) if repetida else next(gravadas)
+        saida.append({"leitura": nova, "ml2_resultado": r2, "ml3_validacao": r3, "duplicada": nova is None})
+    return saida
+
+async def corpo_binario(request: Request) -> list:
+    """Decodifica o corpo no formato de binario.py (lido no event loop; a rota segue síncrona)."""
+    tipo = request.headers.get("content-type", "").split(";")[0].strip()
+    if tipo != TIPO_BINARIO:
+        raise HTTPException(status_code=415, detail=f"Use Content-Type: {TIPO_BINARIO}")
+    try:
+        return decodificar(await request.body())
+    except FormatoInvalido as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@sincrona(app.post("/esp32/leituras/bin", response_model=IdsGravados))
+def receber_leituras_binario(request: Request, dados: list = Depends(corpo_binario), db: Session = Depends(get_db)):
+    """
+    Mesmo que /esp32/leituras/lote, com o corpo no formato binário compacto
+    (binario.py, ~51 bytes por leitura em vez de ~700). A resposta também é
+    curta: só os ids gravados e quantos registros eram reenvios (v3 traz
+    device_id e seq), para o ESP32 não gastar rádio baixando os resultados
+    dos modelos.
+    """
+    for dado in dados:
+        validar_leitura(dado)
+    admitir(request, dados)
+    novos = [dado for dado, repetida in zip(dados, conferir_seqs(dados)) if not repetida]
+    if fila_ingestao is not None:
+        ids = enfileirar(novos)
+        return JSONResponse(status_code=202, content={
+            "ids": ids, "status": "enfileiradas", "duplicadas": len(dados) - len(novos)})
+
+    with vaga_inferencia(novos):
+        ids = [nova.id for nova in gravar_lote(novos, db)[0] if nova is not None]
+    return {"ids": ids, "duplicadas": len(dados) - len(ids)}
+
+def gravar_linhas(dados: list):
+    """Lote do protocolo de linhas (ouvinte.py), já validado; roda numa thread."""
+    while True:
+        try:
+            marcas = sequencias.repetidas(dados)
+            break
+        except SeqReiniciada as e:
+            # Sem resposta por leitura: o lote segue sem as linhas da placa reiniciada
+            print("Protocolo de linhas:", e)
+            dados = [dado for dado in dados if dado.get("device_id") != e.device_id]
+    dados = [dado for dado, repetida in zip(dados, marcas) if not repetida]
+    if not dados:
+        return
+    if fila_ingestao is not None:
+        while True:
+            try:
+                return fila_ingestao.enfileirar_lote(dados)
+            except FilaCheia:
+                time.sleep(0.05)  # segura o ouvinte, e com ele os clientes TCP
+    db = SessionLocal()
+    try:
+        gravar_lote(dados, db)
+    finally:
+        db.close()
+
+# Ingestão por TCP/UDP (ECOVITA_LINHAS_TCP / ECOVITA_LINHAS_UDP), mesma validação e gravação das rotas
+ouvinte = OuvinteLinhas(validar_leitura, gravar_linhas)
+
+@app.get("/esp32/ingestao", response_class=RespostaORJSON)
+def status_ingestao():
+    """
+    Profundidade da fila e latência de commit do modo assíncrono e do
+    protocolo de linhas, os reenvios descartados pela idempotência e as
+    recusas (429) do controle de admissão.
+    """
+    linhas = {"linhas": ouvinte.status()} if ouvinte.ativo else {}
+    banco = {
+        "banco": "assincrono" if DB_ASSINCRONO else "sincrono",
+        "idempotencia": sequencias.status(),
+        "admissao": {"dispositivos": baldes.status(), "inferencia": limite_inferencia.status()},
+        "frota": frota.status(),
+    }
+    if fila_ingestao is None:
+        return {"modo": "sincrono", **banco, **linhas}
+    return {"modo": "assincrono", **banco, **fila_ingestao.status(), **linhas}
+
+# ----------------------
+# MÉTRICAS (Prometheus)
+# ----------------------
+def profundidade_filas():
+    filas = {"ml2": modelos.ml2, "ml3": modelos.ml3}
+    profundidade = {nome: m["lote"].fila.qsize() for nome, m in filas.items() if m}
+    if fila_ingestao is not None:
+        profundidade["ingestao"] = fila_ingestao.fila.qsize()
+    if ouvinte.fila is not None:
+        profundidade["linhas"] = ouvinte.fila.qsize()
+    return profundidade
+
+def lotes_modelos():
+    """Linhas por forward pass de ML-2/ML-3 (histograma do micro-lote)."""
+    lotes = {}
+    for nome, m in (("ml2", modelos.ml2), ("ml3", modelos.ml3)):
+        if m:
+            micro = m["lote"]
+            h = lotes[nome] = Histograma(FAIXAS_LOTE)
+            h.contagens, h.soma, h.total = list(micro.histograma_lote), micro.linhas, micro.forward_passes
+    return lotes
+
+metricas.medidor("fila_profundidade", "Itens aguardando em cada fila (ingestão, linhas, micro-lotes).",
+                 profundidade_filas, ("fila",))
+metricas.medidor("pool_conexoes", "Conexões dos pools do SQLAlchemy: em uso e tamanho do pool.",
+                 lambda: uso_pool({"escrita": engine, "leitura": engine_leitura,
+                                   "escrita_async": engine_async, "leitura_async": engine_leitura_async}),
+                 ("engine", "estado"))
+metricas.medidor("inferencia_em_uso", "Requisições gravando + rodando ML-2/ML-3 agora (admissao.py).",
+                 lambda: limite_inferencia.em_uso)
+metricas.medidor("modelo_lote_linhas", "Linhas por forward pass dos modelos.", lotes_modelos,
+                 ("modelo",), tipo="histogram")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def exportar_metricas():
+    """Formato texto do Prometheus; latências em segundos."""
+    return PlainTextResponse(metricas.texto(), media_type=TIPO_CONTEUDO)
+
+@sincrona(app.get("/esp32/leitura", response_model=Pagina[LeituraSaida]))
+def listar_leituras(
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    temperatura_min: Optional[float] = None,
+    temperatura_max: Optional[float] = None,
+    umidade_min: Optional[float] = None,
+    umidade_max: Optional[float] = None,
+    ph_min: Optional[float] = None,
+    ph_max: Optional[float] = None,
+    gas: Optional[str] = None,
+    gas_min: Optional[float] = None,
+    gas_max: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: Session = Depends(get_db_leitura)
+):
+    """
+    Lista leituras em ordem de (data_registro, id), uma página por vez.
+    Para a próxima página, repita a chamada com cursor=next_cursor.
+    device_id restringe a uma pilha.
+    gas/gas_min/gas_max filtram pela concentração de um composto (ex.: gas=H2S&gas_min=5).
+    """
+    filtros = dict(id_teste=id_teste, device_id=device_id, de=de, ate=ate, faixas={
+        "temperatura": (temperatura_min, temperatura_max),
+        "umidade": (umidade_min, umidade_max),
+        "ph": (ph_min, ph_max),
+    })
+    query = filtrar(db.query(SensorLeitura), SensorLeitura, **filtros)
+    filtro_gas = None
+    if gas is not None:
+        query = filtrar_gas(query, SensorLeitura, gas, gas_min, gas_max)
+        filtro_gas = (gas, gas_min, gas_max)
+    arquivadas = lambda depois: leituras_arquivadas(db, gas=filtro_gas, depois=depois, **filtros)
+    return pagina(query, SensorLeitura, cursor, limit, arquivadas)
+
+@app.get("/esp32/feed")
+async def feed_leituras(request: Request, device_id: Optional[str] = None):
+    """
+    Server-Sent Events: cada leitura gravada (com o resultado do ML-3) é
+    enviada como um evento "leitura". Se o cliente não acompanhar, os
+    eventos mais antigos são descartados e um evento "perdidas" avisa.
+    Com device_id, só as leituras dessa pilha.
+    """
+    assinante = difusor.assinar(device_id)
+
+    async def eventos():
+        perdidas = 0
+        try:
+            while not await request.is_disconnected():
+                try:
+                    mensagem = await asyncio.wait_for(assinante.fila.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # mantém a conexão viva em proxies
+                    continue
+                if assinante.perdidas != perdidas:
+                    perdidas = assinante.perdidas
+                    yield f"event: perdidas\ndata: {perdidas}\n\n"
+                yield f"event: leitura\ndata: {mensagem}\n\n"
+        finally:
+            difusor.cancelar(assinante)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/esp32/feed/status", response_class=RespostaORJSON)
+def status_feed():
+    return difusor.status()
+
+@app.get("/esp32/leitura/agregado", response_class=RespostaORJSON)
+def agregado_leituras(
+    bucket: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    de: Optional[datetime] = Query(None, alias="from"),
+    ate: Optional[datetime] = Query(None, alias="to"),
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    fonte: str = Query("rollup", pattern="^(rollup|bruto)$"),
+    db: Session = Depends(get_db_leitura)
+):
+    """
+    Séries por minuto/hora/dia de temperatura, umidade, pH e COVs (soma dos ppm).
+    fonte=rollup lê as tabelas de rollup (O(intervalos)); fonte=bruto varre
+    sensor_leituras e respeita from/to exatos.
+    """
+    agregar = agregar_rollups if fonte == "rollup" else agregar_leituras
+    return agregar(db, bucket, id_teste, de, ate, device_id)
+
+@app.get("/esp32/gases/agregado", response_class=RespostaORJSON)
+def agregado_gases(
+    bucket: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    gas: Optional[list[str]] = Query(None),
+    de: Optional[datetime] = Query(None, alias="from"),
+    ate: Optional[datetime] = Query(None, alias="to"),
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    db: Session = Depends(get_db_leitura)
+):
+    """
+    Séries de ppm por composto (count/min/max/mean) por minuto/hora/dia.
+    Repita gas para escolher os compostos (ex.: gas=H2S&gas=Amônia); sem gas, todos.
+    """
+    return agregar_gases(db, bucket, gas, id_teste, de, ate, device_id)
+
+@app.get("/esp32/leitura/export")
+def exportar_historico(
+    formato: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    compactar: bool = Query(False, alias="gzip"),
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None
+):
+    """
+    Exporta o histórico de leituras em NDJSON ou CSV (opcionalmente .gz),
+    em ordem de (data_registro, id), enviando os blocos à medida que saem
+    do SQLite e do arquivo frio.
+    """
+    def gerar():
+        # Sessão própria: o gerador roda depois que a rota já retornou
+        db = SessionLeitura()
+        try:
+            colunas = [getattr(SensorLeitura, c) for c in COLUNAS_EXPORTACAO]
+            query = filtrar(db.query(*colunas), SensorLeitura, id_teste, de, ate, device_id=device_id).order_by(
+                SensorLeitura.data_registro, SensorLeitura.id)
+            arquivadas = leituras_arquivadas(db, id_teste, de, ate, colunas=COLUNAS_EXPORTACAO, device_id=device_id)
+            gz = zlib.compressobj(wbits=31) if compactar else None  # wbits=31 -> formato gzip
+            for bloco in exportar_leituras(query, formato, arquivadas):
+                dados = bloco.encode("utf-8")
+                yield gz.compress(dados) + gz.flush(zlib.Z_SYNC_FLUSH) if gz else dados
+            if gz:
+                yield gz.flush()
+        finally:
+            db.close()
+
+    nome = f"sensor_leituras.{formato}" + (".gz" if compactar else "")
+    tipo = "application/gzip" if compactar else ("text/csv" if formato == "csv" else "application/x-ndjson")
+    return StreamingResponse(gerar(), media_type=tipo,
+                             headers={"Content-Disposition": f'attachment; filename="{nome}"'})
+
+# ----------------------
+# ROTAS DA FROTA (uma placa por pilha)
+# ----------------------
+@app.get("/dispositivos", response_model=list[DispositivoSaida])
+def listar_dispositivos(id_teste: Optional[int] = None, db: Session = Depends(get_db_leitura)):
+    """Placas cadastradas (ou vistas numa leitura), em ordem de device_id; id_teste filtra as pilhas do teste."""
+    query = db.query(Dispositivo)
+    if id_teste is not None:
+        query = query.filter(Dispositivo.id_teste == id_teste)
+    dispositivos = query.order_by(Dispositivo.device_id).all()
+    db.close()  # mesmo motivo de pagina()
+    return dispositivos
+
+@app.get("/dispositivos/{device_id}", response_model=PainelDispositivo)
+def painel_dispositivo(device_id: str = Path(max_length=64), db: Session = Depends(get_db_leitura)):
+    """
+    Cadastro, última leitura e último resultado do ML-3 de uma pilha, cada
+    um buscado pela chave. Séries e histórico: as rotas de leituras,
+    agregados, feed e exportação aceitam device_id.
+    """
+    dispositivo = db.get(Dispositivo, device_id)
+    if dispositivo is None:
+        db.close()
+        raise HTTPException(status_code=404, detail="Dispositivo não encontrado")
+    ultima = db.get(SensorLeitura, dispositivo.ultima_leitura_id) if dispositivo.ultima_leitura_id else None
+    ml3 = db.scalars(
+        select(ML3Resultado).where(ML3Resultado.device_id == device_id)
+        .order_by(ML3Resultado.data_analise.desc()).limit(1)
+    ).first()
+    db.close()
+    return {"dispositivo": dispositivo, "ultima_leitura": ultima, "ultimo_ml3": ml3}
+
+@app.put("/dispositivos/{device_id}", response_model=DispositivoSaida)
+def cadastrar_dispositivo(
+    dado: DispositivoEntrada,
+    device_id: str = Path(min_length=1, max_length=64),
+    db: Session = Depends(get_db)
+):
+    """
+    Cadastra ou atualiza uma pilha; só os campos enviados mudam. O
+    id_teste vale para as leituras gravadas daqui em diante (as já
+    gravadas ficam no teste que tinham).
+    """
+    campos = dado.model_dump(exclude_unset=True)
+    if campos.get("id_teste") is not None and db.get(Teste, campos["id_teste"]) is None:
+        raise HTTPException(status_code=404, detail="Teste não encontrado")
+    dispositivo = db.get(Dispositivo, device_id)
+    if dispositivo is None:
+        dispositivo = Dispositivo(device_id=device_id, criado_em=datetime.now(), leituras=0)
+        db.add(dispositivo)
+    for campo, valor in campos.items():
+        setattr(dispositivo, campo, valor)
+    db.commit()
+    frota.invalidar()
+    return dispositivo
 
 # ----------------------
 # ROTAS DE RESULTADOS ML
 # ----------------------
-@app.get("/ml_resultados")
-def listar_resultados(db: Session = Depends(get_db)):
-    return db.query(MLResultado).all()
+@app.get("/modelos", response_class=RespostaORJSON)
+def status_modelos():
+    """Quais modelos estão carregados em memória e quanto levaram para carregar."""
+    return modelos.status()
+
+@sincrona(app.get("/ml_resultados", response_model=Pagina[MLResultadoSaida]))
+def listar_resultados(
+    request: Request,
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    toxicidade: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: Session = Depends(get_db_leitura)
+):
+    """Responde 304 se If-None-Match trouxer o ETag atual (sem tocar no banco)."""
+    def gerar():
+        query = filtrar(db.query(MLResultado), MLResultado, id_teste, de, ate, device_id=device_id)
+        if toxicidade is not None:
+            query = query.filter(MLResultado.toxicidade_geral == toxicidade)
+        return pagina(query, MLResultado, cursor, limit)
+    return cache_respostas.responder(request, ["ml_resultados"], Pagina[MLResultadoSaida], gerar)
+
+@app.get("/cache/status", response_class=RespostaORJSON)
+def status_cache():
+    return cache_respostas.status()
+
+# ----------------------
+# ROTAS ASSÍNCRONAS (ECOVITA_DB_ASSINCRONO=1)
+# ----------------------
+# A espera pelo SQLite (commit, SELECT da página) libera o event loop em vez
+# de prender um dos ~40 workers do threadpool; ML-2/ML-3 são CPU e esperam
+# o micro-lote, então continuam numa thread com uma sessão síncrona.
+def inferir_gravadas(novas: list):
+    db = SessionLocal()
+    try:
+        return inferir_lote(novas, db)
+    finally:
+        db.close()
+
+async def gravar_lote_async(dados: list, db: AsyncSession):
+    if not dados:
+        return [], [], []
+    agora = datetime.now()
+    novas = [nova_leitura(dado, agora) for dado in dados]
+    gravadas = await db.run_sync(sequencias.gravar, novas)
+    ml2_res, ml3_res = await run_in_threadpool(inferir_gravadas, gravadas)
+    return alinhar(novas, gravadas, ml2_res, ml3_res)
+
+@assincrona(app.post("/esp32/leitura", response_model=LeituraProcessada))
+async def receber_leitura_async(entrada: LeituraEntrada, request: Request, db: AsyncSession = Depends(get_db_async)):
+    """Mesmo contrato de receber_leitura."""
+    dado = entrada.para_dict()
+    admitir(request, [dado])
+    if conferir_seqs([dado])[0]:
+        return {"duplicada": True}
+    if fila_ingestao is not None:
+        id_leitura = enfileirar([dado])[0]
+        return JSONResponse(status_code=202, content={"id": id_leitura, "status": "enfileirada"})
+
+    async with vaga_inferencia_async([dado]):
+        return processadas([False], *await gravar_lote_async([dado], db))[0]
+
+@assincrona(app.post("/esp32/leituras/lote", response_model=list[LeituraProcessada]))
+async def receber_leituras_lote_async(
+    entradas: list[LeituraEntrada], request: Request, db: AsyncSession = Depends(get_db_async)
+):
+    """Mesmo contrato de receber_leituras_lote."""
+    dados = [entrada.para_dict() for entrada in entradas]
+    admitir(request, dados)
+    repetidas = conferir_seqs(dados)
+    novos = [dado for dado, repetida in zip(dados, repetidas) if not repetida]
+    if fila_ingestao is not None:
+        ids = enfileirar(novos)
+        return JSONResponse(status_code=202, content={
+            "ids": ids, "status": "enfileiradas", "duplicadas": len(dados) - len(novos)})
+
+    async with vaga_inferencia_async(novos):
+        return processadas(repetidas, *await gravar_lote_async(novos, db))
+
+@assincrona(app.post("/esp32/leituras/bin", response_model=IdsGravados))
+async def receber_leituras_binario_async(
+    request: Request, dados: list = Depends(corpo_binario), db: AsyncSession = Depends(get_db_async)
+):
+    """Mesmo contrato de receber_leituras_binario."""
+    for dado in dados:
+        validar_leitura(dado)
+    admitir(request, dados)
+    novos = [dado for dado, repetida in zip(dados, conferir_seqs(dados)) if not repetida]
+    if fila_ingestao is not None:
+        ids = enfileirar(novos)
+        return JSONResponse(status_code=202, content={
+            "ids": ids, "status": "enfileiradas", "duplicadas": len(dados) - len(novos)})
+
+    async with vaga_inferencia_async(novos):
+        ids = [nova.id for nova in (await gravar_lote_async(novos, db))[0] if nova is not None]
+    return {"ids": ids, "duplicadas": len(dados) - len(ids)}
+
+@assincrona(app.get("/esp32/leitura", response_model=Pagina[LeituraSaida]))
+async def listar_leituras_async(
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    temperatura_min: Optional[float] = None,
+    temperatura_max: Optional[float] = None,
+    umidade_min: Optional[float] = None,
+    umidade_max: Optional[float] = None,
+    ph_min: Optional[float] = None,
+    ph_max: Optional[float] = None,
+    gas: Optional[str] = None,
+    gas_min: Optional[float] = None,
+    gas_max: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: AsyncSession = Depends(get_db_leitura_async)
+):
+    """Mesmo contrato de listar_leituras."""
+    filtros = dict(id_teste=id_teste, device_id=device_id, de=de, ate=ate, faixas={
+        "temperatura": (temperatura_min, temperatura_max),
+        "umidade": (umidade_min, umidade_max),
+        "ph": (ph_min, ph_max),
+    })
+    consulta = filtrar(select(SensorLeitura), SensorLeitura, **filtros)
+    filtro_gas = None
+    if gas is not None:
+        consulta = filtrar_gas(consulta, SensorLeitura, gas, gas_min, gas_max)
+        filtro_gas = (gas, gas_min, gas_max)
+    arquivadas = lambda sessao, depois: leituras_arquivadas(sessao, gas=filtro_gas, depois=depois, **filtros)
+    return await pagina_async(db, consulta, SensorLeitura, cursor, limit, arquivadas)
+
+@assincrona(app.get("/site_dados", response_model=Pagina[SiteDadoSaida]))
+async def listar_site_dados_async(
+    request: Request,
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: AsyncSession = Depends(get_db_leitura_async)
+):
+    """Mesmo contrato de listar_site_dados."""
+    async def gerar():
+        consulta = filtrar(select(SiteDado), SiteDado, id_teste, de, ate, device_id=device_id)
+        return await pagina_async(db, consulta, SiteDado, cursor, limit)
+    return await cache_respostas.responder_async(request, ["site_dados"], Pagina[SiteDadoSaida], gerar)
+
+@assincrona(app.get("/ml_resultados", response_model=Pagina[MLResultadoSaida]))
+async def listar_resultados_async(
+    request: Request,
+    id_teste: Optional[int] = None,
+    device_id: Optional[str] = None,
+    de: Optional[datetime] = None,
+    ate: Optional[datetime] = None,
+    toxicidade: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(LIMITE_PADRAO, ge=1, le=LIMITE_MAX),
+    db: AsyncSession = Depends(get_db_leitura_async)
+):
+    """Mesmo contrato de listar_resultados."""
+    async def gerar():
+        consulta = filtrar(select(MLResultado), MLResultado, id_teste, de, ate, device_id=device_id)
+        if toxicidade is not None:
+            consulta = consulta.filter(MLResultado.toxicidade_geral == toxicidade)
+        return await pagina_async(db, consulta, MLResultado, cursor, limit)
+    return await cache_respostas.responder_async(request, ["ml_resultados"], Pagina[MLResultadoSaida], gerar)
@@ -0,0 +1,358 @@
+# arquivo.py
+# Arquivo frio das leituras do ESP32.
+# Leituras antigas (mais de ECOVITA_ARQUIVO_DIAS dias) ou de testes
+# concluídos saem do SQLite para arquivos Parquet compactados, um por
+# teste e mês. As rotas de listagem, exportação e agregação leem os dois
+# níveis; o manifesto em arquivo_lotes diz quais arquivos abrir.
+# Dependência: pyarrow (só é importado quando existe arquivo frio)
+# Uso: python arquivo.py --dias 90 [--sem-concluidos] [--vacuum]
+
+import argparse
+import heapq
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, Float, Integer, bindparam, text
+
+from bd import ArquivoLote, SensorLeitura, CAMPOS_COM_EXTREMOS, engine, init_db
+
+# -------------------------
+# Configurações (variáveis de ambiente)
+# -------------------------
+ARQUIVO_DIR = os.getenv("ECOVITA_ARQUIVO_DIR", "arquivo")
+IDADE_DIAS = int(os.getenv("ECOVITA_ARQUIVO_DIAS", "90"))
+COMPRESSAO = "zstd"
+
+# Todas as colunas de sensor_leituras + covs (soma dos ppm, para as agregações)
+COLUNAS_SENSOR = [c.name for c in SensorLeitura.__table__.columns]
+COLUNAS_LEITURA = COLUNAS_SENSOR + ["covs"]
+COLUNAS_GAS = ["id_leitura", "gas", "ppm", "data_registro"]
+BLOCO_EXCLUSAO = 500   # ids por DELETE ... IN (...)
+
+
+def _esquemas():
+    # Derivado do modelo: colunas novas de sensor_leituras entram sozinhas, e
+    # arquivos antigos são lidos com elas nulas
+    import pyarrow as pa
+
+    def tipo(coluna):
+        if isinstance(coluna.type, Integer):
+            return pa.int64()
+        if isinstance(coluna.type, Float):
+            return pa.float64()
+        if isinstance(coluna.type, DateTime):
+            return pa.timestamp("us")
+        return pa.string()
+
+    leituras = pa.schema([(c.name, tipo(c)) for c in SensorLeitura.__table__.columns] + [("covs", pa.float64())])
+    gases = pa.schema([
+        ("id_leitura", pa.int64()), ("gas", pa.string()), ("ppm", pa.float64()), ("data_registro", pa.timestamp("us")),
+    ])
+    return leituras, gases
+
+
+# -------------------------
+# Arquivamento
+# -------------------------
+# O corte por idade cai sempre à meia-noite e um teste concluído vai
+# inteiro, então nenhum intervalo de rollup (minuto/hora/dia) de um teste
+# fica dividido entre os dois níveis. A leitura de maior id nunca sai do
+# SQLite: sem ela o rowid (e a reserva de ids da fila) voltaria a números
+# que já estão no arquivo.
+CONDICAO_ARQUIVO = """
+    ({criterio}) AND s.id < (SELECT MAX(id) FROM sensor_leituras)
+"""
+CRITERIO_CONCLUIDOS = "s.id_teste IN (SELECT id FROM testes WHERE status = 'concluído')"
+
+SQL_GRUPOS = """
+SELECT DISTINCT s.id_teste, substr(s.data_registro, 1, 7) AS mes
+  FROM sensor_leituras AS s
+ WHERE {condicao}
+"""
+
+SQL_LEITURAS_GRUPO = """
+SELECT {colunas},
+       (SELECT SUM(g.ppm) FROM leitura_gases AS g WHERE g.id_leitura = s.id) AS covs
+  FROM sensor_leituras AS s
+ WHERE {condicao} AND s.id_teste IS :id_teste AND substr(s.data_registro, 1, 7) = :mes
+ ORDER BY s.data_registro, s.id
+"""
+
+SQL_GASES_GRUPO = """
+SELECT g.id_leitura, gs.nome, g.ppm, s.data_registro
+  FROM leitura_gases AS g
+  JOIN gases AS gs ON gs.id = g.id_gas
+  JOIN sensor_leituras AS s ON s.id = g.id_leitura
+ WHERE g.id_leitura IN :ids
+ ORDER BY s.data_registro, s.id, gs.nome
+"""
+
+# O SQLite roda sem PRAGMA foreign_keys: o ondelete="CASCADE" de
+# leitura_gases e ml3_resultados é feito aqui, na mesma transação
+SQL_EXCLUSOES = (
+    "DELETE FROM leitura_gases WHERE id_leitura IN :ids",
+    "DELETE FROM ml3_resultados WHERE id_leitura IN :ids",
+    "DELETE FROM sensor_leituras WHERE id IN :ids",
+)
+
+
+def _data(valor):
+    return datetime.fromisoformat(valor) if isinstance(valor, str) else valor
+
+def _gravar_parquet(caminho, linhas, colunas, esquema):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    destino = os.path.join(ARQUIVO_DIR, caminho)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tabela = pa.Table.from_pydict({c: list(v) for c, v in zip(colunas, zip(*linhas))} if linhas
+                                  else {c: [] for c in colunas}, schema=esquema)
+    temporario = destino + ".tmp"
+    pq.write_table(tabela, temporario, compression=COMPRESSAO)
+    os.replace(temporario, destino)
+
+def _arquivar_grupo(conexao, condicao, params, id_teste, mes):
+    """Grava os dois arquivos do grupo (teste, mês), registra no manifesto e apaga do SQLite."""
+    esquema_leituras, esquema_gases = _esquemas()
+    i_data = COLUNAS_LEITURA.index("data_registro")
+    sql = SQL_LEITURAS_GRUPO.format(condicao=condicao, colunas=", ".join(f"s.{c}" for c in COLUNAS_SENSOR))
+    linhas = [
+        (*l[:i_data], _data(l[i_data]), *l[i_data + 1:])
+        for l in conexao.execute(text(sql), {**params, "id_teste": id_teste, "mes": mes})
+    ]
+    if not linhas:
+        return None
+    ids = [l[0] for l in linhas]
+    gases = [
+        (g[0], g[1], g[2], _data(g[3]))
+        for bloco in _blocos_ids(ids)
+        for g in conexao.execute(text(SQL_GASES_GRUPO).bindparams(bindparam("ids", expanding=True)), {"ids": bloco})
+    ]
+
+    pasta = os.path.join(f"teste={id_teste or 0}", f"mes={mes}")
+    nome = f"{min(ids)}-{max(ids)}.parquet"
+    lote = ArquivoLote(
+        id_teste=id_teste, mes=mes,
+        caminho=os.path.join("leituras", pasta, nome), caminho_gases=os.path.join("gases", pasta, nome),
+        id_min=min(ids), id_max=max(ids), data_min=linhas[0][i_data], data_max=linhas[-1][i_data],
+        linhas=len(linhas), arquivado_em=datetime.now(),
+    )
+    _gravar_parquet(lote.caminho, linhas, COLUNAS_LEITURA, esquema_leituras)
+    _gravar_parquet(lote.caminho_gases, gases, COLUNAS_GAS, esquema_gases)
+
+    tabela = ArquivoLote.__table__
+    conexao.execute(tabela.insert().values({c.name: getattr(lote, c.name) for c in tabela.columns if c.name != "id"}))
+    for bloco in _blocos_ids(ids):
+        for sql in SQL_EXCLUSOES:
+            conexao.execute(text(sql).bindparams(bindparam("ids", expanding=True)), {"ids": bloco})
+    return lote
+
+def _blocos_ids(ids):
+    for i in range(0, len(ids), BLOCO_EXCLUSAO):
+        yield ids[i:i + BLOCO_EXCLUSAO]
+
+def arquivar(dias=IDADE_DIAS, concluidos=True, agora=None, engine_alvo=None):
+    """
+    Move para o Parquet as leituras anteriores à meia-noite de dias atrás e,
+    com concluidos=True, todas as dos testes concluídos. Cada (teste, mês)
+    é um commit: os arquivos são gravados antes das linhas saírem do SQLite.
+    Retorna a lista de ArquivoLote criados.
+    """
+    corte = (agora or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=dias)
+    criterio = "s.data_registro < :corte" + (f" OR {CRITERIO_CONCLUIDOS}" if concluidos else "")
+    condicao = CONDICAO_ARQUIVO.format(criterio=criterio)
+    params = {"corte": corte.isoformat(" ")}
+
+    alvo = engine_alvo or engine
+    with alvo.connect() as conexao:
+        grupos = conexao.execute(text(SQL_GRUPOS.format(condicao=condicao)), params).all()
+    lotes = []
+    for id_teste, mes in grupos:
+        with alvo.begin() as conexao:
+            lote = _arquivar_grupo(conexao, condicao, params, id_teste, mes)
+        if lote is not None:
+            lotes.append(lote)
+    return lotes
+
+
+# -------------------------
+# Leitura do arquivo frio
+# -------------------------
+def lotes_do_filtro(db, id_teste=None, de=None, ate=None):
+    """Entradas do manifesto que podem ter leituras no filtro (poda por teste e datas)."""
+    query = db.query(ArquivoLote)
+    if id_teste is not None:
+        query = query.filter(ArquivoLote.id_teste == id_teste)
+    if de is not None:
+        query = query.filter(ArquivoLote.data_max >= de)
+    if ate is not None:
+        query = query.filter(ArquivoLote.data_min < ate)
+    return query.order_by(ArquivoLote.data_min).all()
+
+def _filtro(de=None, ate=None, faixas=None, depois=None, device_id=None):
+    """Expressão do pyarrow equivalente a consultas.filtrar (+ cursor keyset)."""
+    import pyarrow.compute as pc
+
+    filtro = pc.scalar(True)
+    data = pc.field("data_registro")
+    if device_id is not None:
+        # O manifesto é por (teste, mês): a pilha só é filtrada dentro do arquivo
+        filtro &= pc.field("device_id") == device_id
+    if de is not None:
+        filtro &= data >= de
+    if ate is not None:
+        filtro &= data < ate
+    for coluna, (minimo, maximo) in (faixas or {}).items():
+        if minimo is not None:
+            filtro &= pc.field(coluna) >= minimo
+        if maximo is not None:
+            filtro &= pc.field(coluna) <= maximo
+    if depois is not None:
+        data_cursor, id_cursor = depois
+        filtro &= (data > data_cursor) | ((data == data_cursor) & (pc.field("id") > id_cursor))
+    return filtro
+
+def _dataset(caminhos, esquema=None):
+    import pyarrow.dataset as ds
+    return ds.dataset([os.path.join(ARQUIVO_DIR, c) for c in caminhos], schema=esquema, format="parquet")
+
+def _colunas(colunas):
+    # Arquivos anteriores ao resumo do ESP32 não têm amostras: vale 1
+    import pyarrow.compute as pc
+    return {
+        c: pc.coalesce(pc.field(c), pc.scalar(1)) if c == "amostras" else pc.field(c)
+        for c in colunas
+    }
+
+def _ids_com_gas(lote, gas, minimo=None, maximo=None):
+    import pyarrow.compute as pc
+
+    filtro = pc.field("gas") == gas
+    if minimo is not None:
+        filtro &= pc.field("ppm") >= minimo
+    if maximo is not None:
+        filtro &= pc.field("ppm") <= maximo
+    return _dataset([lote.caminho_gases]).to_table(columns=["id_leitura"], filter=filtro).column("id_leitura")
+
+def _linhas_lote(lote, filtro, colunas):
+    # use_threads=False mantém a ordem do arquivo, (data_registro, id)
+    scanner = _dataset([lote.caminho], _esquemas()[0]).scanner(
+        columns=_colunas(colunas), filter=filtro, use_threads=False)
+    for bloco in scanner.to_batches():
+        yield from zip(*(bloco.column(c).to_pylist() for c in colunas))
+
+def leituras_arquivadas(db, id_teste=None, de=None, ate=None, faixas=None, gas=None, depois=None,
+                        colunas=COLUNAS_SENSOR, device_id=None):
+    """
+    Leituras arquivadas que passam nos filtros, como tuplas de colunas, em
+    ordem de (data_registro, id). gas = (composto, mínimo, máximo);
+    depois = (data_registro, id) do cursor. Os arquivos só são lidos à
+    medida que o iterador é consumido.
+    """
+    lotes = lotes_do_filtro(db, id_teste, de, ate)
+    if depois is not None:
+        lotes = [l for l in lotes if l.data_max >= depois[0]]
+    if not lotes:
+        return iter(())
+
+    import pyarrow.compute as pc
+
+    filtro = _filtro(de, ate, faixas, depois, device_id)
+    fontes = []
+    for lote in lotes:
+        filtro_lote = filtro
+        if gas is not None:
+            filtro_lote &= pc.field("id").isin(_ids_com_gas(lote, *gas))
+        fontes.append(_linhas_lote(lote, filtro_lote, colunas))
+    i_data, i_id = colunas.index("data_registro"), colunas.index("id")
+    return heapq.merge(*fontes, key=lambda linha: (linha[i_data], linha[i_id]))
+
+def _com_bucket(tabela, tamanho):
+    import pyarrow.compute as pc
+    texto = pc.strftime(tabela["data_registro"], format="%Y-%m-%d %H:%M:%S")
+    return tabela.append_column("bucket", pc.utf8_slice_codeunits(texto, 0, tamanho))
+
+def agregar_arquivadas(db, tamanho, campos, id_teste=None, de=None, ate=None, device_id=None):
+    """
+    Por intervalo (prefixo de data_registro com tamanho caracteres): n,
+    ultimo_id e {campo}_min/_max/_soma/_n/_last, calculados no pyarrow com
+    as mesmas regras de consultas.agregar_leituras (amostras e extremos).
+    """
+    lotes = lotes_do_filtro(db, id_teste, de, ate)
+    if not lotes:
+        return []
+    import pyarrow.compute as pc
+
+    extremos = [c for c in campos if c in CAMPOS_COM_EXTREMOS]
+    colunas = _colunas(["id", "data_registro", "amostras", *campos])
+    for c in extremos:
+        colunas[f"{c}_min"] = pc.coalesce(pc.field(f"{c}_min"), pc.field(c))
+        colunas[f"{c}_max"] = pc.coalesce(pc.field(f"{c}_max"), pc.field(c))
+    tabela = _dataset([l.caminho for l in lotes], _esquemas()[0]).to_table(
+        columns=colunas, filter=_filtro(de, ate, device_id=device_id))
+    for c in campos:
+        peso = pc.if_else(pc.is_valid(tabela[c]), tabela["amostras"], None)
+        tabela = tabela.append_column(f"{c}_soma", pc.multiply(tabela[c], tabela["amostras"]))
+        tabela = tabela.append_column(f"{c}_n", peso)
+    tabela = _com_bucket(tabela, tamanho).sort_by("id")
+    ultimo = pc.ScalarAggregateOptions(skip_nulls=False)
+    agregados = [("amostras", "sum"), ("id", "max")]
+    for c in campos:
+        minimo, maximo = (f"{c}_min", f"{c}_max") if c in extremos else (c, c)
+        agregados += [(minimo, "min"), (maximo, "max"), (f"{c}_soma", "sum"), (f"{c}_n", "sum"), (c, "last", ultimo)]
+    # use_threads=False: "last" respeita a ordem por id
+    linhas = tabela.group_by("bucket", use_threads=False).aggregate(agregados).to_pylist()
+    saida = []
+    for l in linhas:
+        linha = {"bucket": l["bucket"], "n": l["amostras_sum"], "ultimo_id": l["id_max"]}
+        for c in campos:
+            minimo, maximo = (f"{c}_min", f"{c}_max") if c in extremos else (c, c)
+            linha[f"{c}_min"] = l[f"{minimo}_min"]
+            linha[f"{c}_max"] = l[f"{maximo}_max"]
+            linha[f"{c}_soma"] = l[f"{c}_soma_sum"]
+            linha[f"{c}_n"] = l[f"{c}_n_sum"] or 0
+            linha[f"{c}_last"] = l[f"{c}_last"]
+        saida.append(linha)
+    return saida
+
+def agregar_gases_arquivados(db, tamanho, gases=None, id_teste=None, de=None, ate=None, device_id=None):
+    """Por (composto, intervalo): n e ppm_min/_max/_soma dos arquivos de gases."""
+    lotes = lotes_do_filtro(db, id_teste, de, ate)
+    if not lotes:
+        return []
+    import pyarrow.compute as pc
+
+    filtro = _filtro(de, ate)
+    if gases:
+        filtro &= pc.field("gas").isin(list(gases))
+    if device_id is not None:
+        # Os arquivos de gases não têm device_id: ids das leituras da pilha
+        ids = _dataset([l.caminho for l in lotes], _esquemas()[0]).to_table(
+            columns=["id"], filter=_filtro(de, ate, device_id=device_id)).column("id")
+        filtro &= pc.field("id_leitura").isin(ids)
+    tabela = _dataset([l.caminho_gases for l in lotes]).to_table(columns=["gas", "ppm", "data_registro"], filter=filtro)
+    linhas = _com_bucket(tabela, tamanho).group_by(["gas", "bucket"]).aggregate(
+        [("ppm", "count"), ("ppm", "min"), ("ppm", "max"), ("ppm", "sum")]).to_pylist()
+    return [
+        {"gas": l["gas"], "bucket": l["bucket"], "n": l["ppm_count"],
+         "ppm_min": l["ppm_min"], "ppm_max": l["ppm_max"], "ppm_soma": l["ppm_sum"]}
+        for l in linhas
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move leituras antigas do SQLite para o arquivo Parquet")
+    parser.add_argument("--dias", type=int, default=IDADE_DIAS, help="idade mínima (dias) para arquivar")
+    parser.add_argument("--sem-concluidos", action="store_true", help="não arquivar testes concluídos mais novos")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM no SQLite ao final")
+    args = parser.parse_args()
+
+    init_db()
+    lotes = arquivar(args.dias, concluidos=not args.sem_concluidos)
+    for lote in lotes:
+        print(f"📦 {lote.caminho}: {lote.linhas} leituras ({lote.data_min} – {lote.data_max})")
+    print(f"✅ {sum(l.linhas for l in lotes)} leituras arquivadas em {len(lotes)} arquivo(s)")
+    if args.vacuum and lotes:
+        with engine.connect() as conexao:
+            conexao.exec_driver_sql("VACUUM")
+        print("✅ VACUUM concluído")
@@ -1,16 +1,104 @@
 from sqlalchemy import (
     create_engine, Column, Integer, String, Float, Text,
-    Date, DateTime, Enum, ForeignKey
+    Date, DateTime, Enum, ForeignKey, Index, event, func, case, inspect, text
 )
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base, declared_attr, relationship, sessionmaker, Session
+from sqlalchemy.schema import CreateIndex, CreateTable
 from datetime import datetime, date
+from functools import lru_cache
+import json
+import os
+import sys
 
 # ==============================
 # Configuração do Banco
 # ==============================
-engine = create_engine("sqlite:///ecovita.db", echo=False)
+DB_ARQUIVO = os.getenv("ECOVITA_DB", "ecovita.db")
+PERFIL_SQLITE = os.getenv("ECOVITA_SQLITE_PERFIL", "wal")
+LEITORES_POOL = int(os.getenv("ECOVITA_LEITORES_POOL", "4"))
+# Rotas de ingestão e listagem async sobre aiosqlite (pip install aiosqlite)
+DB_ASSINCRONO = os.getenv("ECOVITA_DB_ASSINCRONO", "0") == "1"
+
+# Perfis de armazenamento. "padrao" é o comportamento original
+# (rollback journal, uma engine só); "wal" separa leitura e escrita.
+PERFIS_SQLITE = {
+    "padrao": {},
+    "wal": {
+        "journal_mode": "WAL",      # leitores não bloqueiam o escritor (nem o contrário)
+        "synchronous": "NORMAL",    # fsync só no checkpoint; seguro contra corrupção em WAL
+        "mmap_size": 268435456,     # 256 MiB de leitura via mmap
+        "cache_size": -65536,       # negativo = KiB -> 64 MiB de page cache por conexão
+        "busy_timeout": 5000,       # ms esperando lock antes de "database is locked"
+        "temp_store": "MEMORY",
+    },
+}
+
+def _aplicar_pragmas(engine, pragmas, somente_leitura=False):
+    @event.listens_for(engine, "connect")
+    def _pragmas(conexao_dbapi, _):
+        cursor = conexao_dbapi.cursor()
+        for nome, valor in pragmas.items():
+            if somente_leitura and nome == "journal_mode":
+                continue  # o modo do arquivo é definido pela conexão de escrita
+            cursor.execute(f"PRAGMA {nome}={valor}")
+        if somente_leitura:
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+
+def criar_engines(arquivo=DB_ARQUIVO, perfil=PERFIL_SQLITE, leitores=LEITORES_POOL):
+    """
+    Retorna (engine de escrita, engine de leitura).
+    No perfil "wal" a escrita usa uma única conexão (os escritores do
+    processo fazem fila no pool em vez de disputar o lock do SQLite) e a
+    leitura um pool de conexões somente-leitura.
+    """
+    pragmas = PERFIS_SQLITE[perfil]
+    if not pragmas:
+        engine = create_engine(f"sqlite:///{arquivo}", echo=False)
+        return engine, engine
+    escrita = create_engine(f"sqlite:///{arquivo}", echo=False,
+                            pool_size=1, max_overflow=0, pool_timeout=30)
+    leitura = create_engine(f"sqlite:///file:{arquivo}?mode=ro&uri=true", echo=False,
+                            pool_size=leitores, max_overflow=0, pool_timeout=30)
+    _aplicar_pragmas(escrita, pragmas)
+    _aplicar_pragmas(leitura, pragmas, somente_leitura=True)
+    return escrita, leitura
+
+def criar_engines_async(arquivo=DB_ARQUIVO, perfil=PERFIL_SQLITE, leitores=LEITORES_POOL):
+    """
+    Mesmo que criar_engines, com o driver aiosqlite: a espera pelo SQLite
+    acontece numa thread do aiosqlite e a rota libera o event loop, em vez
+    de ocupar um worker do threadpool do FastAPI.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+    pragmas = PERFIS_SQLITE[perfil]
+    if not pragmas:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{arquivo}", echo=False)
+        return engine, engine
+    escrita = create_async_engine(f"sqlite+aiosqlite:///{arquivo}", echo=False,
+                                  pool_size=1, max_overflow=0, pool_timeout=30)
+    leitura = create_async_engine(f"sqlite+aiosqlite:///file:{arquivo}?mode=ro&uri=true", echo=False,
+                                  pool_size=leitores, max_overflow=0, pool_timeout=30)
+    _aplicar_pragmas(escrita.sync_engine, pragmas)
+    _aplicar_pragmas(leitura.sync_engine, pragmas, somente_leitura=True)
+    return escrita, leitura
+
+engine, engine_leitura = criar_engines()
 Base = declarative_base()
-SessionLocal = sessionmaker(bind=engine)
+# expire_on_commit=False: objetos continuam legíveis após o commit sem um
+# SELECT de refresh por linha (rotas em lote, resposta e feed ao vivo)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+SessionLeitura = sessionmaker(bind=engine_leitura)
+
+if DB_ASSINCRONO:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    engine_async, engine_leitura_async = criar_engines_async()
+    SessionAsync = async_sessionmaker(engine_async, expire_on_commit=False)
+    SessionLeituraAsync = async_sessionmaker(engine_leitura_async)
+else:
+    engine_async = engine_leitura_async = SessionAsync = SessionLeituraAsync = None
 
 # ==============================
 # Tabelas
@@ -35,6 +123,9 @@ class Teste(Base):
 
 class ComposteiraDado(Base):
     __tablename__ = "composteira_dados"
+    __table_args__ = (
+        Index("ix_composteira_dados_teste_data", "id_teste", "registro_em"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_teste = Column(Integer, ForeignKey("testes.id", ondelete="SET NULL"), nullable=True)
@@ -51,6 +142,10 @@ class ComposteiraDado(Base):
 
 class SiteDado(Base):
     __tablename__ = "site_dados"
+    __table_args__ = (
+        Index("ix_site_dados_teste_data", "id_teste", "data_registro"),
+        Index("ix_site_dados_device_data", "device_id", "data_registro"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_teste = Column(Integer, ForeignKey("testes.id", ondelete="SET NULL"), nullable=True)
@@ -61,12 +156,17 @@ class SiteDado(Base):
     temp_alvo_c = Column(Float)
     umidade_alvo_pct = Column(Float)
     data_registro = Column(DateTime, default=datetime.utcnow)
+    device_id = Column(String(64))  # pilha a que a montagem se refere
 
     teste = relationship("Teste", back_populates="site_dados")
 
 
 class MLResultado(Base):
     __tablename__ = "ml_resultados"
+    __table_args__ = (
+        Index("ix_ml_resultados_teste_data", "id_teste", "data_registro"),
+        Index("ix_ml_resultados_device_data", "device_id", "data_registro"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_teste = Column(Integer, ForeignKey("testes.id", ondelete="SET NULL"), nullable=True)
@@ -80,12 +180,20 @@ class MLResultado(Base):
     dupla_atoxica = Column(String(200))
     dupla_toxica = Column(String(200))
     data_registro = Column(DateTime, default=datetime.utcnow)
+    device_id = Column(String(64))  # o do site_dado avaliado
 
     teste = relationship("Teste", back_populates="resultados_ml")
 
 
 class SensorLeitura(Base):
     __tablename__ = "sensor_leituras"
+    __table_args__ = (
+        Index("ix_sensor_leituras_teste_data", "id_teste", "data_registro"),
+        Index("ix_sensor_leituras_data_id", "data_registro", "id"),  # paginação keyset sem filtro
+        Index("ix_sensor_leituras_device_data", "device_id", "data_registro", "id"),  # keyset de uma pilha
+        # Ingestão idempotente (idempotencia.py); leituras sem seq ficam com NULL, que não colide
+        Index("ux_sensor_leituras_device_seq", "device_id", "seq", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_teste = Column(Integer, ForeignKey("testes.id", ondelete="SET NULL"), nullable=True)
@@ -93,15 +201,36 @@ class SensorLeitura(Base):
     umidade = Column(Float)
     o2 = Column(Float)
     ph = Column(Float)
-    gases = Column(Text)  # Ex: '{"NH3": 10, "CH4": 5}' (serializado como JSON)
+    gases = Column(Text)  # Payload original (JSON); para consultas use leitura_gases
     data_registro = Column(DateTime, default=datetime.utcnow)
 
+    # Resumo agregado no ESP32 (esp.py): os campos acima são as médias do
+    # intervalo, amostras quantas leituras brutas a linha representa e
+    # *_min/*_max os extremos. resumo guarda min/max/último de tudo (JSON).
+    amostras = Column(Integer, nullable=False, default=1, server_default="1")
+    temperatura_min = Column(Float)
+    temperatura_max = Column(Float)
+    umidade_min = Column(Float)
+    umidade_max = Column(Float)
+    ph_min = Column(Float)
+    ph_max = Column(Float)
+    resumo = Column(Text)
+
+    # Origem: dispositivo e número de sequência do registro nele (reenvios repetem o seq)
+    device_id = Column(String(64))
+    seq = Column(Integer)
+
     teste = relationship("Teste", back_populates="leituras_sensor")
     resultado_ml3 = relationship("ML3Resultado", back_populates="leitura", uselist=False, cascade="all, delete-orphan")
+    concentracoes = relationship("LeituraGas", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class ML3Resultado(Base):
     __tablename__ = "ml3_resultados"
+    __table_args__ = (
+        Index("ix_ml3_resultados_leitura", "id_leitura"),
+        Index("ix_ml3_resultados_device_data", "device_id", "data_analise"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_leitura = Column(Integer, ForeignKey("sensor_leituras.id", ondelete="CASCADE"), nullable=False)
@@ -111,15 +240,460 @@ class ML3Resultado(Base):
     prob_fase_maturacao = Column(Float)
     score_coerencia = Column(Float)
     data_analise = Column(DateTime, default=datetime.utcnow)
+    device_id = Column(String(64))  # o da leitura: último resultado de uma pilha sem join
 
     leitura = relationship("SensorLeitura", back_populates="resultado_ml3")
 
+
+# ==============================
+# Dispositivos (uma placa ESP32 por pilha)
+# ==============================
+# Registro da frota. Uma placa entra sozinha na primeira leitura gravada
+# (visto_em, ultima_leitura_id e leituras são atualizados no mesmo flush);
+# nome, descrição e o teste em andamento na pilha vêm de PUT /dispositivos.
+# sensor_leituras.device_id não tem chave estrangeira: leituras de uma
+# placa ainda não cadastrada são aceitas como antes.
+class Dispositivo(Base):
+    __tablename__ = "dispositivos"
+    __table_args__ = (
+        Index("ix_dispositivos_teste", "id_teste"),
+    )
+
+    device_id = Column(String(64), primary_key=True)
+    nome = Column(String(100))
+    descricao = Column(String(255))
+    id_teste = Column(Integer, ForeignKey("testes.id", ondelete="SET NULL"), nullable=True)
+    criado_em = Column(DateTime, default=datetime.now)
+    visto_em = Column(DateTime)            # data_registro da leitura mais recente
+    ultima_leitura_id = Column(Integer)
+    leituras = Column(Integer, nullable=False, default=0, server_default="0")
+
+    teste = relationship("Teste")
+
+
+# ==============================
+# Gases por composto (normalizado)
+# ==============================
+# Uma linha por (leitura, composto), preenchida automaticamente a cada
+# flush a partir de SensorLeitura.gases. Filtros e agregações por gás
+# ("H2S > 5 ppm") rodam no SQLite sem decodificar JSON.
+class Gas(Base):
+    __tablename__ = "gases"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    nome = Column(String(50), unique=True, nullable=False)
+
+
+class LeituraGas(Base):
+    __tablename__ = "leitura_gases"
+    __table_args__ = (
+        Index("ix_leitura_gases_gas_ppm", "id_gas", "ppm"),
+    )
+
+    id_leitura = Column(Integer, ForeignKey("sensor_leituras.id", ondelete="CASCADE"), primary_key=True)
+    id_gas = Column(Integer, ForeignKey("gases.id"), primary_key=True)
+    ppm = Column(Float)
+
+    gas = relationship("Gas")
+
+
+# ==============================
+# Arquivo frio (Parquet)
+# ==============================
+# Manifesto dos arquivos gerados por arquivo.py: as leituras listadas aqui
+# saíram de sensor_leituras/leitura_gases e são lidas dos arquivos Parquet.
+class ArquivoLote(Base):
+    __tablename__ = "arquivo_lotes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_teste = Column(Integer, nullable=True)
+    mes = Column(String(7))                        # 'AAAA-MM'
+    caminho = Column(String(255), unique=True)     # leituras, relativo a ECOVITA_ARQUIVO_DIR
+    caminho_gases = Column(String(255))            # leitura_gases do mesmo lote
+    id_min = Column(Integer)
+    id_max = Column(Integer)
+    data_min = Column(DateTime)
+    data_max = Column(DateTime)
+    linhas = Column(Integer)
+    arquivado_em = Column(DateTime, default=datetime.now)
+
+# Compostos enviados pelo Mega (arduino.c++), na mesma ordem
+GASES_ARDUINO = [
+    "Metano", "Hidrogênio", "Álcool", "Fumaça", "Amônia", "Benzeno",
+    "Formaldeído", "CO", "CO2", "H2S", "SO2"
+]
+# Nomes alternativos aceitos no payload em formato dict
+APELIDOS_GASES = {"CH4": "Metano", "NH3": "Amônia", "Amonia": "Amônia"}
+
+def gases_por_composto(gases):
+    """Converte o campo gases (lista do Mega ou dict) em {composto: ppm}."""
+    if not gases:
+        return {}
+    dados = json.loads(gases) if isinstance(gases, str) else gases
+    if isinstance(dados, list):
+        dados = {g.get("composto"): g.get("ppm", 0.0) for g in dados}
+    return {APELIDOS_GASES.get(nome, nome): float(ppm) for nome, ppm in dados.items() if ppm is not None}
+
+_ids_gases = {}  # url do banco -> {nome: id}
+
+def ids_gases(conexao, nomes):
+    """id de cada composto, criando no dicionário os que ainda não existem."""
+    cache = _ids_gases.setdefault(str(conexao.engine.url), {})
+    faltando = [n for n in set(nomes) if n not in cache]
+    if faltando:
+        tabela = Gas.__table__
+        conexao.execute(sqlite_insert(tabela).on_conflict_do_nothing(), [{"nome": n} for n in faltando])
+        cache.update({nome: id_ for id_, nome in conexao.execute(
+            tabela.select().with_only_columns(tabela.c.id, tabela.c.nome).where(tabela.c.nome.in_(faltando))
+        )})
+    return cache
+
+def gravar_gases(conexao, leituras):
+    """Insere as linhas de leitura_gases das leituras recém-gravadas."""
+    por_leitura = [(l.id, gases_por_composto(l.gases)) for l in leituras]
+    ids = ids_gases(conexao, [nome for _, g in por_leitura for nome in g])
+    linhas = [
+        {"id_leitura": id_leitura, "id_gas": ids[nome], "ppm": ppm}
+        for id_leitura, g in por_leitura for nome, ppm in g.items()
+    ]
+    if linhas:
+        conexao.execute(sqlite_insert(LeituraGas.__table__).on_conflict_do_nothing(), linhas)
+
+@lru_cache(maxsize=None)
+def _upsert_dispositivo():
+    t = Dispositivo.__table__.c
+    stmt = sqlite_insert(Dispositivo.__table__)
+    ex = stmt.excluded
+    return stmt.on_conflict_do_update(index_elements=["device_id"], set_={
+        "visto_em": func.max(func.coalesce(t.visto_em, ex.visto_em), ex.visto_em),
+        "ultima_leitura_id": func.max(func.coalesce(t.ultima_leitura_id, ex.ultima_leitura_id), ex.ultima_leitura_id),
+        "leituras": t.leituras + ex.leituras,
+    })
+
+def registrar_dispositivos(conexao, leituras):
+    """Cadastra as placas novas e atualiza visto_em/ultima_leitura_id/leituras (um upsert por flush)."""
+    por_placa = {}
+    for l in leituras:
+        if l.device_id is None:
+            continue
+        quando = l.data_registro or datetime.utcnow()
+        d = por_placa.get(l.device_id)
+        if d is None:
+            por_placa[l.device_id] = {"device_id": l.device_id, "criado_em": datetime.now(), "visto_em": quando,
+                                      "ultima_leitura_id": l.id, "leituras": 1}
+            continue
+        d["leituras"] += 1
+        if l.id > d["ultima_leitura_id"]:
+            d["visto_em"], d["ultima_leitura_id"] = quando, l.id
+    if por_placa:
+        conexao.execute(_upsert_dispositivo(), list(por_placa.values()))
+
+
+# ==============================
+# Rollups (minuto / hora / dia)
+# ==============================
+# Estatísticas por teste, pilha e intervalo, atualizadas na mesma transação
+# em que as leituras são gravadas. "inicio" é o prefixo do texto de
+# data_registro ('AAAA-MM-DD HH:MM' / 'AAAA-MM-DD HH' / 'AAAA-MM-DD'),
+# id_teste = 0 agrupa as leituras sem teste e device_id = '' as sem placa.
+# A série de uma pilha é uma busca pelo índice (device_id, inicio).
+CAMPOS_ROLLUP = ["temperatura", "umidade", "ph", "covs"]
+
+class RollupMixin:
+    id_teste = Column(Integer, primary_key=True, default=0)
+    device_id = Column(String(64), primary_key=True, default="")
+    inicio = Column(String(16), primary_key=True)
+    n = Column(Integer, nullable=False)
+    ultimo_id = Column(Integer)  # leitura mais recente do intervalo (valores *_ultimo)
+
+    temperatura_soma = Column(Float)
+    temperatura_min = Column(Float)
+    temperatura_max = Column(Float)
+    temperatura_ultimo = Column(Float)
+
+    umidade_soma = Column(Float)
+    umidade_min = Column(Float)
+    umidade_max = Column(Float)
+    umidade_ultimo = Column(Float)
+
+    ph_soma = Column(Float)
+    ph_min = Column(Float)
+    ph_max = Column(Float)
+    ph_ultimo = Column(Float)
+
+    covs_soma = Column(Float)  # COVs = soma dos ppm de todos os compostos da leitura
+    covs_min = Column(Float)
+    covs_max = Column(Float)
+    covs_ultimo = Column(Float)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (Index(f"ix_{cls.__tablename__}_device", "device_id", "inicio"),)
+
+
+class RollupMinuto(RollupMixin, Base):
+    __tablename__ = "rollup_minuto"
+
+class RollupHora(RollupMixin, Base):
+    __tablename__ = "rollup_hora"
+
+class RollupDia(RollupMixin, Base):
+    __tablename__ = "rollup_dia"
+
+# granularidade -> (tabela, tamanho do prefixo de data_registro)
+ROLLUPS = {"1m": (RollupMinuto, 16), "1h": (RollupHora, 13), "1d": (RollupDia, 10)}
+
+
+def covs_total(gases):
+    """Soma dos ppm de todos os compostos do campo gases."""
+    return float(sum(gases_por_composto(gases).values()))
+
+@lru_cache(maxsize=None)
+def _upsert_rollup(modelo):
+    # Montar a expressão custa ms; ela é a mesma para todo flush
+    t = modelo.__table__.c
+    stmt = sqlite_insert(modelo.__table__)
+    ex = stmt.excluded
+    novo_mais_recente = ex.ultimo_id > t.ultimo_id
+    valores = {"n": t.n + ex.n, "ultimo_id": func.max(t.ultimo_id, ex.ultimo_id)}
+    for c in CAMPOS_ROLLUP:
+        valores[f"{c}_soma"] = func.coalesce(t[f"{c}_soma"], 0) + func.coalesce(ex[f"{c}_soma"], 0)
+        # MIN/MAX escalares do SQLite devolvem NULL se algum lado for NULL
+        valores[f"{c}_min"] = func.coalesce(func.min(t[f"{c}_min"], ex[f"{c}_min"]), t[f"{c}_min"], ex[f"{c}_min"])
+        valores[f"{c}_max"] = func.coalesce(func.max(t[f"{c}_max"], ex[f"{c}_max"]), t[f"{c}_max"], ex[f"{c}_max"])
+        valores[f"{c}_ultimo"] = case((novo_mais_recente, ex[f"{c}_ultimo"]), else_=t[f"{c}_ultimo"])
+    return stmt.on_conflict_do_update(index_elements=["id_teste", "device_id", "inicio"], set_=valores)
+
+def atualizar_rollups(conexao, leituras):
+    """
+    Agrega as leituras em memória e faz um upsert por (teste, pilha, intervalo).
+    Uma linha resumida no ESP32 conta como suas amostras (n e soma
+    ponderados) e contribui com seus extremos para min/max.
+    """
+    valores = [
+        ((l.id_teste or 0, l.device_id or ""), str(l.data_registro or datetime.utcnow()), l.id, l.amostras or 1, {
+            "temperatura": (l.temperatura, l.temperatura_min, l.temperatura_max),
+            "umidade": (l.umidade, l.umidade_min, l.umidade_max),
+            "ph": (l.ph, l.ph_min, l.ph_max),
+            "covs": (covs_total(l.gases), None, None),
+        })
+        for l in leituras
+    ]
+    for modelo, tamanho in ROLLUPS.values():
+        grupos = {}
+        for (id_teste, device_id), data, id_, amostras, campos in valores:
+            g = grupos.get((id_teste, device_id, data[:tamanho]))
+            if g is None:
+                g = grupos[(id_teste, device_id, data[:tamanho])] = {
+                    "id_teste": id_teste, "device_id": device_id, "inicio": data[:tamanho], "n": 0, "ultimo_id": id_}
+                for c in CAMPOS_ROLLUP:
+                    g[f"{c}_soma"], g[f"{c}_min"], g[f"{c}_max"], g[f"{c}_ultimo"] = 0.0, None, None, None
+            g["n"] += amostras
+            for c, (v, minimo, maximo) in campos.items():
+                if v is None:
+                    continue
+                minimo = v if minimo is None else minimo
+                maximo = v if maximo is None else maximo
+                g[f"{c}_soma"] += v * amostras
+                g[f"{c}_min"] = minimo if g[f"{c}_min"] is None else min(g[f"{c}_min"], minimo)
+                g[f"{c}_max"] = maximo if g[f"{c}_max"] is None else max(g[f"{c}_max"], maximo)
+            if id_ >= g["ultimo_id"]:
+                g["ultimo_id"] = id_
+                for c, (v, _, _) in campos.items():
+                    g[f"{c}_ultimo"] = v
+        if grupos:
+            conexao.execute(_upsert_rollup(modelo), list(grupos.values()))
+
+@event.listens_for(Session, "after_flush")
+def _leituras_apos_flush(session, contexto):
+    # Vale para qualquer caminho de gravação (rota, lote, fila assíncrona)
+    novas = [o for o in session.new if isinstance(o, SensorLeitura)]
+    if novas:
+        conexao = session.connection()
+        gravar_gases(conexao, novas)
+        atualizar_rollups(conexao, novas)
+        registrar_dispositivos(conexao, novas)
+
+SQL_RECONSTRUIR_ROLLUP = """
+INSERT INTO {tabela} (id_teste, device_id, inicio, n, ultimo_id, {colunas})
+WITH base AS (
+    SELECT s.id, COALESCE(s.id_teste, 0) AS id_teste, COALESCE(s.device_id, '') AS device_id,
+           substr(s.data_registro, 1, {tamanho}) AS inicio,
+           s.amostras, s.temperatura, s.umidade, s.ph, {extremos},
+           COALESCE((SELECT SUM(g.ppm) FROM leitura_gases AS g WHERE g.id_leitura = s.id), 0) AS covs
+      FROM sensor_leituras AS s
+),
+agregado AS (
+    SELECT id_teste, device_id, inicio, SUM(amostras) AS n, MAX(id) AS ultimo_id, {agregados}
+      FROM base
+     GROUP BY id_teste, device_id, inicio
+)
+SELECT a.id_teste, a.device_id, a.inicio, a.n, a.ultimo_id, {selecionados}
+  FROM agregado AS a JOIN base AS u ON u.id = a.ultimo_id
+"""
+
+# Colunas com extremos próprios em sensor_leituras (resumos do ESP32)
+CAMPOS_COM_EXTREMOS = ["temperatura", "umidade", "ph"]
+
+def sql_extremos(prefixo="s."):
+    """{c}_lo/{c}_hi: extremos da linha, ou o próprio valor se ela não for um resumo."""
+    return ", ".join(
+        f"COALESCE({prefixo}{c}_min, {prefixo}{c}) AS {c}_lo, COALESCE({prefixo}{c}_max, {prefixo}{c}) AS {c}_hi"
+        for c in CAMPOS_COM_EXTREMOS
+    ) + ", NULL AS covs_lo, NULL AS covs_hi"
+
+def _sql_reconstruir_rollup(modelo, tamanho):
+    # Todas as pilhas de um (teste, intervalo) saem e voltam juntas
+    return [
+        f"DELETE FROM {modelo.__tablename__} WHERE (id_teste, inicio) IN "
+        f"(SELECT COALESCE(id_teste, 0), substr(data_registro, 1, {tamanho}) FROM sensor_leituras)",
+        SQL_RECONSTRUIR_ROLLUP.format(
+            tabela=modelo.__tablename__,
+            tamanho=tamanho,
+            extremos=sql_extremos(),
+            colunas=", ".join(f"{c}_soma, {c}_min, {c}_max, {c}_ultimo" for c in CAMPOS_ROLLUP),
+            agregados=", ".join(
+                f"SUM({c} * amostras) AS {c}_soma, MIN(COALESCE({c}_lo, {c})) AS {c}_min, "
+                f"MAX(COALESCE({c}_hi, {c})) AS {c}_max" for c in CAMPOS_ROLLUP
+            ),
+            selecionados=", ".join(f"a.{c}_soma, a.{c}_min, a.{c}_max, u.{c}" for c in CAMPOS_ROLLUP),
+        ),
+    ]
+
+def reconstruir_rollups():
+    """
+    Recalcula as tabelas de rollup a partir de sensor_leituras (backfill).
+    Só são substituídos os intervalos que ainda têm leituras no SQLite: os
+    de leituras já arquivadas (arquivo.py) ficam como estão.
+    """
+    with engine.begin() as conexao:
+        for modelo, tamanho in ROLLUPS.values():
+            for comando in _sql_reconstruir_rollup(modelo, tamanho):
+                conexao.execute(text(comando))
+
+# ==============================
+# Migrações (versão em PRAGMA user_version)
+# ==============================
+# create_all só cria o que não existe; mudanças em tabelas que já existem
+# num banco antigo entram aqui, numa lista ordenada e idempotente.
+
+# Nome do composto de um elemento de json_each(gases), com os apelidos resolvidos
+_SQL_NOME_GAS = "CASE {composto} {apelidos} ELSE {composto} END".format(
+    composto="COALESCE(json_extract(g.value, '$.composto'), g.key)",
+    apelidos=" ".join(f"WHEN '{a}' THEN '{n}'" for a, n in APELIDOS_GASES.items()),
+)
+# ids dos gases do Mega na ordem de GASES_ARDUINO
+_SQL_SEMEAR_GASES = "INSERT OR IGNORE INTO gases (nome) VALUES " + ", ".join(f"('{g}')" for g in GASES_ARDUINO)
+_SQL_PPM_GAS = "CASE g.type WHEN 'object' THEN json_extract(g.value, '$.ppm') ELSE g.value END"
+
+def _sql_recriar_rollup(modelo, tamanho):
+    """Tabela de rollup no esquema atual, com as linhas antigas (device_id = '') e as pilhas do SQLite reagrupadas."""
+    tabela = modelo.__table__
+    antiga = f"{tabela.name}_v4"
+    colunas = ", ".join(c.name for c in tabela.columns if c.name != "device_id")
+    return [
+        f"ALTER TABLE {tabela.name} RENAME TO {antiga}",
+        # O RENAME leva junto os índices, com os mesmos nomes: num banco
+        # anterior aos rollups, create_all já os criou no esquema atual
+        *(f"DROP INDEX IF EXISTS {indice.name}" for indice in tabela.indexes),
+        str(CreateTable(tabela).compile(dialect=sqlite.dialect())),
+        *(str(CreateIndex(indice).compile(dialect=sqlite.dialect())) for indice in tabela.indexes),
+        f"INSERT INTO {tabela.name} (device_id, {colunas}) SELECT '', {colunas} FROM {antiga}",
+        f"DROP TABLE {antiga}",
+        *_sql_reconstruir_rollup(modelo, tamanho),
+    ]
+
+MIGRACOES = [
+    (1, "índices de série temporal", [
+        "CREATE INDEX IF NOT EXISTS ix_composteira_dados_teste_data ON composteira_dados (id_teste, registro_em)",
+        "CREATE INDEX IF NOT EXISTS ix_site_dados_teste_data ON site_dados (id_teste, data_registro)",
+        "CREATE INDEX IF NOT EXISTS ix_ml_resultados_teste_data ON ml_resultados (id_teste, data_registro)",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_leituras_teste_data ON sensor_leituras (id_teste, data_registro)",
+        "CREATE INDEX IF NOT EXISTS ix_sensor_leituras_data_id ON sensor_leituras (data_registro, id)",
+        "CREATE INDEX IF NOT EXISTS ix_ml3_resultados_leitura ON ml3_resultados (id_leitura)",
+        "ANALYZE",
+    ]),
+    (2, "gases normalizados em leitura_gases", [
+        _SQL_SEMEAR_GASES,
+        # Backfill a partir do JSON: lista do Mega ({"composto","ppm"}) ou dict composto -> ppm
+        f"""
+        INSERT OR IGNORE INTO gases (nome)
+        SELECT DISTINCT {_SQL_NOME_GAS} FROM sensor_leituras AS s, json_each(s.gases) AS g
+         WHERE s.gases IS NOT NULL
+        """,
+        f"""
+        INSERT OR IGNORE INTO leitura_gases (id_leitura, id_gas, ppm)
+        SELECT s.id, gs.id, {_SQL_PPM_GAS}
+          FROM sensor_leituras AS s, json_each(s.gases) AS g
+          JOIN gases AS gs ON gs.nome = {_SQL_NOME_GAS}
+         WHERE s.gases IS NOT NULL AND {_SQL_PPM_GAS} IS NOT NULL
+        """,
+        "ANALYZE",
+    ]),
+    (3, "resumos agregados no ESP32", [
+        "ALTER TABLE sensor_leituras ADD COLUMN amostras INTEGER NOT NULL DEFAULT 1",
+        *(f"ALTER TABLE sensor_leituras ADD COLUMN {c}_{e} FLOAT"
+          for c in CAMPOS_COM_EXTREMOS for e in ("min", "max")),
+        "ALTER TABLE sensor_leituras ADD COLUMN resumo TEXT",
+    ]),
+    (4, "ingestão idempotente por (device_id, seq)", [
+        "ALTER TABLE sensor_leituras ADD COLUMN device_id VARCHAR(64)",
+        "ALTER TABLE sensor_leituras ADD COLUMN seq INTEGER",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_sensor_leituras_device_seq ON sensor_leituras (device_id, seq)",
+    ]),
+    (5, "frota de pilhas: dispositivos e device_id nos resultados e rollups", [
+        # create_all já criou a tabela dispositivos; só os cadastros das placas existentes
+        """
+        INSERT OR IGNORE INTO dispositivos (device_id, criado_em, visto_em, ultima_leitura_id, leituras)
+        SELECT device_id, MIN(data_registro), MAX(data_registro), MAX(id), COUNT(*)
+          FROM sensor_leituras WHERE device_id IS NOT NULL GROUP BY device_id
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_sensor_leituras_device_data ON sensor_leituras (device_id, data_registro, id)",
+        "ALTER TABLE site_dados ADD COLUMN device_id VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS ix_site_dados_device_data ON site_dados (device_id, data_registro)",
+        "ALTER TABLE ml_resultados ADD COLUMN device_id VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS ix_ml_resultados_device_data ON ml_resultados (device_id, data_registro)",
+        "ALTER TABLE ml3_resultados ADD COLUMN device_id VARCHAR(64)",
+        """
+        UPDATE ml3_resultados SET device_id = (
+            SELECT s.device_id FROM sensor_leituras AS s WHERE s.id = ml3_resultados.id_leitura)
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_ml3_resultados_device_data ON ml3_resultados (device_id, data_analise)",
+        # device_id entra na chave primária dos rollups: o SQLite exige recriar a tabela
+        *(comando for modelo, tamanho in ROLLUPS.values() for comando in _sql_recriar_rollup(modelo, tamanho)),
+        "ANALYZE",
+    ]),
+]
+
+def migrar(engine_alvo=None):
+    """Aplica as migrações com versão maior que a gravada no banco."""
+    with (engine_alvo or engine).begin() as conexao:
+        versao = conexao.exec_driver_sql("PRAGMA user_version").scalar()
+        for numero, descricao, comandos in MIGRACOES:
+            if numero <= versao:
+                continue
+            for comando in comandos:
+                conexao.exec_driver_sql(comando)
+            conexao.exec_driver_sql(f"PRAGMA user_version = {numero}")
+            print(f"✅ Migração {numero} aplicada: {descricao}")
+
 # ==============================
 # Inicialização do Banco
 # ==============================
 def init_db():
+    novo = not inspect(engine).has_table("sensor_leituras")
     Base.metadata.create_all(engine)
+    if novo:
+        # create_all já criou o esquema atual: só semeia os gases e registra a versão
+        with engine.begin() as conexao:
+            conexao.exec_driver_sql(_SQL_SEMEAR_GASES)
+            conexao.exec_driver_sql(f"PRAGMA user_version = {MIGRACOES[-1][0]}")
+    else:
+        migrar()
 
 if __name__ == "__main__":
     init_db()
     print("✅ Banco de dados inicializado com sucesso!")
+    if "rollups" in sys.argv[1:]:  # python bd.py rollups
+        reconstruir_rollups()
+        print("✅ Rollups reconstruídos a partir de sensor_leituras!")
@@ -0,0 +1,745 @@
+# benchmark.py
+# Benchmarks do backend Ecovita. Rodam sobre um banco SQLite temporário,
+# sem precisar dos modelos treinados nem de uma API no ar.
+# Uso: python benchmark.py lote --linhas 2000 --tamanho 100
+#      python benchmark.py frota --placas 200 --salvar base.json
+#      python benchmark.py frota --placas 200 --comparar base.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from bd import Base, SensorLeitura, criar_engines, PERFIS_SQLITE
+from api import nova_leitura, validar_leitura
+from ouvinte import OuvinteLinhas
+from esquemas import LeituraSaida, Pagina, RespostaORJSON
+from consultas import agregar_leituras
+from metricas import Metricas, MedirRequisicoes
+import binario
+
+# -------------------------
+# Payload no formato do arduino.c++
+# -------------------------
+COMPOSTOS_ARDUINO = [
+    ("Metano", "mq2", 0.4), ("Hidrogênio", "mq2", 0.3), ("Álcool", "mq2", 0.2),
+    ("Fumaça", "mq2", 0.1), ("Amônia", "mq135", 0.3), ("Benzeno", "mq135", 0.2),
+    ("Formaldeído", "mq135", 0.2), ("CO", "mq135", 0.2), ("CO2", "mq135", 0.1),
+    ("H2S", "mq136", 0.6), ("SO2", "mq136", 0.4),
+]
+
+def payload_arduino(rng=random):
+    """Gera uma leitura com o mesmo JSON que o Mega imprime na Serial1."""
+    mq = {s: rng.uniform(0, 1000) for s in ("mq2", "mq135", "mq136")}
+    return {
+        "temperatura": round(rng.uniform(25, 65), 2),
+        "umidade": round(rng.uniform(35, 80), 2),
+        "ph": round(rng.uniform(5.5, 8.5), 2),
+        "umidSolo": rng.randint(0, 100),
+        "gases": [
+            {"composto": nome, "ppm": round(mq[sensor] * fator, 2)}
+            for nome, sensor, fator in COMPOSTOS_ARDUINO
+        ],
+    }
+
+def banco_temporario(pasta, perfil="padrao"):
+    """Cria o banco num diretório temporário; retorna (engine de escrita, engine de leitura)."""
+    escrita, leitura = criar_engines(os.path.join(pasta, "bench.db"), perfil)
+    Base.metadata.create_all(escrita)
+    return escrita, leitura
+
+def _relatorio(nome, linhas, segundos):
+    print(f"{nome:<28} {linhas:>8} linhas  {segundos:8.3f} s  {linhas / segundos:12.1f} linhas/s")
+
+# -------------------------
+# lote: uma linha por commit x um commit por lote
+# -------------------------
+def bench_lote(args):
+    payloads = [payload_arduino() for _ in range(args.linhas)]
+
+    with tempfile.TemporaryDirectory() as pasta:
+        engine, _ = banco_temporario(pasta, args.perfil)
+        Sessao = sessionmaker(bind=engine)
+
+        # Rota /esp32/leitura: add + commit + refresh por leitura
+        db = Sessao()
+        inicio = time.perf_counter()
+        for dado in payloads:
+            nova = nova_leitura(dado, datetime.now())
+            db.add(nova)
+            db.commit()
+            db.refresh(nova)
+        _relatorio("uma linha por requisição", args.linhas, time.perf_counter() - inicio)
+        db.close()
+
+        # Rota /esp32/leituras/lote: add_all + um commit por lote
+        db = Sessao(expire_on_commit=False)
+        inicio = time.perf_counter()
+        for i in range(0, len(payloads), args.tamanho):
+            agora = datetime.now()
+            db.add_all([nova_leitura(dado, agora) for dado in payloads[i:i + args.tamanho]])
+            db.commit()
+        _relatorio(f"lotes de {args.tamanho}", args.linhas, time.perf_counter() - inicio)
+        db.close()
+        engine.dispose()
+
+# -------------------------
+# sqlite: leitura e escrita concorrentes, perfil "padrao" x "wal"
+# -------------------------
+def bench_sqlite(args):
+    for perfil in PERFIS_SQLITE:
+        with tempfile.TemporaryDirectory() as pasta:
+            escrita, leitura = banco_temporario(pasta, perfil)
+            Escrita = sessionmaker(bind=escrita, expire_on_commit=False)
+            Leitura = sessionmaker(bind=leitura)
+
+            db = Escrita()
+            agora = datetime.now()
+            db.add_all([nova_leitura(payload_arduino(), agora) for _ in range(args.semente)])
+            db.commit()
+            db.close()
+
+            contagem = {"linhas gravadas": 0, "consultas": 0, "erros de lock": 0}
+            lock = threading.Lock()
+            fim = time.monotonic() + args.segundos
+
+            def somar(chave, n=1):
+                with lock:
+                    contagem[chave] += n
+
+            def escritor():
+                rng = random.Random()
+                while time.monotonic() < fim:
+                    db = Escrita()
+                    try:
+                        agora = datetime.now()
+                        db.add_all([nova_leitura(payload_arduino(rng), agora) for _ in range(args.lote)])
+                        db.commit()
+                        somar("linhas gravadas", args.lote)
+                    except OperationalError:
+                        db.rollback()
+                        somar("erros de lock")
+                    finally:
+                        db.close()
+
+            def leitor():
+                while time.monotonic() < fim:
+                    db = Leitura()
+                    try:
+                        # Mesma forma da listagem do painel: últimas 100 leituras
+                        db.query(SensorLeitura).order_by(
+                            SensorLeitura.data_registro.desc(), SensorLeitura.id.desc()).limit(100).all()
+                        somar("consultas")
+                    except OperationalError:
+                        somar("erros de lock")
+                    finally:
+                        db.close()
+
+            threads = [threading.Thread(target=escritor) for _ in range(args.escritores)]
+            threads += [threading.Thread(target=leitor) for _ in range(args.leitores)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            print(f"perfil {perfil:<7} "
+                  f"{contagem['linhas gravadas'] / args.segundos:10.1f} linhas/s  "
+                  f"{contagem['consultas'] / args.segundos:8.1f} consultas/s  "
+                  f"{contagem['erros de lock']:5d} erros de lock")
+            escrita.dispose()
+            leitura.dispose()
+
+# -------------------------
+# formato: corpo JSON do Mega x binário compacto (binario.py)
+# -------------------------
+def _cronometrar(funcao, corpo, repeticoes):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao(corpo)
+    return (time.perf_counter() - inicio) / repeticoes
+
+def bench_formato(args):
+    leituras = [payload_arduino() for _ in range(args.lote)]
+    # Mesmo texto que o Mega imprime (sem espaços, UTF-8)
+    codificar_json = lambda d: json.dumps(d if args.lote > 1 else d[0], separators=(",", ":"), ensure_ascii=False).encode()
+    # No servidor o JSON ainda passa pela validação do corpo (list[dict]) do FastAPI
+    validar_corpo = TypeAdapter(list[dict] if args.lote > 1 else dict).validate_python
+    decodificar_json = lambda corpo: validar_corpo(json.loads(corpo))
+    formatos = {"json": (codificar_json, decodificar_json), "binario": (binario.codificar, binario.decodificar)}
+
+    resultados = {}
+    for nome, (codificar, decodificar) in formatos.items():
+        corpo = codificar(leituras)
+        resultados[nome] = (
+            len(corpo),
+            len(corpo) * 8 / (args.kbps * 1000) * 1000,               # ms de rádio só do corpo
+            _cronometrar(codificar, leituras, args.repeticoes) * 1e6,  # µs no cliente
+            _cronometrar(decodificar, corpo, args.repeticoes) * 1e6,   # µs no servidor
+        )
+    print(f"{args.lote} leitura(s) por requisição, enlace de {args.kbps} kbit/s")
+    print(f"{'formato':<10} {'bytes':>8} {'rádio ms':>10} {'codificar µs':>14} {'decodificar µs':>16}")
+    for nome, (tamanho, radio, codificar, decodificar) in resultados.items():
+        print(f"{nome:<10} {tamanho:>8} {radio:>10.3f} {codificar:>14.2f} {decodificar:>16.2f}")
+    j, b = resultados["json"], resultados["binario"]
+    print(f"{'json/bin':<10} {j[0] / b[0]:>7.1f}x {j[1] / b[1]:>9.1f}x {j[2] / b[2]:>13.1f}x {j[3] / b[3]:>15.1f}x")
+
+# -------------------------
+# serializacao: páginas de /esp32/leitura e o agregado, por caminho de serialização
+# -------------------------
+def bench_serializacao(args):
+    with tempfile.TemporaryDirectory() as pasta:
+        engine, _ = banco_temporario(pasta, "wal")
+        Sessao = sessionmaker(bind=engine)
+        db = Sessao()
+        rng = random.Random(1)
+        agora = datetime.now()
+        # Uma leitura por minuto: o agregado "1m" tem um intervalo por leitura
+        db.add_all([nova_leitura(payload_arduino(rng), agora - timedelta(minutes=i)) for i in range(args.itens)])
+        db.commit()
+        db.close()
+
+        db = Sessao()
+        itens = db.query(SensorLeitura).order_by(SensorLeitura.id).all()
+        pagina = {"itens": itens, "next_cursor": None}
+        adaptador = TypeAdapter(Pagina[LeituraSaida])
+        agregado = agregar_leituras(db, "1m")
+        db.close()
+
+        caminhos = {
+            # Antes: ORM sem response_model -> jsonable_encoder -> json.dumps (JSONResponse)
+            "orm + jsonable_encoder": lambda: json.dumps(
+                jsonable_encoder(pagina), ensure_ascii=False, separators=(",", ":")).encode(),
+            # Agora: response_model -> validação from_attributes + dump_json do pydantic-core
+            "esquema + dump_json": lambda: adaptador.dump_json(
+                adaptador.validate_python(pagina, from_attributes=True)),
+        }
+        print(f"página de {args.itens} leituras")
+        for nome, serializar in caminhos.items():
+            corpo = serializar()
+            segundos = _cronometrar(lambda _: serializar(), None, args.repeticoes)
+            print(f"{nome:<28} {segundos * 1000:8.2f} ms/página  {args.itens / segundos:12.0f} itens/s  {len(corpo):>9} bytes")
+
+        n = len(agregado["inicio"])
+        print(f"agregado de {n} intervalos (dict colunar)")
+        caminhos = {
+            "json.dumps (JSONResponse)": lambda: json.dumps(
+                jsonable_encoder(agregado), ensure_ascii=False, separators=(",", ":")).encode(),
+            "orjson (RespostaORJSON)": lambda: RespostaORJSON(agregado).body,
+        }
+        for nome, serializar in caminhos.items():
+            corpo = serializar()
+            segundos = _cronometrar(lambda _: serializar(), None, args.repeticoes)
+            print(f"{nome:<28} {segundos * 1000:8.2f} ms/resposta  {n / segundos:12.0f} intervalos/s  {len(corpo):>9} bytes")
+        engine.dispose()
+
+# -------------------------
+# linhas: muitos dispositivos no protocolo de linhas (ouvinte.py)
+# -------------------------
+async def _dispositivo_tcp(host, porta, leituras, intervalo_s):
+    _, escritor = await asyncio.open_connection(host, porta)
+    for linha in leituras:
+        escritor.write(linha)
+        if intervalo_s:
+            await escritor.drain()
+            await asyncio.sleep(intervalo_s)
+    await escritor.drain()
+    escritor.close()
+    await escritor.wait_closed()
+
+async def _dispositivo_udp(host, porta, leituras, intervalo_s):
+    transporte, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        asyncio.DatagramProtocol, remote_addr=(host, porta))
+    for linha in leituras:
+        transporte.sendto(linha)
+        await asyncio.sleep(intervalo_s)  # sleep(0) já cede a vez aos outros dispositivos
+    transporte.close()
+
+async def _frota(args, host, porta, linhas):
+    dispositivo = _dispositivo_tcp if args.protocolo == "tcp" else _dispositivo_udp
+    await asyncio.gather(*(dispositivo(host, porta, l, args.intervalo_ms / 1000) for l in linhas))
+
+def bench_linhas(args):
+    rng = random.Random(1)
+    linhas = [
+        [(json.dumps(payload_arduino(rng), ensure_ascii=False) + "\n").encode() for _ in range(args.leituras)]
+        for _ in range(args.dispositivos)
+    ]
+    total = args.dispositivos * args.leituras
+    print(f"{args.dispositivos} dispositivos x {args.leituras} leituras por {args.protocolo.upper()}")
+    if args.host is not None:
+        inicio = time.perf_counter()
+        asyncio.run(_frota(args, args.host, args.porta, linhas))
+        _relatorio("envio", total, time.perf_counter() - inicio)
+        return
+
+    with tempfile.TemporaryDirectory() as pasta:
+        # Ouvinte local num event loop próprio (como no uvicorn), gravando
+        # num banco temporário sem inferência
+        engine, _ = banco_temporario(pasta, args.perfil)
+        Sessao = sessionmaker(bind=engine, expire_on_commit=False)
+
+        def gravar(dados):
+            db = Sessao()
+            try:
+                agora = datetime.now()
+                db.add_all([nova_leitura(dado, agora) for dado in dados])
+                db.commit()
+            finally:
+                db.close()
+
+        tcp = args.protocolo == "tcp"
+        ouvinte = OuvinteLinhas(validar_leitura, gravar, "127.0.0.1",
+                                porta_tcp=0 if tcp else None, porta_udp=None if tcp else 0)
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(ouvinte.iniciar(), loop).result()
+
+        inicio = time.perf_counter()
+        asyncio.run(_frota(args, "127.0.0.1", ouvinte.porta_tcp if tcp else ouvinte.porta_udp, linhas))
+        _relatorio("envio", total, time.perf_counter() - inicio)
+        time.sleep(0.2)  # datagramas ainda no buffer do socket
+        asyncio.run_coroutine_threadsafe(ouvinte.parar(), loop).result()
+        _relatorio("gravação", ouvinte.leituras_gravadas, time.perf_counter() - inicio)
+        loop.call_soon_threadsafe(loop.stop)
+
+        status = ouvinte.status()
+        print(f"lotes gravados {status['lotes_gravados']}  lote médio {status['lote_medio']}  "
+              f"commit médio {status['latencia_commit_ms']['media']} ms  "
+              f"descartadas {status['descartadas_udp']}  inválidas {status['invalidas']}  "
+              f"perdidas no caminho {total - status['linhas_recebidas']}")
+        engine.dispose()
+
+# -------------------------
+# concorrencia: rotas síncronas (threadpool) x ECOVITA_DB_ASSINCRONO=1 (event loop)
+# -------------------------
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _subir_api(pasta, assincrono, perfil, **extra):
+    """uvicorn num processo próprio, banco novo e sem modelos (só o caminho de I/O)."""
+    porta = _porta_livre()
+    env = dict(os.environ, ECOVITA_DB=os.path.join(pasta, "bench.db"), ECOVITA_SQLITE_PERFIL=perfil,
+               ECOVITA_DB_ASSINCRONO="1" if assincrono else "0",
+               ECOVITA_MODELOS_DIR=os.path.join(pasta, "sem_modelos"),
+               ECOVITA_ARQUIVO_DIR=os.path.join(pasta, "arquivo"), **extra)
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--port", str(porta), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    import httpx
+    limite = time.monotonic() + 120  # a importação do TensorFlow é lenta
+    while time.monotonic() < limite:
+        try:
+            httpx.get(f"http://127.0.0.1:{porta}/esp32/ingestao", timeout=1)
+            return processo, f"http://127.0.0.1:{porta}"
+        except httpx.TransportError:
+            if processo.poll() is not None:
+                break
+            time.sleep(0.5)
+    processo.kill()
+    raise RuntimeError("a API não subiu")
+
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] if ordenados else 0.0
+
+async def _carga(url, clientes, segundos, escritas):
+    """clientes laços fechados: cada um manda a próxima requisição quando a anterior volta."""
+    import httpx
+    latencias, erros = [], Counter()
+    fim = time.monotonic() + segundos
+    limites = httpx.Limits(max_connections=clientes, max_keepalive_connections=clientes)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=30) as http:
+        async def cliente(rng):
+            while time.monotonic() < fim:
+                inicio = time.perf_counter()
+                try:
+                    if rng.random() < escritas:
+                        r = await http.post("/esp32/leitura", json=payload_arduino(rng))
+                    else:
+                        r = await http.get("/esp32/leitura", params={"limit": 100})
+                    if r.status_code != 200:
+                        erros[str(r.status_code)] += 1
+                        continue
+                except httpx.HTTPError as e:
+                    erros[type(e).__name__] += 1
+                    continue
+                latencias.append((time.perf_counter() - inicio) * 1000)
+        await asyncio.gather(*(cliente(random.Random(i)) for i in range(clientes)))
+    return sorted(latencias), erros
+
+def bench_concorrencia(args):
+    import httpx
+    print(f"{args.segundos:.0f} s por nível, {args.escritas:.0%} POST /esp32/leitura, "
+          f"resto GET /esp32/leitura?limit=100 (perfil {args.perfil})")
+    for assincrono in (False, True):
+        with tempfile.TemporaryDirectory() as pasta:
+            processo, url = _subir_api(pasta, assincrono, args.perfil)
+            try:
+                # Histórico inicial para as páginas não saírem vazias
+                httpx.post(f"{url}/esp32/leituras/lote", json=[payload_arduino() for _ in range(500)], timeout=60)
+                modo = "async (event loop)" if assincrono else "sync (threadpool)"
+                for clientes in args.clientes:
+                    latencias, erros = asyncio.run(_carga(url, clientes, args.segundos, args.escritas))
+                    print(f"{modo:<19} {clientes:5d} clientes  {len(latencias) / args.segundos:8.1f} req/s  "
+                          f"p50 {_percentil(latencias, 0.50):7.1f} ms  p95 {_percentil(latencias, 0.95):7.1f} ms  "
+                          f"p99 {_percentil(latencias, 0.99):7.1f} ms  {sum(erros.values()):5d} erros {dict(erros) or ''}")
+            finally:
+                processo.terminate()
+                processo.wait()
+
+# -------------------------
+# frota: N placas virtuais a taxa fixa contra a API, com linha de base
+# -------------------------
+class SondaLock:
+    """
+    Mede quanto um escritor espera pelo lock de escrita do SQLite: a cada
+    periodo_s abre uma transação BEGIN IMMEDIATE (com o mesmo busy_timeout
+    da API) e a desfaz na hora. Cada amostra é uma espera que uma gravação
+    da API teria sofrido naquele instante.
+    """
+
+    def __init__(self, arquivo, periodo_s=0.05, timeout_s=5.0):
+        self.arquivo = arquivo
+        self.periodo_s = periodo_s
+        self.timeout_s = timeout_s
+        self.esperas_ms = []
+        self.estouros = 0   # "database is locked" depois do busy_timeout
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def _rodar(self):
+        import sqlite3
+        conexao = sqlite3.connect(self.arquivo, timeout=self.timeout_s, isolation_level=None)
+        try:
+            while not self._parar.wait(self.periodo_s):
+                inicio = time.perf_counter()
+                try:
+                    conexao.execute("BEGIN IMMEDIATE")
+                except sqlite3.OperationalError:
+                    self.estouros += 1
+                    continue
+                self.esperas_ms.append((time.perf_counter() - inicio) * 1000)
+                conexao.execute("ROLLBACK")
+        finally:
+            conexao.close()
+
+    def resultado(self):
+        esperas = sorted(self.esperas_ms)
+        return {
+            "amostras": len(esperas),
+            "espera_p50_ms": round(_percentil(esperas, 0.50), 3),
+            "espera_p99_ms": round(_percentil(esperas, 0.99), 3),
+            "espera_max_ms": round(esperas[-1], 3) if esperas else 0.0,
+            "ocupado": round(sum(e > 1 for e in esperas) / len(esperas), 4) if esperas else 0.0,
+            "estouros": self.estouros,
+        }
+
+async def _placas(url, args):
+    """
+    Laço aberto: cada placa manda no seu relógio (a cada intervalo_s, com
+    fase aleatória), esteja a API rápida ou não; um envio que volta depois
+    do próximo horário conta como atraso e o seguinte sai na hora.
+    """
+    import httpx
+    latencias, erros, contagem = [], Counter(), Counter()
+    fim = time.monotonic() + args.segundos
+    rota = "/esp32/leitura" if args.lote == 1 else "/esp32/leituras/lote"
+    limites = httpx.Limits(max_connections=args.placas, max_keepalive_connections=args.placas)
+    async with httpx.AsyncClient(base_url=url, limits=limites, timeout=args.timeout) as http:
+        async def placa(i):
+            rng = random.Random(i)
+            device_id, seq = f"bench-{i:04d}", 0
+            proximo = time.monotonic() + rng.uniform(0, args.intervalo_s)
+            while True:
+                espera = proximo - time.monotonic()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                if time.monotonic() >= fim:
+                    return
+                leituras = []
+                for _ in range(args.lote):
+                    leituras.append({**payload_arduino(rng), "device_id": device_id, "seq": seq})
+                    seq += 1
+                inicio = time.perf_counter()
+                try:
+                    r = await http.post(rota, json=leituras[0] if args.lote == 1 else leituras)
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+                    contagem["requisicoes"] += 1
+                    if r.status_code in (200, 202):
+                        contagem["leituras"] += args.lote
+                    else:
+                        erros[str(r.status_code)] += 1
+                except httpx.HTTPError as e:
+                    contagem["requisicoes"] += 1
+                    erros[type(e).__name__] += 1
+                proximo += args.intervalo_s
+                if proximo < time.monotonic():
+                    contagem["atrasos"] += 1
+                    proximo = time.monotonic()
+        await asyncio.gather(*(placa(i) for i in range(args.placas)))
+    return sorted(latencias), erros, contagem
+
+def _rodada_frota(url, args, arquivo_db=None):
+    import httpx
+    sonda = SondaLock(arquivo_db) if arquivo_db else None
+    if sonda is not None:
+        sonda.iniciar()
+    inicio = time.perf_counter()
+    try:
+        latencias, erros, contagem = asyncio.run(_placas(url, args))
+    finally:
+        if sonda is not None:
+            sonda.parar()
+    segundos = time.perf_counter() - inicio
+    servidor = httpx.get(f"{url}/esp32/ingestao", timeout=30).json()
+    requisicoes = contagem["requisicoes"]
+    return {
+        "config": {
+            "placas": args.placas, "intervalo_s": args.intervalo_s, "lote": args.lote,
+            "segundos": args.segundos, "perfil": args.perfil, "assincrono": args.assincrono,
+            "ingestao_assincrona": args.ingestao_assincrona,
+            "oferecido_leituras_s": round(args.placas * args.lote / args.intervalo_s, 1),
+        },
+        "requisicoes_s": round(requisicoes / segundos, 1),
+        "leituras_s": round(contagem["leituras"] / segundos, 1),
+        "latencia_ms": {
+            "p50": round(_percentil(latencias, 0.50), 2),
+            "p95": round(_percentil(latencias, 0.95), 2),
+            "p99": round(_percentil(latencias, 0.99), 2),
+            "max": round(latencias[-1], 2) if latencias else 0.0,
+        },
+        "taxa_erro": round(sum(erros.values()) / requisicoes, 4) if requisicoes else 0.0,
+        "erros": dict(erros),
+        "atrasos": contagem["atrasos"],
+        "lock_sqlite": sonda.resultado() if sonda is not None else None,
+        "servidor": {
+            "recusadas_429": servidor["admissao"]["dispositivos"]["recusadas"]
+                             + servidor["admissao"]["inferencia"]["recusadas"],
+            "repetidas": servidor["idempotencia"]["repetidas_janela"] + servidor["idempotencia"]["repetidas_banco"],
+            **({"fila_max_ms_commit": servidor["latencia_commit_ms"]["max"],
+                "recusadas_fila_cheia": servidor["recusadas_fila_cheia"]}
+               if servidor["modo"] == "assincrono" else {}),
+        },
+    }
+
+# (caminho, maior é melhor) das métricas comparadas com a linha de base
+METRICAS_FROTA = [
+    ("requisicoes_s", True), ("leituras_s", True),
+    ("latencia_ms.p50", False), ("latencia_ms.p95", False), ("latencia_ms.p99", False),
+    ("latencia_ms.max", False), ("taxa_erro", False), ("atrasos", False),
+    ("lock_sqlite.espera_p50_ms", False), ("lock_sqlite.espera_p99_ms", False),
+    ("lock_sqlite.ocupado", False), ("lock_sqlite.estouros", False),
+]
+
+def _valor(resultado, caminho):
+    for chave in caminho.split("."):
+        if not isinstance(resultado, dict) or chave not in resultado:
+            return None
+        resultado = resultado[chave]
+    return resultado
+
+def _imprimir_frota(r):
+    l = r["latencia_ms"]
+    print(f"{r['requisicoes_s']:8.1f} req/s  {r['leituras_s']:8.1f} leituras/s  "
+          f"p50 {l['p50']:7.1f} ms  p95 {l['p95']:7.1f} ms  p99 {l['p99']:7.1f} ms  max {l['max']:7.1f} ms")
+    print(f"erros {r['taxa_erro']:.2%} {r['erros'] or ''}  atrasos {r['atrasos']}  servidor {r['servidor']}")
+    if r["lock_sqlite"] is not None:
+        s = r["lock_sqlite"]
+        print(f"lock SQLite: espera p50 {s['espera_p50_ms']} ms  p99 {s['espera_p99_ms']} ms  "
+              f"max {s['espera_max_ms']} ms  ocupado {s['ocupado']:.1%}  estouros {s['estouros']}  "
+              f"({s['amostras']} amostras)")
+
+def _comparar_frota(base, atual):
+    if base["config"] != atual["config"]:
+        print(f"aviso: configuração diferente da linha de base {base['config']}")
+    print(f"{'métrica':<28} {'base':>12} {'atual':>12} {'variação':>10}")
+    for caminho, maior_melhor in METRICAS_FROTA:
+        antes, agora = _valor(base, caminho), _valor(atual, caminho)
+        if antes is None or agora is None:
+            continue
+        variacao = (agora - antes) / antes if antes else (0.0 if agora == antes else float("inf"))
+        piorou = variacao < 0 if maior_melhor else variacao > 0
+        marca = "  pior" if piorou and abs(variacao) >= 0.1 else ""
+        print(f"{caminho:<28} {antes:>12} {agora:>12} {variacao:>+10.1%}{marca}")
+
+def bench_frota(args):
+    print(f"{args.placas} placas, {args.lote} leitura(s) a cada {args.intervalo_s} s por placa "
+          f"({args.placas * args.lote / args.intervalo_s:.1f} leituras/s oferecidas), {args.segundos:.0f} s")
+    if args.url is not None:
+        resultado = _rodada_frota(args.url.rstrip("/"), args, args.db)
+    else:
+        with tempfile.TemporaryDirectory() as pasta:
+            processo, url = _subir_api(
+                pasta, args.assincrono, args.perfil,
+                ECOVITA_INGESTAO_ASSINCRONA="1" if args.ingestao_assincrona else "0")
+            try:
+                resultado = _rodada_frota(url, args, os.path.join(pasta, "bench.db"))
+            finally:
+                processo.terminate()
+                processo.wait()
+    _imprimir_frota(resultado)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            _comparar_frota(json.load(f), resultado)
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"linha de base salva em {args.salvar}")
+
+# -------------------------
+# metricas: custo da instrumentação de GET /metrics por requisição
+# -------------------------
+class _Rota:
+    path = "/esp32/leitura"
+
+async def _app_vazia(scope, receive, send):
+    scope["route"] = _Rota  # o que o roteador do FastAPI faz ao casar a rota
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+async def _chamar_asgi(app, n):
+    scope = {"type": "http", "method": "POST", "path": "/esp32/leitura"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(mensagem):
+        pass
+
+    inicio = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - inicio) / n
+
+def bench_metricas(args):
+    metricas = Metricas()
+    medida = MedirRequisicoes(_app_vazia, metricas)
+    sem = asyncio.run(_chamar_asgi(_app_vazia, args.repeticoes))
+    com = asyncio.run(_chamar_asgi(medida, args.repeticoes))
+    middleware = (com - sem) * 1e6
+
+    def etapa(_):
+        with metricas.etapa("ml2"):
+            pass
+    etapa_us = _cronometrar(etapa, None, args.repeticoes) * 1e6
+
+    # before_commit + after_commit das sessões: um dict e uma observação
+    class _Sessao:
+        info = {}
+    antes = lambda db: db.info.__setitem__("metricas_commit", time.perf_counter())
+    def depois(db):
+        metricas.observar_etapa("commit", time.perf_counter() - db.info.pop("metricas_commit"))
+    commit_us = _cronometrar(lambda db: (antes(db), depois(db)), _Sessao, args.repeticoes) * 1e6
+
+    # Uma leitura em /esp32/leitura: middleware + commit da leitura + ml2 + ml3 (com o commit do ML-3)
+    total = middleware + 2 * commit_us + 2 * etapa_us
+    print(f"{'middleware por requisição':<36} {middleware:8.2f} µs")
+    print(f"{'etapa (ml1/ml2/ml3)':<36} {etapa_us:8.2f} µs")
+    print(f"{'commit (before + after_commit)':<36} {commit_us:8.2f} µs")
+    print(f"{'POST /esp32/leitura completo':<36} {total:8.2f} µs")
+
+    for i in range(args.rotas):
+        for status in (200, 404, 429):
+            metricas.requisicao("GET", f"/rota/{i}", status, 0.01)
+    scrape = _cronometrar(lambda _: metricas.texto(), None, 200) * 1000
+    print(f"{f'scrape com {args.rotas} rotas':<36} {scrape:8.2f} ms")
+
+# -------------------------
+# CLI
+# -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do backend Ecovita")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("lote", help="ingestão uma-a-uma x em lote")
+    p.add_argument("--linhas", type=int, default=2000)
+    p.add_argument("--tamanho", type=int, default=100, help="leituras por lote")
+    p.add_argument("--perfil", choices=list(PERFIS_SQLITE), default="padrao")
+    p.set_defaults(func=bench_lote)
+
+    p = sub.add_parser("sqlite", help="leitura/escrita concorrentes por perfil do SQLite")
+    p.add_argument("--segundos", type=float, default=5)
+    p.add_argument("--escritores", type=int, default=2)
+    p.add_argument("--leitores", type=int, default=4)
+    p.add_argument("--lote", type=int, default=10, help="leituras por commit")
+    p.add_argument("--semente", type=int, default=5000, help="leituras pré-carregadas")
+    p.set_defaults(func=bench_sqlite)
+
+    p = sub.add_parser("formato", help="tamanho e custo de parse: JSON x binário")
+    p.add_argument("--lote", type=int, default=1, help="leituras por requisição")
+    p.add_argument("--kbps", type=float, default=250, help="taxa útil do enlace para estimar o tempo de rádio")
+    p.add_argument("--repeticoes", type=int, default=20000)
+    p.set_defaults(func=bench_formato)
+
+    p = sub.add_parser("serializacao", help="JSON das rotas de listagem: ORM genérico x esquemas Pydantic/orjson")
+    p.add_argument("--itens", type=int, default=1000, help="leituras por página (LIMITE_MAX)")
+    p.add_argument("--repeticoes", type=int, default=50)
+    p.set_defaults(func=bench_serializacao)
+
+    p = sub.add_parser("linhas", help="frota de dispositivos no protocolo de linhas TCP/UDP")
+    p.add_argument("--dispositivos", type=int, default=200)
+    p.add_argument("--leituras", type=int, default=50, help="leituras por dispositivo")
+    p.add_argument("--intervalo-ms", type=float, default=0, help="pausa entre leituras de um dispositivo")
+    p.add_argument("--protocolo", choices=["tcp", "udp"], default="tcp")
+    p.add_argument("--perfil", choices=list(PERFIS_SQLITE), default="wal")
+    p.add_argument("--host", help="ouvinte já no ar (API com ECOVITA_LINHAS_TCP/UDP); sem ele, sobe um local")
+    p.add_argument("--porta", type=int)
+    p.set_defaults(func=bench_linhas)
+
+    p = sub.add_parser("concorrencia", help="API no uvicorn: rotas síncronas x ECOVITA_DB_ASSINCRONO=1")
+    p.add_argument("--clientes", type=int, nargs="+", default=[10, 50, 200, 500],
+                   help="níveis de concorrência (clientes simultâneos)")
+    p.add_argument("--segundos", type=float, default=10, help="duração de cada nível")
+    p.add_argument("--escritas", type=float, default=0.5, help="fração de POSTs")
+    p.add_argument("--perfil", choices=list(PERFIS_SQLITE), default="wal")
+    p.set_defaults(func=bench_concorrencia)
+
+    p = sub.add_parser("frota", help="placas virtuais a taxa fixa contra a API; salva/compara linha de base")
+    p.add_argument("--placas", type=int, default=100)
+    p.add_argument("--intervalo-s", type=float, default=1.0, help="segundos entre envios de uma placa")
+    p.add_argument("--lote", type=int, default=1, help="leituras por envio (>1 usa /esp32/leituras/lote)")
+    p.add_argument("--segundos", type=float, default=30)
+    p.add_argument("--timeout", type=float, default=10, help="timeout do POST, como o do esp.py")
+    p.add_argument("--perfil", choices=list(PERFIS_SQLITE), default="wal")
+    p.add_argument("--assincrono", action="store_true", help="API com ECOVITA_DB_ASSINCRONO=1")
+    p.add_argument("--ingestao-assincrona", action="store_true", help="API com ECOVITA_INGESTAO_ASSINCRONA=1")
+    p.add_argument("--url", help="API já no ar; sem ela, sobe uma local com banco temporário")
+    p.add_argument("--db", help="arquivo SQLite da API em --url, para a sonda de lock")
+    p.add_argument("--salvar", metavar="ARQUIVO", help="grava o resultado em JSON (linha de base)")
+    p.add_argument("--comparar", metavar="ARQUIVO", help="linha de base salva para comparar")
+    p.set_defaults(func=bench_frota)
+
+    p = sub.add_parser("metricas", help="custo por requisição da instrumentação de GET /metrics")
+    p.add_argument("--repeticoes", type=int, default=200000)
+    p.add_argument("--rotas", type=int, default=40, help="rotas distintas no scrape")
+    p.set_defaults(func=bench_metricas)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# binario.py
+# Formato binário compacto das leituras do Mega (ESP32 -> API), alternativo
+# ao JSON de ~700 bytes que o arduino.c++ imprime por leitura.
+#
+# Cabeçalho "<BH": versão, quantidade de registros. Registros (little-endian):
+#   v1  leitura "<hHHB11I": temperatura °C x100 (int16), umidade % x100 (uint16),
+#       pH x100 (uint16), umidade do solo % (uint8), ppm x100 (uint32) de cada
+#       composto de GASES_ARDUINO
+#   v2  resumo de um intervalo agregado no ESP32: "<H" amostras brutas +
+#       quatro blocos no layout v1 (média, mínimo, máximo, último)
+#   v3  registros v2 precedidos de "<16sI": device_id (ASCII, completado com
+#       zeros) e seq do primeiro registro; o registro i tem seq + i
+# Campo ausente = maior valor do tipo. O encoder do ESP32 (esp.py) segue o
+# mesmo layout; qualquer mudança de campos exige uma nova versão.
+
+import struct
+
+from bd import GASES_ARDUINO
+
+TIPO_BINARIO = "application/vnd.ecovita.leituras"
+VERSAO = 1
+
+CABECALHO = struct.Struct("<BH")
+_CAMPOS_LEITURA = "hHHB%dI" % len(GASES_ARDUINO)
+LEITURA_V1 = struct.Struct("<" + _CAMPOS_LEITURA)
+RESUMO_V2 = struct.Struct("<H" + _CAMPOS_LEITURA * 4)
+ORIGEM_V3 = struct.Struct("<16sI")
+ESTATISTICAS_V2 = ("media", "min", "max", "ultimo")
+# (campo, escala, mínimo, ausente) na ordem do struct; ausente = maior valor do tipo
+CAMPOS_V1 = (
+    ("temperatura", 100, -0x8000, 0x7FFF),
+    ("umidade", 100, 0, 0xFFFF),
+    ("ph", 100, 0, 0xFFFF),
+    ("umidSolo", 1, 0, 0xFF),
+)
+PPM_V1 = (100, 0, 0xFFFFFFFF)
+_AUSENTES = [limites[-1] for _, *limites in CAMPOS_V1]
+
+
+class FormatoInvalido(ValueError):
+    """Corpo binário truncado, com versão desconhecida ou tamanho errado."""
+
+
+def _para_inteiro(valor, escala, minimo, ausente):
+    if valor is None:
+        return ausente
+    return max(minimo, min(ausente - 1, round(valor * escala)))
+
+
+def codificar(dados):
+    """Lista de leituras (dicts no formato do Mega) -> bytes da versão atual."""
+    partes = [CABECALHO.pack(VERSAO, len(dados))]
+    for dado in dados:
+        gases = dado.get("gases") or []
+        ppm = {g.get("composto"): g.get("ppm") for g in gases} if isinstance(gases, list) else gases
+        partes.append(LEITURA_V1.pack(
+            *(_para_inteiro(dado.get(campo), *limites) for campo, *limites in CAMPOS_V1),
+            *(_para_inteiro(ppm.get(nome), *PPM_V1) for nome in GASES_ARDUINO),
+        ))
+    return b"".join(partes)
+
+def _leitura(valores):
+    temperatura, umidade, ph, umid_solo = valores[:4]
+    ausentes = _AUSENTES
+    return {
+        "temperatura": None if temperatura == ausentes[0] else temperatura / 100,
+        "umidade": None if umidade == ausentes[1] else umidade / 100,
+        "ph": None if ph == ausentes[2] else ph / 100,
+        "umidSolo": None if umid_solo == ausentes[3] else umid_solo,
+        # dict composto -> ppm, o outro formato aceito em SensorLeitura.gases
+        "gases": {nome: v / 100 for nome, v in zip(GASES_ARDUINO, valores[4:]) if v != PPM_V1[2]},
+    }
+
+def _resumo(valores):
+    # Campos principais = médias; os demais blocos vão em min/max/ultimo
+    n = len(CAMPOS_V1) + len(GASES_ARDUINO)
+    blocos = [_leitura(valores[1 + i * n:1 + (i + 1) * n]) for i in range(len(ESTATISTICAS_V2))]
+    dado = blocos[0]
+    dado["amostras"] = valores[0]
+    dado.update(zip(ESTATISTICAS_V2[1:], blocos[1:]))
+    return dado
+
+# versão -> (preâmbulo depois do cabeçalho, registro, montagem do dict)
+FORMATOS = {1: (None, LEITURA_V1, _leitura), 2: (None, RESUMO_V2, _resumo), 3: (ORIGEM_V3, RESUMO_V2, _resumo)}
+
+def decodificar(corpo):
+    """bytes -> lista de dicts no formato aceito pelas rotas JSON."""
+    if len(corpo) < CABECALHO.size:
+        raise FormatoInvalido("corpo menor que o cabeçalho")
+    versao, quantidade = CABECALHO.unpack_from(corpo)
+    if versao not in FORMATOS:
+        raise FormatoInvalido(f"versão {versao} não suportada")
+    preambulo, registro, montar = FORMATOS[versao]
+    inicio = CABECALHO.size + (preambulo.size if preambulo else 0)
+    if len(corpo) != inicio + quantidade * registro.size:
+        raise FormatoInvalido(f"tamanho {len(corpo)} não corresponde a {quantidade} registros v{versao}")
+    dados = [montar(valores) for valores in registro.iter_unpack(memoryview(corpo)[inicio:])]
+    if preambulo is not None:
+        device_id, seq = preambulo.unpack_from(corpo, CABECALHO.size)
+        try:
+            device_id = device_id.rstrip(b"\0").decode("ascii")
+        except UnicodeDecodeError:
+            raise FormatoInvalido("device_id deve ser ASCII")
+        for i, dado in enumerate(dados):
+            dado["device_id"], dado["seq"] = device_id, seq + i
+    return dados
@@ -0,0 +1,157 @@
+# cache.py
+# Cache de respostas das rotas de leitura que mudam pouco (/site_dados,
+# /ml_resultados). Cada tabela tem uma versão em memória, incrementada no
+# commit de qualquer sessão que gravou nela; uma entrada do cache guarda o
+# corpo JSON já serializado, o ETag (hash do corpo) e as versões das tabelas
+# de que depende. Se nenhuma mudou, a rota responde sem consultar o banco:
+# 304 se o cliente mandou o mesmo ETag em If-None-Match, senão o corpo guardado.
+#
+# As versões são do processo: com vários workers, cada um invalida só o que
+# ele mesmo gravou. Gravações fora do ORM (SQL direto) não invalidam.
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from fastapi import Response
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+CACHE_MAX = int(os.getenv("ECOVITA_CACHE_MAX", "256"))   # respostas guardadas (LRU)
+
+
+class VersoesTabelas:
+    """Versão por tabela, incrementada no commit das sessões que a alteraram."""
+
+    def __init__(self):
+        self._versoes = {}
+        self._lock = threading.Lock()
+
+    def de(self, tabelas):
+        return tuple(self._versoes.get(t, 0) for t in tabelas)
+
+    def incrementar(self, tabelas):
+        with self._lock:
+            for t in tabelas:
+                self._versoes[t] = self._versoes.get(t, 0) + 1
+
+
+versoes = VersoesTabelas()
+
+@event.listens_for(Session, "after_flush")
+def _anotar_tabelas(session, contexto):
+    alteradas = session.info.setdefault("tabelas_alteradas", set())
+    for objeto in (*session.new, *session.dirty, *session.deleted):
+        tabela = getattr(objeto, "__tablename__", None)
+        if tabela:
+            alteradas.add(tabela)
+
+@event.listens_for(Session, "after_commit")
+def _invalidar(session):
+    alteradas = session.info.pop("tabelas_alteradas", None)
+    if alteradas:
+        versoes.incrementar(alteradas)
+
+@event.listens_for(Session, "after_rollback")
+def _descartar(session):
+    session.info.pop("tabelas_alteradas", None)
+
+
+class _Entrada:
+    __slots__ = ("versao", "etag", "corpo")
+
+    def __init__(self, versao, etag, corpo):
+        self.versao = versao
+        self.etag = etag
+        self.corpo = corpo
+
+
+class CacheRespostas:
+    def __init__(self, tamanho=CACHE_MAX):
+        self.tamanho = tamanho
+        self._entradas = OrderedDict()
+        self._adaptadores = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.nao_modificadas = 0   # 304
+        self.acertos = 0           # corpo servido da memória
+        self.falhas = 0            # consulta + serialização
+
+    def _adaptador(self, modelo):
+        adaptador = self._adaptadores.get(modelo)
+        if adaptador is None:
+            adaptador = self._adaptadores[modelo] = TypeAdapter(modelo)
+        return adaptador
+
+    def responder(self, request, tabelas, modelo, gerar):
+        """
+        Resposta da rota para request: gerar() só roda se o cache não tiver
+        uma entrada válida para (rota, parâmetros). modelo é o response_model
+        usado para serializar o resultado de gerar().
+        """
+        chave, versao, resposta = self._buscar(request, tabelas)
+        if resposta is not None:
+            return resposta
+        return self._guardar(request, chave, versao, modelo, gerar())
+
+    async def responder_async(self, request, tabelas, modelo, gerar):
+        """Mesmo que responder, com gerar() sendo uma corrotina (rotas com AsyncSession)."""
+        chave, versao, resposta = self._buscar(request, tabelas)
+        if resposta is not None:
+            return resposta
+        return self._guardar(request, chave, versao, modelo, await gerar())
+
+    def _buscar(self, request, tabelas):
+        chave = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        versao = versoes.de(tabelas)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada.versao == versao:
+                self._entradas.move_to_end(chave)
+            else:
+                entrada = None
+        if entrada is None:
+            return chave, versao, None
+        cabecalhos = {"Cache-Control": "no-cache", "ETag": entrada.etag}
+        if _casa(entrada.etag, request.headers.get("if-none-match")):
+            self.nao_modificadas += 1
+            return chave, versao, Response(status_code=304, headers=cabecalhos)
+        self.acertos += 1
+        return chave, versao, Response(entrada.corpo, media_type="application/json", headers=cabecalhos)
+
+    def _guardar(self, request, chave, versao, modelo, resultado):
+        self.falhas += 1
+        adaptador = self._adaptador(modelo)
+        corpo = adaptador.dump_json(adaptador.validate_python(resultado, from_attributes=True))
+        entrada = _Entrada(versao, '"%s"' % hashlib.blake2b(corpo, digest_size=12).hexdigest(), corpo)
+        with self._lock:
+            self._entradas[chave] = entrada
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho:
+                self._entradas.popitem(last=False)
+        cabecalhos = {"Cache-Control": "no-cache", "ETag": entrada.etag}
+        # Conteúdo igual ao que o cliente já tem (ex.: a escrita não afetou esta página)
+        if _casa(entrada.etag, request.headers.get("if-none-match")):
+            self.nao_modificadas += 1
+            return Response(status_code=304, headers=cabecalhos)
+        return Response(corpo, media_type="application/json", headers=cabecalhos)
+
+    def status(self):
+        return {
+            "entradas": len(self._entradas),
+            "capacidade": self.tamanho,
+            "nao_modificadas_304": self.nao_modificadas,
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+        }
+
+
+def _casa(etag, if_none_match):
+    """Comparação fraca do If-None-Match (W/ ignorado; "*" casa com qualquer ETag)."""
+    if not if_none_match:
+        return False
+    etags = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+    return "*" in etags or etag in etags
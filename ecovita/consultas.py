@@ -0,0 +1,447 @@
+# consultas.py
+# Camada de consultas da API Ecovita: filtros aplicados no SQLite e
+# paginação por cursor (keyset) sobre (data_registro, id), para que cada
+# página custe o mesmo independentemente do tamanho do histórico.
+# Leituras já movidas para o arquivo frio (arquivo.py) entram intercaladas
+# nas páginas, exportações e agregações brutas.
+
+import base64
+import csv
+import heapq
+import io
+import json
+from datetime import datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import DateTime, bindparam, select, text, tuple_
+
+from arquivo import COLUNAS_SENSOR, agregar_arquivadas, agregar_gases_arquivados
+from bd import ROLLUPS, sql_extremos
+
+LIMITE_PADRAO = 100
+LIMITE_MAX = 1000
+
+
+# -------------------------
+# Cursor opaco: base64("<data_registro ISO>|<id>")
+# -------------------------
+def codificar_cursor(data_registro, id_):
+    bruto = f"{data_registro.isoformat()}|{id_}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    """Levanta ValueError se o cursor não foi gerado por codificar_cursor."""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        data, id_ = bruto.split("|")
+        return datetime.fromisoformat(data), int(id_)
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+# -------------------------
+# Filtros
+# -------------------------
+def filtrar(query, modelo, id_teste=None, de=None, ate=None, faixas=None, device_id=None):
+    """
+    Aplica os filtros comuns às tabelas com data_registro.
+    faixas: {"coluna": (mínimo, máximo)}, qualquer extremo pode ser None.
+    device_id restringe a uma pilha (índices (device_id, data_registro)).
+    """
+    if id_teste is not None:
+        query = query.filter(modelo.id_teste == id_teste)
+    if device_id is not None:
+        query = query.filter(modelo.device_id == device_id)
+    if de is not None:
+        query = query.filter(modelo.data_registro >= de)
+    if ate is not None:
+        query = query.filter(modelo.data_registro < ate)
+    for coluna, (minimo, maximo) in (faixas or {}).items():
+        if minimo is not None:
+            query = query.filter(getattr(modelo, coluna) >= minimo)
+        if maximo is not None:
+            query = query.filter(getattr(modelo, coluna) <= maximo)
+    return query
+
+def filtrar_gas(query, modelo, gas, minimo=None, maximo=None):
+    """Mantém as leituras cujo composto gas está na faixa [minimo, maximo] ppm."""
+    from bd import Gas, LeituraGas
+    ids = select(LeituraGas.id_leitura).join(Gas).where(Gas.nome == gas)
+    if minimo is not None:
+        ids = ids.where(LeituraGas.ppm >= minimo)
+    if maximo is not None:
+        ids = ids.where(LeituraGas.ppm <= maximo)
+    return query.filter(modelo.id.in_(ids))
+
+
+# -------------------------
+# Paginação keyset
+# -------------------------
+def consulta_pagina(query, modelo, cursor=None, limite=LIMITE_PADRAO):
+    """A query de uma página (limite + 1 linhas), sem executar."""
+    if cursor:
+        data, id_ = decodificar_cursor(cursor)
+        query = query.filter(tuple_(modelo.data_registro, modelo.id) > tuple_(data, id_))
+    return query.order_by(modelo.data_registro, modelo.id).limit(limite + 1)
+
+def paginar(query, modelo, cursor=None, limite=LIMITE_PADRAO, arquivadas=None):
+    """
+    Retorna (itens, next_cursor) em ordem crescente de (data_registro, id).
+    Busca limite + 1 linhas só para saber se existe próxima página.
+    A comparação por row value (data, id) > (?, ?) vira uma busca por
+    faixa nos índices (id_teste, data_registro) / (device_id, data_registro, id)
+    / (data_registro, id).
+    arquivadas(depois) -> tuplas de COLUNAS_SENSOR do arquivo frio após
+    o cursor, na mesma ordem; são intercaladas com as linhas do SQLite.
+    """
+    itens = consulta_pagina(query, modelo, cursor, limite).all()
+    frias = None
+    if arquivadas is not None:
+        depois = decodificar_cursor(cursor) if cursor else None
+        frias = islice(arquivadas(depois), limite + 1)
+    return _fechar_pagina(itens, frias, modelo, limite)
+
+async def paginar_async(db, consulta, modelo, cursor=None, limite=LIMITE_PADRAO, arquivadas=None):
+    """
+    paginar para um select() executado numa AsyncSession. Aqui
+    arquivadas(sessao, depois) recebe a sessão síncrona por trás da
+    AsyncSession (run_sync), porque o catálogo do arquivo frio é lido
+    pelo ORM síncrono; os Parquet locais são lidos no próprio event loop.
+    """
+    itens = (await db.scalars(consulta_pagina(consulta, modelo, cursor, limite))).all()
+    frias = None
+    if arquivadas is not None:
+        depois = decodificar_cursor(cursor) if cursor else None
+        frias = await db.run_sync(lambda sessao: list(islice(arquivadas(sessao, depois), limite + 1)))
+    return _fechar_pagina(itens, frias, modelo, limite)
+
+def _fechar_pagina(itens, frias, modelo, limite):
+    frias = [modelo(**dict(zip(COLUNAS_SENSOR, l))) for l in frias or ()]
+    if frias:
+        itens = list(islice(heapq.merge(frias, itens, key=lambda l: (l.data_registro, l.id)), limite + 1))
+    if len(itens) <= limite:
+        return itens, None
+    ultimo = itens[limite - 1]
+    return itens[:limite], codificar_cursor(ultimo.data_registro, ultimo.id)
+
+
+# -------------------------
+# Exportação em streaming
+# -------------------------
+COLUNAS_EXPORTACAO = [
+    "id", "id_teste", "temperatura", "umidade", "o2", "ph", "gases", "data_registro", "amostras",
+    "temperatura_min", "temperatura_max", "umidade_min", "umidade_max", "ph_min", "ph_max",
+    "device_id", "seq",
+]
+BLOCO_EXPORTACAO = 2000   # linhas lidas do SQLite por vez
+
+def _linha_ndjson(valores):
+    registro = dict(zip(COLUNAS_EXPORTACAO, valores))
+    registro["gases"] = json.loads(registro["gases"]) if registro["gases"] else None
+    registro["data_registro"] = registro["data_registro"].isoformat() if registro["data_registro"] else None
+    return json.dumps(registro, ensure_ascii=False) + "\n"
+
+def _blocos(linhas):
+    linhas = iter(linhas)
+    while True:
+        bloco = list(islice(linhas, BLOCO_EXPORTACAO))
+        if not bloco:
+            return
+        yield bloco
+
+def exportar_leituras(query, formato="ndjson", arquivadas=None):
+    """
+    Gera o conteúdo da exportação em blocos de texto (NDJSON ou CSV).
+    query deve selecionar as COLUNAS_EXPORTACAO ordenadas por
+    (data_registro, id); as linhas são lidas com yield_per, então só um
+    bloco fica em memória por vez. arquivadas: tuplas do arquivo frio na
+    mesma ordem, intercaladas com as do SQLite.
+    """
+    linhas = query.yield_per(BLOCO_EXPORTACAO)
+    if arquivadas is not None:
+        i_data, i_id = COLUNAS_EXPORTACAO.index("data_registro"), COLUNAS_EXPORTACAO.index("id")
+        linhas = heapq.merge(arquivadas, linhas, key=lambda l: (l[i_data], l[i_id]))
+    if formato == "csv":
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        yield buffer.getvalue()
+        for bloco in _blocos(linhas):
+            buffer.seek(0)
+            buffer.truncate()
+            escritor.writerows(bloco)
+            yield buffer.getvalue()
+    else:
+        for bloco in _blocos(linhas):
+            yield "".join(_linha_ndjson(linha) for linha in bloco)
+
+
+# -------------------------
+# Agregação por intervalo de tempo (calculada no SQLite)
+# -------------------------
+# data_registro é gravado como 'AAAA-MM-DD HH:MM:SS.ffffff'; o prefixo
+# do texto já é a chave do intervalo, sem precisar de strftime por linha.
+TAMANHO_BUCKET = {"1m": 16, "1h": 13, "1d": 10}
+CAMPOS_AGREGADOS = ["temperatura", "umidade", "ph", "covs"]
+
+SQL_AGREGADO = """
+WITH base AS (
+    SELECT s.id, substr(s.data_registro, 1, :tamanho) AS bucket,
+           s.amostras, s.temperatura, s.umidade, s.ph, {extremos},
+           (SELECT SUM(g.ppm) FROM leitura_gases AS g WHERE g.id_leitura = s.id) AS covs
+      FROM sensor_leituras AS s
+     WHERE {filtros}
+),
+agregado AS (
+    SELECT bucket, SUM(amostras) AS n, MAX(id) AS ultimo_id,
+           {colunas}
+      FROM base
+     GROUP BY bucket
+)
+SELECT a.*, {ultimos}
+  FROM agregado AS a JOIN base AS u ON u.id = a.ultimo_id
+ ORDER BY a.bucket
+"""
+
+def agregar_leituras(db, bucket="1h", id_teste=None, de=None, ate=None, device_id=None):
+    """
+    count/min/max/mean/last por intervalo, em arrays colunares prontos para
+    o Plotly, varrendo sensor_leituras e o arquivo frio (valores exatos
+    para qualquer faixa de/ate). "last" é a leitura de maior id do intervalo.
+    count e mean contam as amostras brutas de cada resumo do ESP32, e
+    min/max usam os extremos do resumo.
+    """
+    filtros, params = _filtros_sql(TAMANHO_BUCKET[bucket], id_teste, de, ate, device_id)
+    sql = SQL_AGREGADO.format(
+        filtros=" AND ".join(filtros),
+        colunas=",\n           ".join(
+            f"MIN(COALESCE({c}_lo, {c})) AS {c}_min, MAX(COALESCE({c}_hi, {c})) AS {c}_max, "
+            f"SUM({c} * amostras) * 1.0 / SUM(CASE WHEN {c} IS NOT NULL THEN amostras END) AS {c}_mean, "
+            f"SUM({c} * amostras) AS {c}_soma, COALESCE(SUM(CASE WHEN {c} IS NOT NULL THEN amostras END), 0) AS {c}_n"
+            for c in CAMPOS_AGREGADOS
+        ),
+        extremos=sql_extremos(),
+        ultimos=", ".join(f"u.{c} AS {c}_last" for c in CAMPOS_AGREGADOS),
+    )
+    consulta = text(sql).bindparams(*(bindparam(p, type_=DateTime) for p in ("de", "ate") if p in params))
+    linhas = db.execute(consulta, params).mappings().all()
+    frias = agregar_arquivadas(db, TAMANHO_BUCKET[bucket], CAMPOS_AGREGADOS, id_teste, de, ate, device_id)
+    if frias:
+        linhas = _juntar_intervalos(linhas, frias)
+    return _colunar(bucket, linhas)
+
+def _filtros_sql(tamanho, id_teste=None, de=None, ate=None, device_id=None):
+    """Condições sobre sensor_leituras (alias s) e seus parâmetros, para os agregados em SQL."""
+    filtros, params = ["1 = 1"], {"tamanho": tamanho}
+    if id_teste is not None:
+        filtros.append("s.id_teste = :id_teste")
+        params["id_teste"] = id_teste
+    if device_id is not None:
+        filtros.append("s.device_id = :device_id")
+        params["device_id"] = device_id
+    if de is not None:
+        filtros.append("s.data_registro >= :de")
+        params["de"] = de
+    if ate is not None:
+        filtros.append("s.data_registro < :ate")
+        params["ate"] = ate
+    return filtros, params
+
+def _menor(*valores):
+    return min((v for v in valores if v is not None), default=None)
+
+def _maior(*valores):
+    return max((v for v in valores if v is not None), default=None)
+
+def _juntar_intervalos(*fontes):
+    """Soma as linhas de agregar_leituras e agregar_arquivadas do mesmo intervalo."""
+    por_bucket = {}
+    for linha in (l for fonte in fontes for l in fonte):
+        atual = por_bucket.setdefault(linha["bucket"], {"bucket": linha["bucket"], "n": 0, "ultimo_id": -1})
+        recente = linha["ultimo_id"] > atual["ultimo_id"]
+        atual["n"] += linha["n"]
+        atual["ultimo_id"] = max(atual["ultimo_id"], linha["ultimo_id"])
+        for c in CAMPOS_AGREGADOS:
+            atual[f"{c}_min"] = _menor(atual.get(f"{c}_min"), linha[f"{c}_min"])
+            atual[f"{c}_max"] = _maior(atual.get(f"{c}_max"), linha[f"{c}_max"])
+            atual[f"{c}_soma"] = (atual.get(f"{c}_soma") or 0) + (linha[f"{c}_soma"] or 0)
+            atual[f"{c}_n"] = atual.get(f"{c}_n", 0) + linha[f"{c}_n"]
+            if recente:
+                atual[f"{c}_last"] = linha[f"{c}_last"]
+    for atual in por_bucket.values():
+        for c in CAMPOS_AGREGADOS:
+            atual[f"{c}_mean"] = atual[f"{c}_soma"] / atual[f"{c}_n"] if atual[f"{c}_n"] else None
+    return sorted(por_bucket.values(), key=lambda l: l["bucket"])
+
+def _colunar(bucket, linhas):
+    resultado = {"bucket": bucket, "inicio": [l["bucket"] for l in linhas], "count": [l["n"] for l in linhas]}
+    for c in CAMPOS_AGREGADOS:
+        resultado[c] = {
+            "min": [l[f"{c}_min"] for l in linhas],
+            "max": [l[f"{c}_max"] for l in linhas],
+            "mean": [round(l[f"{c}_mean"], 3) if l[f"{c}_mean"] is not None else None for l in linhas],
+            "last": [l[f"{c}_last"] for l in linhas],
+        }
+    return resultado
+
+
+SQL_AGREGADO_GASES = """
+SELECT gs.nome AS gas, substr(s.data_registro, 1, :tamanho) AS bucket,
+       COUNT(*) AS n, MIN(g.ppm) AS ppm_min, MAX(g.ppm) AS ppm_max, AVG(g.ppm) AS ppm_mean
+  FROM leitura_gases AS g
+  JOIN gases AS gs ON gs.id = g.id_gas
+  JOIN sensor_leituras AS s ON s.id = g.id_leitura
+ WHERE {filtros}
+ GROUP BY gs.nome, bucket
+ ORDER BY gs.nome, bucket
+"""
+
+def agregar_gases(db, bucket="1h", gases=None, id_teste=None, de=None, ate=None, device_id=None):
+    """
+    count/min/max/mean de ppm por composto e intervalo, lidos de
+    leitura_gases e do arquivo frio: {composto: {"inicio": [...], "count": [...], ...}}.
+    """
+    filtros, params = _filtros_sql(TAMANHO_BUCKET[bucket], id_teste, de, ate, device_id)
+    if gases:
+        filtros.append("gs.nome IN :gases")
+        params["gases"] = list(gases)
+
+    tipos = [bindparam(p, type_=DateTime) for p in ("de", "ate") if p in params]
+    if gases:
+        tipos.append(bindparam("gases", expanding=True))
+    consulta = text(SQL_AGREGADO_GASES.format(filtros=" AND ".join(filtros))).bindparams(*tipos)
+    linhas = db.execute(consulta, params).mappings().all()
+    frias = agregar_gases_arquivados(db, TAMANHO_BUCKET[bucket], gases, id_teste, de, ate, device_id)
+    if frias:
+        juntas = {}
+        for l in [{**l, "ppm_soma": l["ppm_mean"] * l["n"]} for l in linhas] + frias:
+            atual = juntas.setdefault((l["gas"], l["bucket"]), {**l, "n": 0, "ppm_soma": 0.0})
+            atual["n"] += l["n"]
+            atual["ppm_soma"] += l["ppm_soma"]
+            atual["ppm_min"] = _menor(atual["ppm_min"], l["ppm_min"])
+            atual["ppm_max"] = _maior(atual["ppm_max"], l["ppm_max"])
+        linhas = [{**l, "ppm_mean": l["ppm_soma"] / l["n"]} for _, l in sorted(juntas.items())]
+
+    resultado = {}
+    for l in linhas:
+        serie = resultado.setdefault(l["gas"], {"inicio": [], "count": [], "min": [], "max": [], "mean": []})
+        serie["inicio"].append(l["bucket"])
+        serie["count"].append(l["n"])
+        serie["min"].append(l["ppm_min"])
+        serie["max"].append(l["ppm_max"])
+        serie["mean"].append(round(l["ppm_mean"], 3))
+    return {"bucket": bucket, "gases": resultado}
+
+
+SQL_AGREGADO_ROLLUP = """
+WITH r AS (
+    SELECT * FROM {tabela} WHERE {filtros}
+),
+agregado AS (
+    SELECT inicio AS bucket, SUM(n) AS n, MAX(ultimo_id) AS ultimo_id,
+           {colunas}
+      FROM r
+     GROUP BY inicio
+)
+SELECT a.*, {ultimos}
+  FROM agregado AS a JOIN r AS u ON u.inicio = a.bucket AND u.ultimo_id = a.ultimo_id
+ ORDER BY a.bucket
+"""
+
+def agregar_rollups(db, bucket="1h", id_teste=None, de=None, ate=None, device_id=None):
+    """
+    Mesmo formato de agregar_leituras, lendo as tabelas de rollup (uma
+    linha por teste, pilha e intervalo). de/ate são arredondados para o
+    intervalo que os contém.
+    """
+    modelo, tamanho = ROLLUPS[bucket]
+    filtros, params = ["1 = 1"], {}
+    if id_teste is not None:
+        filtros.append("id_teste = :id_teste")
+        params["id_teste"] = id_teste
+    if device_id is not None:
+        filtros.append("device_id = :device_id")
+        params["device_id"] = device_id
+    if de is not None:
+        filtros.append("inicio >= :de")
+        params["de"] = str(de)[:tamanho]
+    if ate is not None:
+        filtros.append("inicio <= :ate")
+        params["ate"] = str(ate)[:tamanho]
+
+    sql = SQL_AGREGADO_ROLLUP.format(
+        tabela=modelo.__tablename__,
+        filtros=" AND ".join(filtros),
+        colunas=",\n           ".join(
+            f"MIN({c}_min) AS {c}_min, MAX({c}_max) AS {c}_max, SUM({c}_soma) / SUM(n) AS {c}_mean"
+            for c in CAMPOS_AGREGADOS
+        ),
+        ultimos=", ".join(f"u.{c}_ultimo AS {c}_last" for c in CAMPOS_AGREGADOS),
+    )
+    return _colunar(bucket, db.execute(text(sql), params).mappings().all())
+
+
+# -------------------------
+# Verificação dos planos de consulta
+# -------------------------
+def plano(db, query):
+    """Linhas do EXPLAIN QUERY PLAN da query ORM no SQLite."""
+    compilado = query.statement.compile(dialect=db.get_bind().dialect)
+    params = tuple(
+        str(v) if isinstance(v, datetime) else v
+        for v in (compilado.params[p] for p in compilado.positiontup)
+    )
+    linhas = db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compilado), params).all()
+    return [linha[-1] for linha in linhas]
+
+def consultas_quentes(db):
+    """(descrição, query, índice esperado) das consultas mais frequentes da API."""
+    from bd import SensorLeitura, SiteDado, MLResultado, ML3Resultado
+    ontem = datetime.now().replace(microsecond=0) - timedelta(days=1)
+    cursor = codificar_cursor(ontem, 1)
+
+    def pagina(modelo, **filtros):
+        return consulta_pagina(filtrar(db.query(modelo), modelo, **filtros), modelo, cursor)
+
+    return [
+        ("últimas 24 h de um teste", pagina(SensorLeitura, id_teste=1, de=ontem), "ix_sensor_leituras_teste_data"),
+        ("página de leituras sem filtro", pagina(SensorLeitura), "ix_sensor_leituras_data_id"),
+        ("leituras de uma pilha", pagina(SensorLeitura, device_id="esp-1", de=ontem), "ix_sensor_leituras_device_data"),
+        ("site_dados de um teste", pagina(SiteDado, id_teste=1), "ix_site_dados_teste_data"),
+        ("ml_resultados de um teste", pagina(MLResultado, id_teste=1), "ix_ml_resultados_teste_data"),
+        ("ml_resultados de uma pilha", pagina(MLResultado, device_id="esp-1"), "ix_ml_resultados_device_data"),
+        ("ML-3 de uma leitura", db.query(ML3Resultado).filter(ML3Resultado.id_leitura == 1), "ix_ml3_resultados_leitura"),
+    ]
+
+def verificar_indices(db):
+    """Confere que cada consulta quente usa o índice esperado e não ordena em B-tree temporária."""
+    problemas = []
+    for descricao, query, indice in consultas_quentes(db):
+        passos = plano(db, query)
+        if not any(indice in p for p in passos):
+            problemas.append(f"{descricao}: não usa {indice}")
+        if any("TEMP B-TREE" in p for p in passos):
+            problemas.append(f"{descricao}: ordena em B-tree temporária")
+    return problemas
+
+
+if __name__ == "__main__":
+    # python consultas.py -> confere os planos no banco configurado (ECOVITA_DB)
+    import sys
+    from bd import SessionLocal, init_db
+
+    init_db()
+    db = SessionLocal()
+    try:
+        for descricao, query, _ in consultas_quentes(db):
+            print(f"{descricao}:")
+            for passo in plano(db, query):
+                print("   ", passo)
+        problemas = verificar_indices(db)
+    finally:
+        db.close()
+    for p in problemas:
+        print("❌", p)
+    if problemas:
+        sys.exit(1)
+    print("✅ Todas as consultas quentes usam índice")
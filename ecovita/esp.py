@@ -1,48 +1,499 @@
-import machine
 import time
-import network
-import urequests as requests
-import ujson as json
+
+try:  # ESP32 (MicroPython)
+    import machine
+    import network
+    import ujson as json
+    import ustruct as struct
+    import usocket as socket
+    import uos as os
+    import urandom as random
+except ImportError:  # CPython: mesmo cliente, testado contra uma API local
+    machine = network = None
+    import json
+    import struct
+    import socket
+    import os
+    import random
 
 # -------- CONFIGURAÇÕES DO WIFI --------
 SSID = "SEU_WIFI"
 PASSWORD = "SUA_SENHA_WIFI"
 
-# -------- URL DA API --------
-API_URL = "http://192.168.0.10:8000/esp32/leitura"  # Substitua pelo endpoint da sua API
+# -------- API --------
+API_HOST = "192.168.0.10"  # Substitua pelo endereço da sua API
+API_PORTA = 8000
+API_CAMINHO = "/esp32/leituras/bin"
+# Identifica o dispositivo na ingestão idempotente (até 16 caracteres ASCII);
+# None = MAC do ESP32 (machine.unique_id) ou o hostname no CPython
+DEVICE_ID = None
+
+# -------- BUFFER E ENVIO --------
+BUFFER_ARQUIVO = "buffer.bin"   # fila circular na flash (sobrevive a quedas de energia)
+BUFFER_CAPACIDADE = 1000        # resumos guardados (~206 KB); cheia, descarta o mais antigo
+LOTE_MAX = 50                   # resumos por POST
+INTERVALO_ENVIO_MS = 10000      # envia lote incompleto depois deste tempo
+BACKOFF_MIN_MS = 1000           # espera após a 1ª falha; dobra a cada falha seguida
+BACKOFF_MAX_MS = 60000
+TIMEOUT_S = 10
+
+# -------- AGREGAÇÃO NA BORDA --------
+# As linhas do Mega são acumuladas (min/max/média/último) e a cada
+# INTERVALO_AGREGACAO_MS o resumo só vira registro se algum valor saiu da
+# banda morta em torno do último enviado, ou se passou HEARTBEAT_MS.
+# Senão o acúmulo continua, e os extremos não se perdem.
+INTERVALO_AGREGACAO_MS = 10000
+HEARTBEAT_MS = 300000
+BANDAS = {"temperatura": 0.5, "umidade": 1.0, "ph": 0.1, "umidSolo": 2}
+BANDA_GASES_PCT = 10            # variação relativa dos ppm
+BANDA_GASES_MIN_PPM = 1.0       # piso da banda para concentrações perto de zero
+
+# -------- FORMATO BINÁRIO (layout v3 de binario.py na API) --------
+TIPO_BINARIO = "application/vnd.ecovita.leituras"
+VERSAO_BINARIO = 3
+FORMATO_CABECALHO = "<BH16sI"   # versão, quantidade, device_id, seq do primeiro registro
+FORMATO_BLOCO = "<hHHB11I"      # layout de uma leitura v1
+FORMATO_REGISTRO = "<H" + FORMATO_BLOCO[1:] * 4   # amostras + média, mínimo, máximo, último
+TAMANHO_REGISTRO = struct.calcsize(FORMATO_REGISTRO)
+# Mesma ordem do arduino.c++ e de bd.GASES_ARDUINO
+COMPOSTOS = ["Metano", "Hidrogênio", "Álcool", "Fumaça", "Amônia", "Benzeno",
+             "Formaldeído", "CO", "CO2", "H2S", "SO2"]
+CAMPOS = ["temperatura", "umidade", "ph", "umidSolo"]
+# (escala, mínimo, ausente) de cada valor, na ordem do bloco
+LIMITES = [(100, -32768, 0x7FFF), (100, 0, 0xFFFF), (100, 0, 0xFFFF), (1, 0, 0xFF)] + \
+    [(100, 0, 0xFFFFFFFF)] * len(COMPOSTOS)
+
+def inteiro(valor, escala, minimo, ausente):
+    # Valor ausente vai como o maior valor do tipo
+    if valor is None:
+        return ausente
+    return max(minimo, min(ausente - 1, round(valor * escala)))
+
+# Nomes alternativos aceitos pela API (bd.APELIDOS_GASES)
+APELIDOS_GASES = {"CH4": "Metano", "NH3": "Amônia", "Amonia": "Amônia"}
+
+def gases_por_composto(gases):
+    # As mesmas formas que a API aceita em "gases": a lista do Mega
+    # ({"composto", "ppm"}), um dict composto -> ppm ou um desses em texto JSON
+    if isinstance(gases, str):
+        try:
+            gases = json.loads(gases)
+        except ValueError:
+            return {}
+    if isinstance(gases, list):
+        gases = {g.get("composto"): g.get("ppm") for g in gases if isinstance(g, dict)}
+    if not isinstance(gases, dict):
+        return {}
+    return {APELIDOS_GASES.get(nome, nome): ppm for nome, ppm in gases.items() if isinstance(ppm, (int, float))}
+
+def valores_da_leitura(d):
+    # Linha JSON do Mega -> lista plana na ordem do bloco (None = ausente)
+    ppm = gases_por_composto(d.get("gases"))
+    return [d.get(c) for c in CAMPOS] + [ppm.get(nome) for nome in COMPOSTOS]
+
+def codificar_registro(amostras, blocos):
+    # blocos: listas planas de média, mínimo, máximo e último
+    return struct.pack(
+        FORMATO_REGISTRO, min(amostras, 0xFFFF),
+        *[inteiro(v, *limites) for bloco in blocos for v, limites in zip(bloco, LIMITES)]
+    )
+
+def cabecalho(n, device_id, seq):
+    return struct.pack(FORMATO_CABECALHO, VERSAO_BINARIO, n, device_id.encode(), seq)
+
+def identificador():
+    if DEVICE_ID:
+        return DEVICE_ID[:16]
+    if machine is not None:
+        return "".join("%02x" % b for b in machine.unique_id())[:16]
+    return socket.gethostname()[:16]
+
+# -------- RELÓGIO (ticks no ESP32, monotonic no CPython) --------
+def agora_ms():
+    if hasattr(time, "ticks_ms"):
+        return time.ticks_ms()
+    return int(time.monotonic() * 1000)
+
+def decorrido_ms(agora, antes):
+    if hasattr(time, "ticks_diff"):
+        return time.ticks_diff(agora, antes)
+    return agora - antes
+
+# -------- AGREGADOR --------
+class Agregador:
+    def __init__(self, intervalo_ms=INTERVALO_AGREGACAO_MS, heartbeat_ms=HEARTBEAT_MS):
+        self.intervalo_ms = intervalo_ms
+        self.heartbeat_ms = heartbeat_ms
+        self.bandas = [BANDAS.get(c) for c in CAMPOS] + [None] * len(COMPOSTOS)
+        self.referencia = None      # "último" do registro enviado antes
+        self.ultimo_registro = agora_ms()
+        self.amostras_agregadas = 0
+        self.registros = 0
+        self._zerar(agora_ms())
+
+    def _zerar(self, agora):
+        k = len(LIMITES)
+        self.n = 0
+        self.soma, self.contagem = [0.0] * k, [0] * k
+        self.minimo, self.maximo, self.ultimo = [None] * k, [None] * k, [None] * k
+        self.inicio = agora
+
+    def adicionar(self, d):
+        self.n += 1
+        for i, v in enumerate(valores_da_leitura(d)):
+            if v is None:
+                continue
+            self.soma[i] += v
+            self.contagem[i] += 1
+            self.minimo[i] = v if self.minimo[i] is None else min(self.minimo[i], v)
+            self.maximo[i] = v if self.maximo[i] is None else max(self.maximo[i], v)
+            self.ultimo[i] = v
+
+    def _fora_da_banda(self, i, ref):
+        banda = self.bandas[i]
+        if banda is None:
+            banda = max(BANDA_GASES_MIN_PPM, abs(ref) * BANDA_GASES_PCT / 100)
+        return any(v is not None and abs(v - ref) > banda
+                   for v in (self.minimo[i], self.maximo[i], self.ultimo[i]))
+
+    def _mudou(self):
+        if self.referencia is None:
+            return True
+        for i, ref in enumerate(self.referencia):
+            if ref is None:
+                if self.ultimo[i] is not None:
+                    return True
+            elif self._fora_da_banda(i, ref):
+                return True
+        return False
+
+    def fechar(self, agora, forcar=False):
+        # Registro v2 do acúmulo, ou None se ainda não é hora / nada mudou
+        if not self.n or (not forcar and decorrido_ms(agora, self.inicio) < self.intervalo_ms):
+            return None
+        if not (forcar or self._mudou() or decorrido_ms(agora, self.ultimo_registro) >= self.heartbeat_ms):
+            return None
+        media = [s / c if c else None for s, c in zip(self.soma, self.contagem)]
+        registro = codificar_registro(self.n, [media, self.minimo, self.maximo, self.ultimo])
+        # Valor que não apareceu neste resumo mantém a referência anterior
+        self.referencia = [u if u is not None else r for u, r in zip(self.ultimo, self.referencia or self.ultimo)]
+        self.ultimo_registro = agora
+        self.amostras_agregadas += self.n
+        self.registros += 1
+        self._zerar(agora)
+        return registro
+
+# -------- BUFFER NA FLASH --------
+class BufferFlash:
+    # Fila circular de registros de tamanho fixo num arquivo pré-alocado.
+    # O índice (início, quantidade, seq) vai num arquivo à parte, trocado por
+    # rename depois que os dados já estão gravados. seq é o número do
+    # registro mais antigo; os seguintes são seq + 1, seq + 2, ... Como ele
+    # só anda quando a API confirma (ou o mais antigo é descartado), um
+    # lote reenviado depois de um timeout repete as mesmas seqs e a API
+    # descarta as que já tinha. Regravar a placa ou apagar o índice zera a
+    # seq; a API recusa esse recomeço com 409 e a próxima seq livre, e o
+    # Cliente renumera o buffer a partir dela (renumerar).
+    def __init__(self, caminho=BUFFER_ARQUIVO, capacidade=BUFFER_CAPACIDADE, tamanho=TAMANHO_REGISTRO):
+        self.caminho = caminho
+        self.capacidade = capacidade
+        self.tamanho = tamanho
+        self.descartadas = 0
+        try:
+            existe = os.stat(caminho)[6] == capacidade * tamanho
+        except OSError:
+            existe = False
+        self.inicio, self.quantidade, self.seq = self._ler_indice()
+        if not existe:
+            with open(caminho, "wb") as f:
+                bloco = bytes(tamanho * 64)
+                for i in range(0, capacidade, 64):
+                    f.write(bloco[:tamanho * min(64, capacidade - i)])
+            # Buffer novo (ou de outro tamanho): os registros se perdem, a seq continua
+            self.seq += self.quantidade
+            self.inicio, self.quantidade = 0, 0
+            self._gravar_indice()
+
+    def _ler_indice(self):
+        try:
+            with open(self.caminho + ".idx") as f:
+                valores = [int(v) for v in f.read().split()]
+            inicio, quantidade = valores[:2]
+            seq = valores[2] if len(valores) > 2 else 0   # índice de antes da seq
+            return inicio % self.capacidade, min(quantidade, self.capacidade), seq
+        except (OSError, ValueError):
+            return 0, 0, 0
+
+    def _gravar_indice(self):
+        temporario = self.caminho + ".idx.tmp"
+        with open(temporario, "w") as f:
+            f.write("%d %d %d" % (self.inicio, self.quantidade, self.seq))
+        os.rename(temporario, self.caminho + ".idx")
+
+    def adicionar(self, registros):
+        with open(self.caminho, "r+b") as f:
+            for registro in registros:
+                if self.quantidade == self.capacidade:
+                    self.inicio = (self.inicio + 1) % self.capacidade
+                    self.quantidade -= 1
+                    self.seq += 1
+                    self.descartadas += 1
+                f.seek(((self.inicio + self.quantidade) % self.capacidade) * self.tamanho)
+                f.write(registro)
+                self.quantidade += 1
+        self._gravar_indice()
+
+    def primeiros(self, n):
+        # Até n registros a partir do mais antigo, concatenados (o 1º tem self.seq)
+        n = min(n, self.quantidade)
+        partes = []
+        with open(self.caminho, "rb") as f:
+            posicao, restantes = self.inicio, n
+            while restantes:
+                contiguos = min(restantes, self.capacidade - posicao)
+                f.seek(posicao * self.tamanho)
+                partes.append(f.read(contiguos * self.tamanho))
+                posicao, restantes = 0, restantes - contiguos
+        return b"".join(partes), n
+
+    def renumerar(self, seq):
+        # Os registros ainda não confirmados passam a ser seq, seq + 1, ...
+        self.seq = seq
+        self._gravar_indice()
+
+    def descartar(self, n):
+        self.inicio = (self.inicio + n) % self.capacidade
+        self.quantidade -= n
+        self.seq += n
+        self._gravar_indice()
+
+# -------- HTTP COM CONEXÃO REAPROVEITADA --------
+class Enviador:
+    # POST HTTP/1.1 keep-alive: a conexão só é refeita depois de um erro
+    # ou se o servidor pedir para fechar.
+    def __init__(self, host, porta, caminho, timeout_s=TIMEOUT_S):
+        self.host = host
+        self.porta = porta
+        self.caminho = caminho
+        self.timeout_s = timeout_s
+        self._sock = None
+        self._arquivo = None
+        self.backoff_ms = 0
+        self._falhou_em = 0
+        self.conexoes = 0
+        self.retry_after_ms = None   # Retry-After da última resposta (429/503)
+        self.proxima_seq = None      # X-Proxima-Seq da última resposta (409)
+
+    def _conectar(self):
+        endereco = socket.getaddrinfo(self.host, self.porta, 0, socket.SOCK_STREAM)[0][-1]
+        self._sock = socket.socket()
+        self._sock.settimeout(self.timeout_s)
+        self._sock.connect(endereco)
+        self._arquivo = self._sock.makefile("rwb", 0)
+        self.conexoes += 1
+
+    def fechar(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._arquivo = None
+
+    def post(self, corpo, tipo=TIPO_BINARIO):
+        # Retorna o status HTTP; levanta OSError se a conexão falhar
+        reaproveitada = self._sock is not None
+        try:
+            return self._post(corpo, tipo)
+        except OSError:
+            if not reaproveitada:
+                raise
+            # O servidor pode ter fechado a conexão ociosa: uma tentativa numa nova
+            return self._post(corpo, tipo)
+
+    def _post(self, corpo, tipo):
+        self.retry_after_ms = None
+        self.proxima_seq = None
+        try:
+            if self._sock is None:
+                self._conectar()
+            cabecalho = (
+                "POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: %s\r\n"
+                "Content-Length: %d\r\nConnection: keep-alive\r\n\r\n"
+            ) % (self.caminho, self.host, tipo, len(corpo))
+            self._arquivo.write(cabecalho.encode() + corpo)
+            status = int(self._arquivo.readline().split()[1])
+            tamanho, fechar = 0, False
+            while True:
+                linha = self._arquivo.readline()
+                if not linha or linha == b"\r\n":
+                    break
+                nome, _, valor = linha.decode().partition(":")
+                nome, valor = nome.strip().lower(), valor.strip().lower()
+                if nome == "content-length":
+                    tamanho = int(valor)
+                elif nome == "retry-after" and valor.isdigit():  # só a forma em segundos
+                    self.retry_after_ms = min(BACKOFF_MAX_MS, int(valor) * 1000)
+                elif nome == "x-proxima-seq" and valor.isdigit():  # 409: seq reiniciada
+                    self.proxima_seq = int(valor)
+                elif (nome == "connection" and valor == "close") or nome == "transfer-encoding":
+                    fechar = True
+            while tamanho > 0:  # descarta a resposta para liberar a conexão
+                lido = self._arquivo.read(tamanho)
+                if not lido:
+                    break
+                tamanho -= len(lido)
+        except (OSError, ValueError, IndexError) as e:
+            self.fechar()
+            raise OSError("falha no POST: %s" % e)
+        if fechar:
+            self.fechar()
+        return status
+
+    def pronto(self, agora):
+        return not self.backoff_ms or decorrido_ms(agora, self._falhou_em) >= self.backoff_ms
+
+    def falhou(self, agora, espera_ms=None):
+        # Espera pedida pela API (Retry-After) ou backoff exponencial; jitter de
+        # até 25% para as placas recusadas juntas não voltarem juntas
+        if espera_ms:
+            base = espera_ms
+        else:
+            base = min(BACKOFF_MAX_MS, max(BACKOFF_MIN_MS, self.backoff_ms * 2))
+        self.backoff_ms = base + base * random.getrandbits(8) // 1024
+        self._falhou_em = agora
+
+    def sucesso(self):
+        self.backoff_ms = 0
+
+# -------- CLIENTE: UART -> FLASH -> API --------
+class Cliente:
+    def __init__(self, uart, buffer, enviador, online=lambda: True,
+                 lote_max=LOTE_MAX, intervalo_ms=INTERVALO_ENVIO_MS, agregador=None, device_id=None):
+        self.uart = uart
+        self.device_id = device_id or identificador()
+        self.agregador = agregador or Agregador()
+        self.buffer = buffer
+        self.enviador = enviador
+        self.online = online
+        self.lote_max = lote_max
+        self.intervalo_ms = intervalo_ms
+        self.pendente = b""
+        self.ultimo_envio = agora_ms()
+        self.invalidas = 0
+        self.enviadas = 0
+        self.rejeitadas = 0
+
+    def drenar_uart(self):
+        # Lê tudo o que chegou; uma linha incompleta fica para a próxima volta
+        leituras = []
+        while self.uart.any():
+            parte = self.uart.readline()
+            if not parte:
+                break
+            self.pendente += parte
+            if not self.pendente.endswith(b"\n"):
+                continue
+            linha, self.pendente = self.pendente.strip(), b""
+            try:
+                dados = json.loads(linha.decode("utf-8"))
+                if not all(isinstance(dados.get(c), (int, float)) for c in ("temperatura", "umidade")):
+                    raise ValueError("sem temperatura/umidade")
+                leituras.append(dados)
+            except Exception as e:
+                self.invalidas += 1
+                print("Linha inválida do Mega:", e)
+        return leituras
+
+    def passo(self):
+        # Uma volta do loop: UART -> agregador -> flash e, se for hora, um lote para a API
+        for d in self.drenar_uart():
+            self.agregador.adicionar(d)
+        agora = agora_ms()
+        self.gravar_resumo(agora)
+        if not self.buffer.quantidade or not self.online() or not self.enviador.pronto(agora):
+            return
+        if self.buffer.quantidade >= self.lote_max or decorrido_ms(agora, self.ultimo_envio) >= self.intervalo_ms:
+            self.enviar_lote(agora)
+
+    def gravar_resumo(self, agora, forcar=False):
+        registro = self.agregador.fechar(agora, forcar)
+        if registro is not None:
+            self.buffer.adicionar([registro])
+
+    def enviar_lote(self, agora):
+        registros, n = self.buffer.primeiros(self.lote_max)
+        try:
+            status = self.enviador.post(cabecalho(n, self.device_id, self.buffer.seq) + registros)
+        except OSError as e:
+            self.enviador.falhou(agora)
+            print("Erro no envio (nova tentativa em %d ms):" % self.enviador.backoff_ms, e)
+            return
+        if 200 <= status < 300:
+            self.buffer.descartar(n)
+            self.enviadas += n
+            self.enviador.sucesso()
+            self.ultimo_envio = agora
+        elif status == 409 and self.enviador.proxima_seq is not None:
+            # Numeração recomeçou (placa regravada, índice apagado): o lote
+            # volta com as seqs que a API indicou, sem perder os registros
+            self.buffer.renumerar(self.enviador.proxima_seq)
+            print("Seq reiniciada; continuando a partir de", self.buffer.seq)
+        elif status == 429 or status >= 500:
+            self.enviador.falhou(agora, self.enviador.retry_after_ms)
+            print("API indisponível (%d), nova tentativa em %d ms" % (status, self.enviador.backoff_ms))
+        else:
+            # Lote recusado (4xx): reenviar não adianta e travaria a fila
+            self.buffer.descartar(n)
+            self.rejeitadas += n
+            self.ultimo_envio = agora
+            print("Lote recusado pela API:", status)
 
 # -------- CONEXÃO WIFI --------
 def connect_wifi():
+    # Não bloqueia: as leituras vão para a flash enquanto o Wi-Fi não sobe
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
     wlan.connect(SSID, PASSWORD)
-    while not wlan.isconnected():
-        print("Conectando ao Wi-Fi...")
-        time.sleep(1)
-    print("Wi-Fi conectado!", wlan.ifconfig())
+    print("Conectando ao Wi-Fi...")
+    return wlan
 
-connect_wifi()
+class UartArquivo:
+    # No CPython, faz o papel da UART entregando as linhas de um arquivo
+    def __init__(self, caminho):
+        with open(caminho, "rb") as f:
+            self.linhas = f.readlines()
 
-# -------- SERIAL COM ARDUINO MEGA --------
-uart = machine.UART(2, tx=17, rx=16, baudrate=9600)  # ajuste pinos conforme sua ligação
+    def any(self):
+        return len(self.linhas)
+
+    def readline(self):
+        return self.linhas.pop(0) if self.linhas else None
 
 # -------- LOOP PRINCIPAL --------
-while True:
-    if uart.any():
-        try:
-            # Lê a linha recebida do Mega
-            linha = uart.readline().decode('utf-8').strip()
-            print("Recebido do Mega:", linha)
-
-            # Valida se é JSON
-            dados = json.loads(linha)
-
-            # Envia POST para API
-            response = requests.post(API_URL, json=dados, headers={"Content-Type": "application/json"})
-            print("Status da API:", response.status_code, "Resposta:", response.text)
-            response.close()
-
-        except Exception as e:
-            print("Erro:", e)
-    
-    time.sleep(2)
+def main():
+    if machine is not None:
+        wlan = connect_wifi()
+        # -------- SERIAL COM ARDUINO MEGA --------
+        uart = machine.UART(2, tx=17, rx=16, baudrate=9600)  # ajuste pinos conforme sua ligação
+        cliente = Cliente(uart, BufferFlash(), Enviador(API_HOST, API_PORTA, API_CAMINHO), wlan.isconnected)
+        while True:
+            cliente.passo()
+            time.sleep(0.1)
+    else:
+        # python esp.py linhas_do_mega.txt [host] [porta]
+        import sys
+        host = sys.argv[2] if len(sys.argv) > 2 else "127.0.0.1"
+        porta = int(sys.argv[3]) if len(sys.argv) > 3 else API_PORTA
+        cliente = Cliente(UartArquivo(sys.argv[1]), BufferFlash(), Enviador(host, porta, API_CAMINHO))
+        while cliente.uart.any() or cliente.agregador.n or cliente.buffer.quantidade:
+            cliente.passo()
+            if not cliente.uart.any():
+                cliente.gravar_resumo(agora_ms(), forcar=True)
+            time.sleep(0.01)
+        agregador = cliente.agregador
+        print("Amostras:", agregador.amostras_agregadas, "Registros:", agregador.registros,
+              "Enviados:", cliente.enviadas, "Conexões:", cliente.enviador.conexoes)
+
+if __name__ == "__main__":
+    main()
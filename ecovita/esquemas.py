@@ -0,0 +1,232 @@
+# esquemas.py
+# Esquemas Pydantic das rotas da API: entrada validada antes de tocar no
+# banco e saída montada só a partir das colunas (from_attributes), sem
+# nenhum relacionamento do ORM, o que evita lazy loads na serialização.
+# Com response_model, o FastAPI gera o JSON direto no núcleo Rust do
+# Pydantic; as rotas que devolvem dicts livres usam RespostaORJSON.
+
+from datetime import datetime
+from typing import Annotated, Generic, Optional, TypeVar, Union
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+try:
+    import orjson
+except ImportError:  # sem orjson, cai no json da biblioteca padrão
+    orjson = None
+
+# int ou float, mas não "25.5" nem true (o validar_leitura antigo também recusava)
+Numero = Annotated[float, Field(strict=True)]
+
+
+# -------------------------
+# Entrada
+# -------------------------
+class GasMedido(BaseModel):
+    """Um elemento da lista "gases" do Mega; campos a mais são mantidos."""
+    model_config = ConfigDict(extra="allow")
+
+    composto: str
+    ppm: Optional[float] = None
+
+
+class LeituraEntrada(BaseModel):
+    """
+    Leitura do ESP32: o JSON do Mega, um resumo agregado no ESP32
+    (amostras > 1 com min/max/ultimo) ou um registro binário decodificado.
+    gases aceita a lista do Mega, um dict composto -> ppm ou o JSON em texto.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    temperatura: Numero
+    umidade: Numero
+    o2: Optional[Numero] = 0.0
+    ph: Optional[Numero] = 7.0
+    umidSolo: Optional[Numero] = None
+    gases: Union[list[GasMedido], dict[str, Optional[float]], str, None] = {}
+    amostras: int = Field(1, ge=1, strict=True)
+    min: Optional[dict] = None
+    max: Optional[dict] = None
+    ultimo: Optional[dict] = None
+    # Ingestão idempotente: reenvios com o mesmo (device_id, seq) são descartados
+    device_id: Optional[str] = Field(None, min_length=1, max_length=64)
+    seq: Optional[int] = Field(None, ge=0, strict=True)
+
+    @model_validator(mode="after")
+    def _seq_com_dispositivo(self):
+        if (self.device_id is None) != (self.seq is None):
+            raise ValueError("device_id e seq devem ser enviados juntos")
+        return self
+
+    def para_dict(self):
+        """Dict no formato que nova_leitura espera (só os campos enviados)."""
+        return self.model_dump(exclude_unset=True)
+
+
+class SiteDadoEntrada(BaseModel):
+    composto_verde: str
+    peso_verde_kg: float
+    composto_marrom: str
+    peso_marrom_kg: float
+    temp_alvo_c: float
+    umidade_alvo_pct: float
+    device_id: Optional[str] = Field(None, min_length=1, max_length=64)   # pilha montada
+
+
+class DispositivoEntrada(BaseModel):
+    """Cadastro de uma placa/pilha; id_teste = teste em andamento nela (None encerra)."""
+    nome: Optional[str] = Field(None, max_length=100)
+    descricao: Optional[str] = Field(None, max_length=255)
+    id_teste: Optional[int] = None
+
+
+def mensagem_validacao(erro: ValidationError):
+    """Primeiro erro de um ValidationError em uma linha (para o detail do 422)."""
+    e = erro.errors()[0]
+    campo = ".".join(str(p) for p in e["loc"])
+    return f"Campo '{campo}': {e['msg']}" if campo else e["msg"]
+
+
+# -------------------------
+# Saída (ORM -> esquema)
+# -------------------------
+class Esquema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+
+class LeituraSaida(Esquema):
+    id: int
+    id_teste: Optional[int] = None
+    temperatura: Optional[float] = None
+    umidade: Optional[float] = None
+    o2: Optional[float] = None
+    ph: Optional[float] = None
+    gases: Optional[str] = None  # payload original em JSON
+    data_registro: Optional[datetime] = None
+    amostras: Optional[int] = 1
+    temperatura_min: Optional[float] = None
+    temperatura_max: Optional[float] = None
+    umidade_min: Optional[float] = None
+    umidade_max: Optional[float] = None
+    ph_min: Optional[float] = None
+    ph_max: Optional[float] = None
+    resumo: Optional[str] = None
+    device_id: Optional[str] = None
+    seq: Optional[int] = None
+
+
+class SiteDadoSaida(Esquema):
+    id: int
+    id_teste: Optional[int] = None
+    composto_verde: Optional[str] = None
+    peso_verde_kg: Optional[float] = None
+    composto_marrom: Optional[str] = None
+    peso_marrom_kg: Optional[float] = None
+    temp_alvo_c: Optional[float] = None
+    umidade_alvo_pct: Optional[float] = None
+    data_registro: Optional[datetime] = None
+    device_id: Optional[str] = None
+
+
+class MLResultadoSaida(Esquema):
+    id: int
+    id_teste: Optional[int] = None
+    composto_verde_toxico: Optional[str] = None
+    composto_marrom_toxico: Optional[str] = None
+    toxicidade_geral: Optional[str] = None
+    covs_predominantes: Optional[str] = None
+    melhor_composto_verde: Optional[str] = None
+    melhor_composto_marrom: Optional[str] = None
+    recomendacao: Optional[str] = None
+    dupla_atoxica: Optional[str] = None
+    dupla_toxica: Optional[str] = None
+    data_registro: Optional[datetime] = None
+    device_id: Optional[str] = None
+
+
+class DispositivoSaida(Esquema):
+    device_id: str
+    nome: Optional[str] = None
+    descricao: Optional[str] = None
+    id_teste: Optional[int] = None
+    criado_em: Optional[datetime] = None
+    visto_em: Optional[datetime] = None
+    ultima_leitura_id: Optional[int] = None
+    leituras: int = 0
+
+
+class ML3Saida(Esquema):
+    id_leitura: int
+    fase_predita: Optional[str] = None
+    prob_fase_inicial: Optional[float] = None
+    prob_fase_termofilica: Optional[float] = None
+    prob_fase_maturacao: Optional[float] = None
+    score_coerencia: Optional[float] = None
+    data_analise: Optional[datetime] = None
+
+
+class ResultadoML1(BaseModel):
+    toxicidade: str
+    fase: Optional[str] = None
+    probabilidades: Optional[dict[str, float]] = None
+    id_resultado: Optional[int] = None
+    motivo: Optional[str] = None
+
+
+class ResultadoML2(BaseModel):
+    gases_ppb: dict[str, float]
+    toxicidade_est: float
+    classe_quim_score: float
+    pel_adjust: float
+
+
+class ValidacaoML3(BaseModel):
+    fase_predita: str
+    prob_fase_inicial: Optional[float] = None
+    prob_fase_termofilica: Optional[float] = None
+    prob_fase_maturacao: Optional[float] = None
+    score_coerencia: float
+
+
+class LeituraProcessada(BaseModel):
+    leitura: Optional[LeituraSaida] = None   # None se duplicada
+    ml2_resultado: Optional[ResultadoML2] = None
+    ml3_validacao: Optional[ValidacaoML3] = None
+    duplicada: bool = False                  # (device_id, seq) já aceito; nada gravado
+
+
+class PainelDispositivo(BaseModel):
+    """Estado atual de uma pilha, montado por chave (sem varrer o histórico)."""
+    dispositivo: DispositivoSaida
+    ultima_leitura: Optional[LeituraSaida] = None
+    ultimo_ml3: Optional[ML3Saida] = None
+
+
+class SiteDadoInserido(BaseModel):
+    inserido: SiteDadoSaida
+    ml1_resultado: Optional[ResultadoML1] = None
+
+
+class IdsGravados(BaseModel):
+    ids: list[int]
+    duplicadas: int = 0
+
+
+T = TypeVar("T")
+
+class Pagina(BaseModel, Generic[T]):
+    itens: list[T]
+    next_cursor: Optional[str] = None
+
+
+# -------------------------
+# Resposta para dicts livres (agregados, status)
+# -------------------------
+class RespostaORJSON(JSONResponse):
+    """JSONResponse serializada com orjson (arrays grandes de floats dos agregados)."""
+
+    def render(self, content):
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
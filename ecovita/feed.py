@@ -0,0 +1,103 @@
+# feed.py
+# Difusão em processo das leituras recém-gravadas (com o resultado do ML-3)
+# para os clientes conectados em /esp32/feed (Server-Sent Events).
+# Cada evento é serializado uma única vez e entregue a N assinantes, sem
+# nenhuma consulta extra ao banco. Quem assina uma pilha (device_id) fica
+# num conjunto próprio: a leitura vai só para os assinantes dela e os de
+# todas as pilhas, sem passar por um filtro em cada cliente.
+
+import asyncio
+import json
+import os
+import threading
+
+BUFFER_ASSINANTE = int(os.getenv("ECOVITA_FEED_BUFFER", "256"))   # eventos pendentes por cliente
+
+
+def leitura_para_dict(leitura):
+    return {
+        "id": leitura.id,
+        "id_teste": leitura.id_teste,
+        "device_id": leitura.device_id,
+        "seq": leitura.seq,
+        "temperatura": leitura.temperatura,
+        "umidade": leitura.umidade,
+        "o2": leitura.o2,
+        "ph": leitura.ph,
+        "gases": json.loads(leitura.gases) if leitura.gases else None,
+        "data_registro": leitura.data_registro.isoformat() if leitura.data_registro else None,
+    }
+
+
+class Assinante:
+    """Um cliente conectado: fila limitada no event loop da conexão."""
+
+    def __init__(self, loop, tamanho, device_id=None):
+        self.loop = loop
+        self.device_id = device_id
+        self.fila = asyncio.Queue(maxsize=tamanho)
+        self.perdidas = 0
+
+    def _entregar(self, mensagem):
+        # Roda no event loop. Cliente lento: descarta o evento mais antigo.
+        if self.fila.full():
+            self.fila.get_nowait()
+            self.perdidas += 1
+        self.fila.put_nowait(mensagem)
+
+
+class Difusor:
+    def __init__(self, tamanho=BUFFER_ASSINANTE):
+        self.tamanho = tamanho
+        self._assinantes = {}   # device_id (None = todas as pilhas) -> assinantes
+        self._lock = threading.Lock()
+        self.publicadas = 0
+
+    def assinar(self, device_id=None):
+        """Chamado de dentro do event loop (rota async)."""
+        assinante = Assinante(asyncio.get_running_loop(), self.tamanho, device_id)
+        with self._lock:
+            self._assinantes.setdefault(device_id, set()).add(assinante)
+        return assinante
+
+    def cancelar(self, assinante):
+        with self._lock:
+            grupo = self._assinantes.get(assinante.device_id)
+            if grupo is not None:
+                grupo.discard(assinante)
+                if not grupo:
+                    del self._assinantes[assinante.device_id]
+
+    def publicar(self, leituras, ml3_res):
+        """Pode ser chamado de qualquer thread (rotas sync, thread gravadora)."""
+        with self._lock:
+            if not self._assinantes:
+                return
+            grupos = {chave: list(grupo) for chave, grupo in self._assinantes.items()}
+        todas = grupos.get(None, [])
+        for leitura, ml3 in zip(leituras, ml3_res):
+            assinantes = todas if leitura.device_id is None else todas + grupos.get(leitura.device_id, [])
+            if not assinantes:
+                continue
+            mensagem = json.dumps({"leitura": leitura_para_dict(leitura), "ml3": ml3}, ensure_ascii=False)
+            for a in assinantes:
+                try:
+                    a.loop.call_soon_threadsafe(a._entregar, mensagem)
+                except RuntimeError:  # loop da conexão já foi fechado
+                    self.cancelar(a)
+            self.publicadas += 1
+
+    def status(self):
+        with self._lock:
+            assinantes = [a for grupo in self._assinantes.values() for a in grupo]
+            pilhas = sum(1 for chave in self._assinantes if chave is not None)
+        return {
+            "assinantes": len(assinantes),
+            "pilhas_assinadas": pilhas,
+            "publicadas": self.publicadas,
+            "buffer_por_assinante": self.tamanho,
+            "perdidas_por_lentidao": sum(a.perdidas for a in assinantes),
+        }
+
+
+difusor = Difusor()
@@ -0,0 +1,68 @@
+# frota.py
+# Cache em memória do registro de dispositivos (bd.Dispositivo): qual teste
+# está em andamento em cada pilha. Na gravação, cada leitura de uma placa
+# cadastrada recebe o id_teste da pilha por uma busca num dict, sem
+# consulta; com ele o ML-3 conta os dias de compostagem e as listagens,
+# agregados e arquivos por teste passam a incluir a pilha.
+#
+# O cache é recarregado a cada ECOVITA_FROTA_TTL_S segundos (cadastros
+# feitos por outro worker) e na hora pelas rotas de cadastro deste processo.
+
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from bd import Dispositivo
+
+TTL_S = float(os.getenv("ECOVITA_FROTA_TTL_S", "30"))
+
+
+class RegistroFrota:
+    def __init__(self, sessao_factory, ttl_s=TTL_S):
+        self.sessao_factory = sessao_factory
+        self.ttl_s = ttl_s
+        self._testes = None          # device_id -> id_teste (só as pilhas com teste)
+        self._carregado_em = 0.0
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.recargas = 0
+
+    def teste(self, device_id):
+        """id_teste em andamento na pilha de device_id, ou None."""
+        if device_id is None:
+            return None
+        testes = self._testes
+        if testes is None or time.monotonic() - self._carregado_em >= self.ttl_s:
+            testes = self._recarregar()
+        return testes.get(device_id)
+
+    def _recarregar(self):
+        with self._lock:
+            if self._testes is not None and time.monotonic() - self._carregado_em < self.ttl_s:
+                return self._testes  # outra thread acabou de recarregar
+            db = self.sessao_factory()
+            try:
+                testes = dict(db.execute(
+                    select(Dispositivo.device_id, Dispositivo.id_teste).where(Dispositivo.id_teste.is_not(None))
+                ).all())
+            finally:
+                db.close()
+            self._testes, self._carregado_em = testes, time.monotonic()
+            self.recargas += 1
+            return testes
+
+    def invalidar(self):
+        """Chamado depois de um cadastro: a próxima leitura recarrega do banco."""
+        with self._lock:
+            self._testes = None
+
+    def status(self):
+        testes = self._testes
+        return {
+            "pilhas_com_teste": len(testes) if testes is not None else None,
+            "ttl_s": self.ttl_s,
+            "recargas": self.recargas,
+        }
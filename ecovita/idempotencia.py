@@ -0,0 +1,238 @@
+# idempotencia.py
+# Ingestão idempotente por (device_id, seq). O ESP32 numera cada registro
+# com um seq crescente por dispositivo, guardado na flash junto com o
+# buffer, e reenvia o mesmo seq quando um POST falha ou estoura o timeout.
+# O índice único sensor_leituras (device_id, seq) garante que a leitura só
+# entra uma vez; a janela em memória com as últimas seqs de cada
+# dispositivo recusa a repetição antes de qualquer gravação ou modelo.
+#
+# Uma seq muito abaixo da maior já aceita do dispositivo não é reenvio (um
+# reenvio repete no máximo o último lote): é a placa regravada ou com o
+# índice da flash apagado, recomeçando do zero. Em vez de descartar tudo
+# como repetido, a API recusa com SeqReiniciada (409 nas rotas) e devolve
+# a próxima seq livre, para o esp.py renumerar o buffer.
+#
+# Leituras sem device_id/seq (clientes antigos) passam direto, como antes.
+# Leituras movidas para o arquivo frio saem do índice único: um reenvio
+# de meses atrás já não seria reconhecido.
+
+import os
+import threading
+from collections import deque
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from bd import SensorLeitura
+
+JANELA = int(os.getenv("ECOVITA_DEDUP_JANELA", "512"))   # seqs lembradas por dispositivo
+# Quanto abaixo da maior seq aceita uma seq passa a ser reinício, não reenvio
+REINICIO = int(os.getenv("ECOVITA_DEDUP_REINICIO", "512"))
+
+
+class SeqReiniciada(ValueError):
+    """seq muito abaixo da maior aceita do dispositivo; proxima = primeira seq livre."""
+
+    def __init__(self, device_id, seq, proxima):
+        super().__init__(
+            f"seq {seq} do dispositivo {device_id} está muito abaixo da última aceita "
+            f"({proxima - 1}): numeração reiniciada? Continue a partir de {proxima}")
+        self.device_id = device_id
+        self.seq = seq
+        self.proxima = proxima
+
+
+def chave(dado):
+    """(device_id, seq) de um dict de leitura, ou None se ele não traz os dois."""
+    device_id, seq = dado.get("device_id"), dado.get("seq")
+    return None if device_id is None or seq is None else (device_id, seq)
+
+
+class _Janela:
+    """Seqs aceitas de um dispositivo; abaixo de piso, só o banco sabe."""
+    __slots__ = ("seqs", "ordem", "piso", "maior")
+
+    def __init__(self, seqs, piso):
+        self.seqs = set(seqs)
+        self.ordem = deque(sorted(seqs))
+        self.piso = piso
+        self.maior = self.ordem[-1] if self.ordem else -1
+
+
+class JanelaSequencias:
+    """
+    Janela das seqs aceitas por dispositivo, compartilhada pelas rotas, pela
+    fila assíncrona e pelo protocolo de linhas.
+
+    - repetidas(dados): separa as já aceitas e reserva as demais (O(1) por leitura)
+    - gravar(db, novas): commit que tolera seqs gravadas por outro worker
+    - liberar(chaves): desfaz reservas de uma gravação que falhou
+
+    repetidas levanta SeqReiniciada (sem deixar reservas) se uma seq estiver
+    mais de `reinicio` abaixo da maior aceita do dispositivo.
+
+    Na primeira leitura de um dispositivo no processo, as últimas seqs dele
+    vêm do índice único (uma consulta); seqs mais antigas que a janela são
+    conferidas no banco uma a uma.
+    """
+
+    def __init__(self, sessao_factory, tamanho=JANELA, reinicio=REINICIO):
+        self.sessao_factory = sessao_factory
+        self.tamanho = tamanho
+        self.reinicio = reinicio
+        self._janelas = {}
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.aceitas = 0
+        self.repetidas_janela = 0   # recusadas em memória, sem tocar no banco
+        self.repetidas_banco = 0    # seq abaixo da janela ou gravada por outro worker
+        self.consultas_banco = 0
+        self.reiniciadas = 0        # recusadas com SeqReiniciada
+
+    # ----------------------
+    # Antes da gravação
+    # ----------------------
+    def repetidas(self, dados):
+        """
+        Uma marca por leitura de dados: True se o (device_id, seq) dela já
+        foi aceito. As demais ficam reservadas; se a gravação falhar, quem
+        gravou chama liberar para o reenvio não ser tomado por repetição.
+        """
+        chaves = [chave(dado) for dado in dados]
+        marcas = []
+        try:
+            for k in chaves:
+                marcas.append(k is not None and not self._reservar(*k))
+        except SeqReiniciada:
+            self.liberar([k for k, repetida in zip(chaves, marcas) if k is not None and not repetida])
+            raise
+        return marcas
+
+    def _reservar(self, device_id, seq):
+        janela = self._janelas.get(device_id) or self._carregar(device_id)
+        with self._lock:
+            if seq + self.reinicio < janela.maior:
+                self.reiniciadas += 1
+                raise SeqReiniciada(device_id, seq, janela.maior + 1)
+            if seq in janela.seqs:
+                self.repetidas_janela += 1
+                return False
+            if seq >= janela.piso:
+                self._lembrar(janela, seq)
+                return True
+        # Mais antiga que a janela: confere no índice único
+        if self._no_banco(device_id, seq):
+            with self._lock:
+                self.repetidas_banco += 1
+            return False
+        with self._lock:
+            if seq in janela.seqs:
+                self.repetidas_janela += 1
+                return False
+            self._lembrar(janela, seq)
+            return True
+
+    def _lembrar(self, janela, seq):
+        self.aceitas += 1
+        janela.seqs.add(seq)
+        janela.ordem.append(seq)
+        janela.maior = max(janela.maior, seq)
+        if len(janela.ordem) > self.tamanho:
+            velha = janela.ordem.popleft()
+            janela.seqs.discard(velha)
+            janela.piso = max(janela.piso, velha + 1)
+
+    def _carregar(self, device_id):
+        db = self.sessao_factory()
+        try:
+            seqs = db.scalars(
+                select(SensorLeitura.seq)
+                .where(SensorLeitura.device_id == device_id, SensorLeitura.seq.is_not(None))
+                .order_by(SensorLeitura.seq.desc())
+                .limit(self.tamanho)
+            ).all()
+        finally:
+            db.close()
+        # Janela cheia: seqs abaixo da menor carregada podem existir no banco
+        piso = seqs[-1] if len(seqs) == self.tamanho else 0
+        with self._lock:
+            self.consultas_banco += 1
+            return self._janelas.setdefault(device_id, _Janela(seqs, piso))
+
+    def _no_banco(self, device_id, seq):
+        db = self.sessao_factory()
+        try:
+            encontrada = db.scalar(select(SensorLeitura.id).where(
+                SensorLeitura.device_id == device_id, SensorLeitura.seq == seq))
+        finally:
+            db.close()
+        with self._lock:
+            self.consultas_banco += 1
+        return encontrada is not None
+
+    def liberar(self, chaves):
+        with self._lock:
+            for k in chaves:
+                janela = self._janelas.get(k[0]) if k is not None else None
+                if janela is not None:
+                    janela.seqs.discard(k[1])
+
+    # ----------------------
+    # Gravação
+    # ----------------------
+    def gravar(self, db, novas):
+        """
+        add_all + commit das leituras (seqs já reservadas em repetidas).
+        Se o índice único recusar o lote porque outro worker gravou alguma
+        das seqs, grava só o resto. Retorna as leituras gravadas.
+        """
+        try:
+            return self._commit(db, novas)
+        except IntegrityError as erro:
+            existentes = self._existentes(db, novas)
+            gravar = [n for n in novas if (n.device_id, n.seq) not in existentes]
+            if len(gravar) == len(novas):  # outra restrição; não é repetição
+                self.liberar([(n.device_id, n.seq) for n in novas])
+                raise erro
+        with self._lock:
+            self.repetidas_banco += len(novas) - len(gravar)
+        try:
+            return self._commit(db, gravar)
+        except Exception:
+            self.liberar([(n.device_id, n.seq) for n in gravar])
+            raise
+
+    def _commit(self, db, novas):
+        try:
+            db.add_all(novas)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            raise
+        except Exception:
+            db.rollback()
+            self.liberar([(n.device_id, n.seq) for n in novas])
+            raise
+        return novas
+
+    def _existentes(self, db, novas):
+        chaves = [(n.device_id, n.seq) for n in novas if n.seq is not None]
+        if not chaves:
+            return set()
+        colunas = (SensorLeitura.device_id, SensorLeitura.seq)
+        return set(map(tuple, db.execute(select(*colunas).where(tuple_(*colunas).in_(chaves)))))
+
+    # ----------------------
+    # Métricas
+    # ----------------------
+    def status(self):
+        return {
+            "dispositivos": len(self._janelas),
+            "janela": self.tamanho,
+            "aceitas": self.aceitas,
+            "repetidas_janela": self.repetidas_janela,
+            "repetidas_banco": self.repetidas_banco,
+            "consultas_banco": self.consultas_banco,
+            "reiniciadas": self.reiniciadas,
+        }
@@ -0,0 +1,341 @@
+# inferencia.py
+# Servidor de modelos residente da API Ecovita.
+# Carrega os artefatos de ML-1, ML-2 e ML-3 uma única vez (no startup da
+# API), aquece cada modelo com um lote fictício e serve as predições da
+# memória. Os scripts ml1.py/ml2.py/ml3.py continuam sendo só de treino.
+# Dependências: numpy, tensorflow, joblib (as mesmas dos scripts de treino)
+
+import os
+import threading
+from collections import deque
+from datetime import date, datetime
+
+import numpy as np
+
+from bd import MLResultado, ML3Resultado, Teste, gases_por_composto
+from microlote import MicroLote
+
+# -------------------------
+# Artefatos (gerados por ml1.py, ml2.py e ml3.py)
+# -------------------------
+MODELOS_DIR = os.getenv("ECOVITA_MODELOS_DIR", ".")
+
+ML1_MODELO = "modelo_toxicidade_fase.h5"
+ML1_SCALER = "scaler_toxicidade_fase.pkl"
+ML1_ENCODERS = "encoders_toxicidade_fase.pkl"
+ML2_MODELO = os.path.join("ml2_artifacts", "ml2_dual_head.h5")
+ML2_SCALER = os.path.join("ml2_artifacts", "scaler_ml2.pkl")
+ML3_MODELO = os.path.join("ml3_artifacts", "ml3_context_filter.h5")
+ML3_SCALER = os.path.join("ml3_artifacts", "scaler_ml3.pkl")
+ML3_ENCODER = os.path.join("ml3_artifacts", "label_encoder_fase.pkl")
+
+LOTE_AQUECIMENTO = 8
+
+# -------------------------
+# Features (mesma ordem usada no treino)
+# -------------------------
+# ML-1: tabela de compostos de ml1.py -> (família química, PEL_IDHL médio em ppb)
+COMPOSTOS_ML1 = {
+    "Acetaldeído": ("Aldeído", 200), "Acetona": ("Cetona", 1000),
+    "Acroleína": ("Aldeído insaturado", 0.1), "Ácido acético": ("Ácido carboxílico", 10),
+    "Ácido butírico": ("Ácido carboxílico", 10), "Ácido caproico": ("Ácido carboxílico", 10),
+    "Ácido fórmico": ("Ácido carboxílico", 50), "Ácido isovalérico": ("Ácido carboxílico ramificado", 10),
+    "Ácido lático": ("Ácido hidroxi-carboxílico", 10), "Ácido propiônico": ("Ácido carboxílico", 10),
+    "Amônia": ("Amina inorgânica", 50), "Cadaverina": ("Amina alifática", 50),
+    "Dimetil sulfeto": ("Sulfeto orgânico", 10), "Escatol": ("Amina heterocíclica", 10),
+    "Fenol": ("Fenol", 5),
+}
+COMPOSTOS_NITROGENADOS = ["Amônia", "Cadaverina", "Putrescina", "Trimetilamina"]
+TOXICIDADE_BD = {"baixa": "baixa", "média": "moderada", "alta": "alta"}  # rótulo ML-1 -> enum do banco
+
+# ML-2: ml2.input_cols e ml2.gases
+ML2_SENSORES_MQ = ["MQ2", "MQ4", "MQ135", "MQ136"]
+ML2_INPUT_COLS = [
+    "MQ2_cal", "MQ4_cal", "MQ135_cal", "MQ136_cal",
+    "CCS_TVOC_ma", "CCS_eCO2_ma",
+    "BME_Temp", "BME_Hum", "BME_Press",
+    "MQ2_ma", "MQ4_ma", "MQ135_ma", "MQ136_ma",
+    "MQ2_diff", "MQ4_diff", "MQ135_diff", "MQ136_diff"
+]
+ML2_GASES = ["Metano", "Amonia", "H2S", "Acetona", "Etanol", "Formaldeído"]
+ML2_JANELA = 5                 # ml2.SEQ_WINDOW
+PRESSAO_PADRAO_HPA = 1013.25   # o Mega não tem BME: usa pressão ao nível do mar
+
+# O Mega envia ppm = leitura MQ * fator (ver arduino.c++); invertendo um
+# composto de cada sensor recuperamos a leitura bruta do MQ.
+MQ_POR_COMPOSTO = {"MQ2": ("Metano", 0.4), "MQ135": ("Amônia", 0.3), "MQ136": ("H2S", 0.6)}
+
+# ML-3: ml3.feature_cols
+ML3_FEATURE_COLS = ["Temp", "pH", "Umidade", "O2", "Tempo"]
+
+
+def classificar_tipo_cov(familia):
+    """Mesma regra de ml1.classificar_tipo_cov."""
+    familia = familia.lower()
+    for chave, tipo in (("ácido", "ácido"), ("álcool", "álcool"), ("aldeído", "aldeído"),
+                        ("cetona", "cetona"), ("sulfeto", "sulfurado"), ("amina", "amina"),
+                        ("hidrocarboneto", "hidrocarboneto")):
+        if chave in familia:
+            return tipo
+    return "outro"
+
+
+class ServidorModelos:
+    """Mantém os três modelos e seus pré-processadores em memória."""
+
+    def __init__(self, pasta=MODELOS_DIR):
+        self.pasta = pasta
+        self.ml1 = self.ml2 = self.ml3 = None
+        self.tempo_carga_s = {}
+        # Estado de janela do ML-2 (mediana/média móvel/derivada dos MQ), uma
+        # por pilha: device_id -> deque (None = leituras sem placa)
+        self._janelas_mq = {}
+        self._lock_ml2 = threading.Lock()
+
+    # ----------------------
+    # Carga e aquecimento
+    # ----------------------
+    def _caminho(self, nome):
+        return os.path.join(self.pasta, nome)
+
+    def _disponivel(self, *nomes):
+        faltando = [n for n in nomes if not os.path.exists(self._caminho(n))]
+        if faltando:
+            print("⚠️  Artefatos não encontrados, modelo desativado:", ", ".join(faltando))
+        return not faltando
+
+    def carregar(self):
+        """Carrega e aquece todos os modelos cujos artefatos existirem."""
+        try:
+            import joblib
+            import tensorflow as tf
+        except ImportError as e:
+            print("⚠️  Inferência desativada:", e)
+            return
+
+        def carregar_keras(nome, n_features):
+            modelo = tf.keras.models.load_model(self._caminho(nome), compile=False)
+            # Primeira chamada constrói o grafo; depois disso cada lote custa ms
+            modelo(np.zeros((LOTE_AQUECIMENTO, n_features), dtype="float32"), training=False)
+            return modelo
+
+        inicio = datetime.now()
+        if self._disponivel(ML1_MODELO, ML1_SCALER, ML1_ENCODERS):
+            self.ml1 = {
+                "modelo": carregar_keras(ML1_MODELO, 8),
+                "scaler": joblib.load(self._caminho(ML1_SCALER)),
+                "encoders": joblib.load(self._caminho(ML1_ENCODERS)),
+            }
+            self.tempo_carga_s["ml1"] = (datetime.now() - inicio).total_seconds()
+
+        inicio = datetime.now()
+        if self._disponivel(ML2_MODELO, ML2_SCALER):
+            modelo = carregar_keras(ML2_MODELO, len(ML2_INPUT_COLS))
+            self.ml2 = {
+                "modelo": modelo,
+                "scaler": joblib.load(self._caminho(ML2_SCALER)),
+                "lote": MicroLote(lambda X, m=modelo: self._forward(m, X), nome="ml2"),
+            }
+            self.tempo_carga_s["ml2"] = (datetime.now() - inicio).total_seconds()
+
+        inicio = datetime.now()
+        if self._disponivel(ML3_MODELO, ML3_SCALER, ML3_ENCODER):
+            modelo = carregar_keras(ML3_MODELO, len(ML3_FEATURE_COLS))
+            self.ml3 = {
+                "modelo": modelo,
+                "scaler": joblib.load(self._caminho(ML3_SCALER)),
+                "encoder": joblib.load(self._caminho(ML3_ENCODER)),
+                "lote": MicroLote(lambda X, m=modelo: self._forward(m, X), nome="ml3"),
+            }
+            self.tempo_carga_s["ml3"] = (datetime.now() - inicio).total_seconds()
+
+    def status(self):
+        return {
+            "ml1": self.ml1 is not None,
+            "ml2": self.ml2 is not None,
+            "ml3": self.ml3 is not None,
+            "tempo_carga_s": self.tempo_carga_s,
+            "janelas_ml2": len(self._janelas_mq),
+            "microlote": {
+                nome: m["lote"].status() for nome, m in (("ml2", self.ml2), ("ml3", self.ml3)) if m
+            },
+        }
+
+    @staticmethod
+    def _forward(modelo, X):
+        """Uma passada na rede; mais barato que model.predict para lotes pequenos."""
+        return [np.asarray(saida, dtype=float) for saida in modelo(X.astype("float32"), training=False)]
+
+    # ----------------------
+    # ML-1: toxicidade da dupla verde/marrom
+    # ----------------------
+    def prever_toxicidade(self, site_dado, db):
+        if self.ml1 is None:
+            return None
+        encoders = self.ml1["encoders"]
+        verde, marrom = site_dado.composto_verde, site_dado.composto_marrom
+        if verde not in COMPOSTOS_ML1 or marrom not in COMPOSTOS_ML1:
+            return {"toxicidade": "desconhecido", "motivo": "composto fora da base do ML-1"}
+
+        fam_verde, ppb_verde = COMPOSTOS_ML1[verde]
+        fam_marrom, ppb_marrom = COMPOSTOS_ML1[marrom]
+        categorias = {
+            "verde": verde,
+            "marrom": marrom,
+            "tipo_verde": classificar_tipo_cov(fam_verde),
+            "tipo_marrom": classificar_tipo_cov(fam_marrom),
+            "CN_verde": "N" if verde in COMPOSTOS_NITROGENADOS else "C",
+            "CN_marrom": "N" if marrom in COMPOSTOS_NITROGENADOS else "C",
+        }
+        # ml1.py só treina os pares i < j da tabela: um composto pode nunca ter
+        # aparecido como verde (ou marrom), e o LabelEncoder recusa rótulos novos
+        if any(valor not in encoders[nome].classes_ for nome, valor in categorias.items()):
+            return {"toxicidade": "desconhecido", "motivo": "combinação fora do treino do ML-1"}
+        x = np.array([[
+            *(encoders[nome].transform([valor])[0] for nome, valor in categorias.items()),
+            ppb_verde, ppb_marrom,
+        ]], dtype=float)
+        prob_tox, prob_fase = self._forward(self.ml1["modelo"], self.ml1["scaler"].transform(x))
+        toxicidade = encoders["toxicidade"].classes_[int(np.argmax(prob_tox[0]))]
+        fase = encoders["fase"].classes_[int(np.argmax(prob_fase[0]))]
+
+        dupla = f"{verde} + {marrom}"
+        resultado = MLResultado(
+            id_teste=site_dado.id_teste,
+            device_id=site_dado.device_id,
+            toxicidade_geral=TOXICIDADE_BD.get(toxicidade),
+            dupla_toxica=dupla if toxicidade == "alta" else None,
+            dupla_atoxica=dupla if toxicidade == "baixa" else None,
+            recomendacao=f"Fase da compostagem associada: {fase}",
+            data_registro=datetime.now()
+        )
+        db.add(resultado)
+        db.flush()
+        res = {
+            "toxicidade": toxicidade,
+            "fase": fase,
+            "probabilidades": dict(zip(encoders["toxicidade"].classes_, prob_tox[0].round(4).tolist())),
+            "id_resultado": resultado.id,
+        }
+        db.commit()
+        return res
+
+    # ----------------------
+    # ML-2: perfil de gases
+    # ----------------------
+    def _linha_ml2(self, leitura):
+        """Monta as 17 features de ml2.input_cols a partir de uma leitura do Mega."""
+        gases = gases_por_composto(leitura.gases)
+        mq = {s: 0.0 for s in ML2_SENSORES_MQ}
+        for sensor, (composto, fator) in MQ_POR_COMPOSTO.items():
+            mq[sensor] = gases.get(composto, 0.0) / fator
+        janela_mq = self._janelas_mq.get(leitura.device_id)
+        if janela_mq is None:
+            janela_mq = self._janelas_mq[leitura.device_id] = deque(maxlen=ML2_JANELA)
+        anterior = janela_mq[-1] if janela_mq else mq
+        janela_mq.append(mq)
+
+        janela = {s: [m[s] for m in janela_mq] for s in ML2_SENSORES_MQ}
+        f = {
+            "CCS_TVOC_ma": 0.0, "CCS_eCO2_ma": 0.0,  # o Mega não tem CCS811
+            "BME_Temp": leitura.temperatura or 0.0,
+            "BME_Hum": leitura.umidade or 0.0,
+            "BME_Press": PRESSAO_PADRAO_HPA,
+        }
+        for s in ML2_SENSORES_MQ:
+            f[s + "_cal"] = mq[s] / (float(np.median(janela[s])) + 1e-8)
+            f[s + "_ma"] = float(np.mean(janela[s]))
+            f[s + "_diff"] = mq[s] - anterior[s]
+        return [f[c] for c in ML2_INPUT_COLS]
+
+    def prever_gases_lote(self, leituras, db):
+        if self.ml2 is None:
+            return [None] * len(leituras)
+        # A janela móvel depende da ordem de chegada: monta as linhas sob lock
+        with self._lock_ml2:
+            X = np.array([self._linha_ml2(l) for l in leituras], dtype=float)
+        # Requisições concorrentes compartilham um único forward pass
+        gases_pred, compacto_pred = self.ml2["lote"].submeter(self.ml2["scaler"].transform(X))
+        return [
+            {
+                "gases_ppb": dict(zip(ML2_GASES, g.round(3).tolist())),
+                "toxicidade_est": round(float(c[0]), 4),
+                "classe_quim_score": round(float(c[1]), 4),
+                "pel_adjust": round(float(c[2]), 4),
+            }
+            for g, c in zip(gases_pred, compacto_pred)
+        ]
+
+    # ----------------------
+    # ML-3: fase + coerência de contexto
+    # ----------------------
+    def _dias_de_teste(self, leituras, db):
+        """Dias desde o início do teste de cada leitura (uma consulta por lote)."""
+        ids = {l.id_teste for l in leituras if l.id_teste is not None}
+        inicio = dict(db.query(Teste.id, Teste.data_inicio).filter(Teste.id.in_(ids)).all()) if ids else {}
+        dias = []
+        for l in leituras:
+            d0 = inicio.get(l.id_teste)
+            quando = (l.data_registro or datetime.now()).date()
+            dias.append(float((quando - d0).days) if isinstance(d0, date) else 0.0)
+        return dias
+
+    def validar_contexto_lote(self, leituras, db):
+        """A fase e a coerência dependem só do contexto da leitura (sem o ML-2)."""
+        if self.ml3 is None:
+            return [None] * len(leituras)
+        dias = self._dias_de_teste(leituras, db)
+        X = np.array([
+            [l.temperatura or 0.0, l.ph or 0.0, l.umidade or 0.0, l.o2 or 0.0, t]
+            for l, t in zip(leituras, dias)
+        ], dtype=float)
+        prob_fase, coerencia = self.ml3["lote"].submeter(self.ml3["scaler"].transform(X))
+        classes = list(self.ml3["encoder"].classes_)
+
+        resultados = []
+        agora = datetime.now()
+        for leitura, probs, coh in zip(leituras, prob_fase, coerencia):
+            p = dict(zip(classes, probs.tolist()))
+            resultados.append(ML3Resultado(
+                id_leitura=leitura.id,
+                device_id=leitura.device_id,
+                fase_predita=classes[int(np.argmax(probs))],
+                prob_fase_inicial=p.get("Inicial"),
+                prob_fase_termofilica=p.get("Termofilica"),
+                prob_fase_maturacao=p.get("Maturacao"),
+                score_coerencia=float(coh[0]),
+                data_analise=agora
+            ))
+        # Monta a resposta antes do commit, que expira os atributos
+        res = [
+            {
+                "fase_predita": r.fase_predita,
+                "prob_fase_inicial": r.prob_fase_inicial,
+                "prob_fase_termofilica": r.prob_fase_termofilica,
+                "prob_fase_maturacao": r.prob_fase_maturacao,
+                "score_coerencia": r.score_coerencia,
+            }
+            for r in resultados
+        ]
+        db.add_all(resultados)
+        db.commit()
+        return res
+
+
+# Instância única usada pela API
+modelos = ServidorModelos()
+
+def prever_toxicidade(site_dado, db):
+    return modelos.prever_toxicidade(site_dado, db)
+
+def prever_gases_lote(leituras, db):
+    return modelos.prever_gases_lote(leituras, db)
+
+def validar_contexto_lote(leituras, db):
+    return modelos.validar_contexto_lote(leituras, db)
+
+def prever_gases(leitura, db):
+    return prever_gases_lote([leitura], db)[0]
+
+def validar_contexto(leitura, db):
+    return validar_contexto_lote([leitura], db)[0]
@@ -0,0 +1,179 @@
+# ingestao.py
+# Modo de ingestão assíncrona (write-behind) da API Ecovita.
+# A rota só valida e enfileira a leitura; uma thread gravadora dedicada
+# agrupa várias leituras por commit no SQLite e depois entrega o lote
+# para a inferência (ML-2/ML-3), sem prender a conexão HTTP do ESP32.
+
+import itertools
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from sqlalchemy import func
+
+from bd import SensorLeitura
+
+# -------------------------
+# Configurações (variáveis de ambiente)
+# -------------------------
+INGESTAO_ASSINCRONA = os.getenv("ECOVITA_INGESTAO_ASSINCRONA", "0") == "1"
+FILA_MAX = int(os.getenv("ECOVITA_FILA_MAX", "10000"))           # leituras aguardando gravação
+LOTE_MAX = int(os.getenv("ECOVITA_LOTE_MAX", "500"))             # leituras por commit
+JANELA_LOTE_S = float(os.getenv("ECOVITA_JANELA_LOTE_MS", "50")) / 1000
+
+
+class FilaCheia(Exception):
+    """A fila de ingestão atingiu FILA_MAX; o cliente deve tentar de novo."""
+
+
+def _gravar(db, novas):
+    db.add_all(novas)
+    db.commit()
+    return novas
+
+
+class FilaIngestao:
+    """
+    Fila limitada + thread gravadora com group commit.
+
+    - montar(dado, agora, id) -> SensorLeitura: constrói a linha a gravar
+    - inferir(leituras, db): roda os modelos sobre o lote já gravado
+    - gravar(db, leituras) -> gravadas: add_all + commit (por padrão, sem
+      filtro; a API passa o de idempotencia.py)
+
+    Os ids das leituras são reservados na hora do enfileiramento (a partir
+    do maior id existente), para a rota já devolvê-los no 202. Por isso,
+    com o modo assíncrono ligado, toda gravação de SensorLeitura do
+    processo deve passar por esta fila.
+    """
+
+    def __init__(self, sessao_factory, montar, inferir, gravar=None,
+                 tamanho=FILA_MAX, lote_max=LOTE_MAX, janela_s=JANELA_LOTE_S):
+        self.sessao_factory = sessao_factory
+        self.montar = montar
+        self.inferir = inferir
+        self.gravar = gravar or _gravar
+        self.lote_max = lote_max
+        self.janela_s = janela_s
+        self.fila = queue.Queue(maxsize=tamanho)
+        self._ids = None
+        self._lock_ids = threading.Lock()
+        self._thread = None
+        self._parar = threading.Event()
+
+        # Métricas
+        self.lotes_gravados = 0
+        self.leituras_gravadas = 0
+        self.recusadas = 0
+        self.erros = 0
+        self.ultima_latencia_commit_ms = 0.0
+        self.max_latencia_commit_ms = 0.0
+        self._soma_latencia_commit_ms = 0.0
+
+    # ----------------------
+    # Ciclo de vida
+    # ----------------------
+    def iniciar(self):
+        db = self.sessao_factory()
+        try:
+            ultimo_id = db.query(func.max(SensorLeitura.id)).scalar() or 0
+        finally:
+            db.close()
+        self._ids = itertools.count(ultimo_id + 1)
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._gravador, name="ecovita-gravador", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout=10.0):
+        """Sinaliza a thread e espera ela esvaziar a fila."""
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ----------------------
+    # Produtores (rotas)
+    # ----------------------
+    def enfileirar(self, dado, agora=None):
+        """Reserva um id e coloca a leitura na fila. Levanta FilaCheia."""
+        return self.enfileirar_lote([dado], agora)[0]
+
+    def enfileirar_lote(self, dados, agora=None):
+        agora = agora or datetime.now()
+        with self._lock_ids:
+            # Checa o espaço antes de reservar ids para não deixar lote pela metade
+            if self.fila.maxsize - self.fila.qsize() < len(dados):
+                self.recusadas += len(dados)
+                raise FilaCheia()
+            ids = [next(self._ids) for _ in dados]
+            for id_leitura, dado in zip(ids, dados):
+                self.fila.put_nowait((id_leitura, dado, agora))
+        return ids
+
+    # ----------------------
+    # Consumidor (thread gravadora)
+    # ----------------------
+    def _coletar_lote(self):
+        try:
+            itens = [self.fila.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        limite = time.monotonic() + self.janela_s
+        while len(itens) < self.lote_max:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                itens.append(self.fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return itens
+
+    def _gravador(self):
+        while not (self._parar.is_set() and self.fila.empty()):
+            itens = self._coletar_lote()
+            if not itens:
+                continue
+            db = self.sessao_factory(expire_on_commit=False)
+            try:
+                novas = [self.montar(dado, agora, id_leitura) for id_leitura, dado, agora in itens]
+                inicio = time.perf_counter()
+                gravadas = self.gravar(db, novas)
+                self._registrar_commit(len(gravadas), (time.perf_counter() - inicio) * 1000)
+                self.inferir(gravadas, db)
+            except Exception:
+                db.rollback()
+                self.erros += 1
+                traceback.print_exc()
+            finally:
+                db.close()
+                for _ in itens:
+                    self.fila.task_done()
+
+    def _registrar_commit(self, n, latencia_ms):
+        self.lotes_gravados += 1
+        self.leituras_gravadas += n
+        self.ultima_latencia_commit_ms = latencia_ms
+        self.max_latencia_commit_ms = max(self.max_latencia_commit_ms, latencia_ms)
+        self._soma_latencia_commit_ms += latencia_ms
+
+    # ----------------------
+    # Métricas
+    # ----------------------
+    def status(self):
+        return {
+            "profundidade_fila": self.fila.qsize(),
+            "capacidade_fila": self.fila.maxsize,
+            "lotes_gravados": self.lotes_gravados,
+            "leituras_gravadas": self.leituras_gravadas,
+            "recusadas_fila_cheia": self.recusadas,
+            "erros": self.erros,
+            "latencia_commit_ms": {
+                "ultima": round(self.ultima_latencia_commit_ms, 3),
+                "media": round(self._soma_latencia_commit_ms / self.lotes_gravados, 3) if self.lotes_gravados else 0.0,
+                "max": round(self.max_latencia_commit_ms, 3),
+            },
+        }
@@ -0,0 +1,245 @@
+# metricas.py
+# Métricas da API no formato texto do Prometheus (GET /metrics): contador e
+# histograma de latência por rota, histogramas por etapa (commit do SQLite,
+# ML-1, ML-2, ML-3) e medidores lidos só na coleta (filas, pools do banco,
+# micro-lotes). No caminho da requisição cada medida é um bisect e três
+# somas sob um lock; todo o texto é montado na hora do scrape.
+#
+# A latência por rota vem de um middleware ASGI puro (sem o
+# BaseHTTPMiddleware do Starlette, que custa dezenas de µs); o rótulo é o
+# caminho declarado da rota ("/dispositivos/{device_id}"), não a URL, para
+# o número de séries não crescer com os ids.
+
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Limites dos histogramas, em segundos
+LIMITES_REQUISICAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_ETAPA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+SEM_ROTA = "(sem rota)"   # 404 e afins: um rótulo só, qualquer que seja a URL
+
+TIPO_CONTEUDO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _rotulos(nomes, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _aspas(valor):
+    return f'"{valor}"'
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    """Contagens por faixa (não acumuladas; o texto acumula na coleta), soma e total."""
+    __slots__ = ("limites", "contagens", "soma", "total")
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+    def linhas(self, nome, nomes, valores):
+        acumulado = 0
+        for limite, n in zip(self.limites, self.contagens):
+            acumulado += n
+            yield f"{nome}_bucket{_rotulos(nomes, valores, 'le=%s' % _aspas(limite))} {acumulado}"
+        yield f"{nome}_bucket{_rotulos(nomes, valores, 'le=%s' % _aspas('+Inf'))} {self.total}"
+        yield f"{nome}_sum{_rotulos(nomes, valores)} {self.soma!r}"
+        yield f"{nome}_count{_rotulos(nomes, valores)} {self.total}"
+
+
+class _Serie:
+    """Latências de uma (método, rota) e o total de respostas por status."""
+    __slots__ = ("histograma", "status")
+
+    def __init__(self):
+        self.histograma = Histograma(LIMITES_REQUISICAO)
+        self.status = {}
+
+
+class _Cronometro:
+    """Context manager de Metricas.etapa (uma classe sai mais barato que @contextmanager)."""
+    __slots__ = ("metricas", "nome", "inicio")
+
+    def __init__(self, metricas, nome):
+        self.metricas = metricas
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *_):
+        self.metricas.observar_etapa(self.nome, time.perf_counter() - self.inicio)
+
+
+class Metricas:
+    """
+    Registro das métricas de um processo da API.
+
+    - requisicao(metodo, rota, status, segundos): chamado pelo middleware
+    - etapa(nome): context manager que cronometra uma etapa da ingestão
+    - medidor(nome, ajuda, ler, rotulos): valor lido só na coleta; ler()
+      devolve um número, um Histograma ou um dict {valores dos rótulos: um dos dois}
+    - texto(): o corpo de GET /metrics
+    """
+
+    def __init__(self, prefixo="ecovita"):
+        self.prefixo = prefixo
+        self._lock = threading.Lock()
+        self._series = {}        # (metodo, rota) -> _Serie
+        self._etapas = {}        # etapa -> Histograma
+        self._medidores = []     # (nome, tipo, ajuda, rotulos, ler)
+
+    # ----------------------
+    # Caminho da requisição
+    # ----------------------
+    def requisicao(self, metodo, rota, status, segundos):
+        with self._lock:
+            serie = self._series.get((metodo, rota))
+            if serie is None:
+                serie = self._series[(metodo, rota)] = _Serie()
+            serie.status[status] = serie.status.get(status, 0) + 1
+            serie.histograma.observar(segundos)
+
+    def observar_etapa(self, nome, segundos):
+        with self._lock:
+            histograma = self._etapas.get(nome)
+            if histograma is None:
+                histograma = self._etapas[nome] = Histograma(LIMITES_ETAPA)
+            histograma.observar(segundos)
+
+    def etapa(self, nome):
+        return _Cronometro(self, nome)
+
+    def medir_commits(self, sessao=Session):
+        """Cronometra todo commit das sessões (sync e async): flush + COMMIT do SQLite."""
+        @event.listens_for(sessao, "before_commit")
+        def _antes(db):
+            db.info["metricas_commit"] = time.perf_counter()
+
+        @event.listens_for(sessao, "after_commit")
+        def _depois(db):
+            inicio = db.info.pop("metricas_commit", None)
+            if inicio is not None:
+                self.observar_etapa("commit", time.perf_counter() - inicio)
+
+        @event.listens_for(sessao, "after_rollback")
+        def _desfeito(db):
+            db.info.pop("metricas_commit", None)
+
+    # ----------------------
+    # Coleta
+    # ----------------------
+    def medidor(self, nome, ajuda, ler, rotulos=(), tipo="gauge"):
+        self._medidores.append((f"{self.prefixo}_{nome}", tipo, ajuda, tuple(rotulos), ler))
+
+    def texto(self):
+        p = self.prefixo
+        with self._lock:
+            requisicoes = {(*k, status): n for k, serie in self._series.items() for status, n in serie.status.items()}
+            latencias = {k: _copia(serie.histograma) for k, serie in self._series.items()}
+            etapas = {k: _copia(h) for k, h in self._etapas.items()}
+
+        linhas = [
+            f"# HELP {p}_requisicoes_total Requisições HTTP atendidas, por rota e status.",
+            f"# TYPE {p}_requisicoes_total counter",
+        ]
+        linhas += [f"{p}_requisicoes_total{_rotulos(('metodo', 'rota', 'status'), k)} {n}"
+                   for k, n in sorted(requisicoes.items())]
+        linhas += [
+            f"# HELP {p}_requisicao_segundos Latência das requisições HTTP, por rota.",
+            f"# TYPE {p}_requisicao_segundos histogram",
+        ]
+        for k, h in sorted(latencias.items()):
+            linhas += h.linhas(f"{p}_requisicao_segundos", ("metodo", "rota"), k)
+        linhas += [
+            f"# HELP {p}_etapa_segundos Duração das etapas da ingestão (commit, ml1, ml2, ml3).",
+            f"# TYPE {p}_etapa_segundos histogram",
+        ]
+        for nome, h in sorted(etapas.items()):
+            linhas += h.linhas(f"{p}_etapa_segundos", ("etapa",), (nome,))
+
+        for nome, tipo, ajuda, rotulos, ler in self._medidores:
+            try:
+                valor = ler()
+            except Exception as e:  # um medidor quebrado não derruba o scrape
+                print(f"Erro ao ler a métrica {nome}:", e)
+                continue
+            if valor is None:
+                continue
+            linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} {tipo}"]
+            if not isinstance(valor, dict):
+                valor = {(): valor}
+            for k, v in valor.items():
+                k = k if isinstance(k, tuple) else (k,)
+                if isinstance(v, Histograma):
+                    linhas += v.linhas(nome, rotulos, k)
+                else:
+                    linhas.append(f"{nome}{_rotulos(rotulos, k)} {_numero(v)}")
+        return "\n".join(linhas) + "\n"
+
+
+def _copia(h):
+    c = Histograma(h.limites)
+    c.contagens, c.soma, c.total = list(h.contagens), h.soma, h.total
+    return c
+
+
+def uso_pool(engines):
+    """{(engine, estado): conexões} dos pools do SQLAlchemy (escrita/leitura, sync/async)."""
+    uso = {}
+    for nome, engine in engines.items():
+        if engine is None:
+            continue
+        pool = getattr(engine, "sync_engine", engine).pool
+        if not hasattr(pool, "checkedout"):
+            continue  # pool sem contagem (StaticPool, NullPool)
+        uso[(nome, "em_uso")] = pool.checkedout()
+        uso[(nome, "tamanho")] = pool.size()
+    return uso
+
+
+class MedirRequisicoes:
+    """Middleware ASGI: conta e cronometra cada requisição HTTP até o fim da resposta."""
+
+    def __init__(self, app, metricas):
+        self.app = app
+        self.metricas = metricas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        inicio = time.perf_counter()
+        status = 500   # exceção antes de http.response.start vira 500 no ServerErrorMiddleware
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+            await send(mensagem)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            # O roteador do FastAPI deixa a rota encontrada em scope["route"]
+            rota = scope.get("route")
+            self.metricas.requisicao(scope["method"], getattr(rota, "path", SEM_ROTA), status,
+                                     time.perf_counter() - inicio)
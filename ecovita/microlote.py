@@ -0,0 +1,133 @@
+# microlote.py
+# Agendador de micro-lotes para os modelos Keras da API.
+# Requisições concorrentes que chegam dentro de uma janela curta (ou até
+# encher LOTE_MAX linhas) são concatenadas num único forward pass, e cada
+# requisição recebe de volta só as suas linhas do resultado.
+
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+import numpy as np
+
+# -------------------------
+# Configurações (variáveis de ambiente)
+# -------------------------
+JANELA_MS = float(os.getenv("ECOVITA_MICROLOTE_JANELA_MS", "5"))   # 0 desliga o agendador
+LOTE_MAX = int(os.getenv("ECOVITA_MICROLOTE_MAX", "64"))           # linhas por forward pass
+
+FAIXAS_LOTE = [1, 2, 4, 8, 16, 32, 64, 128, 256]   # limites do histograma de tamanho de lote
+AMOSTRAS_ATRASO = 2048                             # atrasos recentes guardados para percentis
+
+
+class _Pedido:
+    __slots__ = ("X", "chegada", "pronto", "saidas", "erro")
+
+    def __init__(self, X):
+        self.X = X
+        self.chegada = time.perf_counter()
+        self.pronto = threading.Event()
+        self.saidas = None
+        self.erro = None
+
+
+class MicroLote:
+    """
+    executar(X) -> lista de arrays com uma linha por linha de X
+    (as saídas de um modelo Keras de várias cabeças).
+    """
+
+    def __init__(self, executar, nome="", janela_ms=JANELA_MS, lote_max=LOTE_MAX):
+        self.executar = executar
+        self.nome = nome
+        self.janela_s = janela_ms / 1000
+        self.lote_max = lote_max
+        self.fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.forward_passes = 0
+        self.linhas = 0
+        self.histograma_lote = [0] * (len(FAIXAS_LOTE) + 1)
+        self._atrasos_ms = deque(maxlen=AMOSTRAS_ATRASO)
+
+    def submeter(self, X):
+        """Bloqueia até o lote que contém X ser processado e devolve as saídas de X."""
+        if self.janela_s <= 0:
+            return self.executar(X)
+        self._garantir_thread()
+        pedido = _Pedido(X)
+        self.fila.put(pedido)
+        pedido.pronto.wait()
+        if pedido.erro is not None:
+            raise pedido.erro
+        return pedido.saidas
+
+    def _garantir_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._laco, name=f"ecovita-microlote-{self.nome}", daemon=True)
+                    self._thread.start()
+
+    def _coletar(self):
+        pedidos = [self.fila.get()]
+        linhas = len(pedidos[0].X)
+        limite = time.perf_counter() + self.janela_s
+        while linhas < self.lote_max:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                pedido = self.fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            pedidos.append(pedido)
+            linhas += len(pedido.X)
+        return pedidos
+
+    def _laco(self):
+        while True:
+            pedidos = self._coletar()
+            inicio = time.perf_counter()
+            try:
+                saidas = self.executar(np.concatenate([p.X for p in pedidos]))
+                fim = 0
+                for p in pedidos:
+                    ini, fim = fim, fim + len(p.X)
+                    p.saidas = [s[ini:fim] for s in saidas]
+            except Exception as e:
+                for p in pedidos:
+                    p.erro = e
+            self._registrar(pedidos, inicio)
+            for p in pedidos:
+                p.pronto.set()
+
+    def _registrar(self, pedidos, inicio):
+        n = sum(len(p.X) for p in pedidos)
+        self.forward_passes += 1
+        self.linhas += n
+        self.histograma_lote[bisect_left(FAIXAS_LOTE, n)] += 1
+        self._atrasos_ms.extend((inicio - p.chegada) * 1000 for p in pedidos)
+
+    def status(self):
+        atrasos = np.array(self._atrasos_ms) if self._atrasos_ms else np.zeros(1)
+        faixas = [f"<={f}" for f in FAIXAS_LOTE] + [f">{FAIXAS_LOTE[-1]}"]
+        return {
+            "janela_ms": self.janela_s * 1000,
+            "lote_max": self.lote_max,
+            "forward_passes": self.forward_passes,
+            "linhas": self.linhas,
+            "lote_medio": round(self.linhas / self.forward_passes, 2) if self.forward_passes else 0.0,
+            "histograma_lote": dict(zip(faixas, self.histograma_lote)),
+            "atraso_fila_ms": {
+                "p50": round(float(np.percentile(atrasos, 50)), 3),
+                "p95": round(float(np.percentile(atrasos, 95)), 3),
+                "max": round(float(atrasos.max()), 3),
+            },
+        }
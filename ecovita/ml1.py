@@ -146,8 +146,15 @@ encoders = {
     "fase": LabelEncoder()
 }
 
-for col in ['composto_verde','composto_marrom','tipo_verde_cod','tipo_marrom_cod','CN_verde','CN_marrom','toxicidade','fase_compostagem']:
-    df_simulado[col+'_enc'] = encoders[col.split('_')[0]].fit_transform(df_simulado[col])
+# Coluna -> chave do encoder (o inferencia.py usa as mesmas chaves)
+colunas_encoder = {
+    'composto_verde': 'verde', 'composto_marrom': 'marrom',
+    'tipo_verde_cod': 'tipo_verde', 'tipo_marrom_cod': 'tipo_marrom',
+    'CN_verde': 'CN_verde', 'CN_marrom': 'CN_marrom',
+    'toxicidade': 'toxicidade', 'fase_compostagem': 'fase'
+}
+for col, chave in colunas_encoder.items():
+    df_simulado[col+'_enc'] = encoders[chave].fit_transform(df_simulado[col])
 
 # ==================================================
 # 5. Preparação de Features e Targets
@@ -0,0 +1,230 @@
+# ouvinte.py
+# Ingestão por protocolo de linhas, ao lado da API HTTP: cada leitura é uma
+# linha JSON (o mesmo objeto de /esp32/leitura) terminada em "\n", enviada
+# por uma conexão TCP persistente ou em datagramas UDP (uma ou mais linhas
+# por datagrama). Sem cabeçalhos nem resposta por leitura; as linhas de
+# todas as conexões são agrupadas e gravadas num único commit por lote.
+
+import asyncio
+import json
+import os
+import socket
+import time
+
+# -------------------------
+# Configurações (variáveis de ambiente)
+# -------------------------
+HOST = os.getenv("ECOVITA_LINHAS_HOST", "0.0.0.0")
+PORTA_TCP = int(os.getenv("ECOVITA_LINHAS_TCP") or 0) or None  # vazio/0 desliga
+PORTA_UDP = int(os.getenv("ECOVITA_LINHAS_UDP") or 0) or None  # vazio/0 desliga
+FILA_MAX = int(os.getenv("ECOVITA_LINHAS_FILA_MAX", "10000"))   # linhas aguardando gravação
+LOTE_MAX = int(os.getenv("ECOVITA_LINHAS_LOTE_MAX", "500"))     # linhas por commit
+JANELA_LOTE_S = float(os.getenv("ECOVITA_LINHAS_JANELA_MS", "20")) / 1000
+LINHA_MAX = 4096                                                # bytes; o JSON do Mega tem ~700
+BUFFER_UDP = 4 * 1024 * 1024    # SO_RCVBUF pedido (o kernel limita a net.core.rmem_max)
+
+
+class LinhaInvalida(ValueError):
+    """Linha que não é um objeto JSON ou não passa na validação da API."""
+
+
+class _ProtocoloUDP(asyncio.DatagramProtocol):
+    def __init__(self, ouvinte):
+        self.ouvinte = ouvinte
+
+    def datagram_received(self, dados, endereco):
+        self.ouvinte.receber_datagrama(dados)
+
+
+class OuvinteLinhas:
+    """
+    Servidores TCP/UDP + uma tarefa gravadora no event loop da API.
+
+    - validar(dado): levanta exceção (HTTPException com detail) se inválido
+    - gravar(dados): grava a lista de leituras num commit; roda numa thread
+
+    Pelo TCP, a fila cheia pausa a leitura do socket (o controle de fluxo do
+    próprio TCP segura o cliente); pelo UDP, a linha é descartada e contada.
+    Linhas inválidas recebem "erro: ..." de volta na conexão TCP.
+    """
+
+    def __init__(self, validar, gravar, host=HOST, porta_tcp=PORTA_TCP, porta_udp=PORTA_UDP,
+                 tamanho=FILA_MAX, lote_max=LOTE_MAX, janela_s=JANELA_LOTE_S):
+        self.validar = validar
+        self.gravar = gravar
+        self.host = host
+        self.porta_tcp = porta_tcp
+        self.porta_udp = porta_udp
+        self.tamanho = tamanho
+        self.lote_max = lote_max
+        self.janela_s = janela_s
+        self.fila = None
+        self._servidor = None
+        self._transporte_udp = None
+        self._tarefa = None
+
+        # Métricas
+        self.conexoes_abertas = 0
+        self.conexoes_total = 0
+        self.linhas_recebidas = 0
+        self.invalidas = 0
+        self.descartadas_udp = 0
+        self.lotes_gravados = 0
+        self.leituras_gravadas = 0
+        self.erros = 0
+        self.max_latencia_commit_ms = 0.0
+        self._soma_latencia_commit_ms = 0.0
+
+    @property
+    def ativo(self):
+        return self.porta_tcp is not None or self.porta_udp is not None
+
+    # ----------------------
+    # Ciclo de vida (dentro do event loop)
+    # ----------------------
+    async def iniciar(self):
+        self.fila = asyncio.Queue(maxsize=self.tamanho)
+        # Porta 0 passada direto (sem o env) = porta livre escolhida pelo sistema
+        if self.porta_tcp is not None:
+            self._servidor = await asyncio.start_server(self._conexao, self.host, self.porta_tcp, limit=LINHA_MAX)
+            self.porta_tcp = self._servidor.sockets[0].getsockname()[1]
+        if self.porta_udp is not None:
+            self._transporte_udp, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _ProtocoloUDP(self), local_addr=(self.host, self.porta_udp))
+            sock = self._transporte_udp.get_extra_info("socket")
+            # Rajadas de datagramas enquanto o loop está ocupado ficam no buffer do kernel
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, BUFFER_UDP)
+            self.porta_udp = sock.getsockname()[1]
+        self._tarefa = asyncio.create_task(self._gravador())
+
+    async def parar(self):
+        """Fecha os servidores e grava o que ainda estiver na fila."""
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        if self._transporte_udp is not None:
+            self._transporte_udp.close()
+        if self._tarefa is not None:
+            await self.fila.join()
+            self._tarefa.cancel()
+            self._tarefa = None
+
+    # ----------------------
+    # Entrada
+    # ----------------------
+    def _ler(self, linha):
+        """Leitura validada, ou None para linha vazia. Levanta LinhaInvalida."""
+        linha = linha.strip()
+        if not linha:
+            return None
+        self.linhas_recebidas += 1
+        try:
+            dado = json.loads(linha)
+            if not isinstance(dado, dict):
+                raise ValueError("a linha deve ser um objeto JSON")
+            self.validar(dado)
+        except Exception as e:
+            self.invalidas += 1
+            raise LinhaInvalida(str(getattr(e, "detail", e)))
+        return dado
+
+    def receber_datagrama(self, dados):
+        for linha in dados.splitlines():
+            try:
+                dado = self._ler(linha)
+            except LinhaInvalida:
+                continue
+            if dado is None:
+                continue
+            try:
+                self.fila.put_nowait(dado)
+            except asyncio.QueueFull:
+                self.descartadas_udp += 1
+
+    async def _conexao(self, leitor, escritor):
+        self.conexoes_abertas += 1
+        self.conexoes_total += 1
+        try:
+            while True:
+                try:
+                    linha = await leitor.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    escritor.write(b"erro: linha maior que %d bytes\n" % LINHA_MAX)
+                    break
+                if not linha:
+                    break
+                try:
+                    dado = self._ler(linha)
+                except LinhaInvalida as e:
+                    escritor.write(f"erro: {e}\n".encode("utf-8"))
+                    continue
+                if dado is not None:
+                    await self.fila.put(dado)
+        except ConnectionError:
+            pass
+        finally:
+            self.conexoes_abertas -= 1
+            escritor.close()
+
+    # ----------------------
+    # Group commit
+    # ----------------------
+    async def _coletar_lote(self):
+        dados = [await self.fila.get()]
+        limite = time.monotonic() + self.janela_s
+        while len(dados) < self.lote_max:
+            if not self.fila.empty():
+                dados.append(self.fila.get_nowait())
+                continue
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                dados.append(await asyncio.wait_for(self.fila.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return dados
+
+    async def _gravador(self):
+        while True:
+            dados = await self._coletar_lote()
+            inicio = time.perf_counter()
+            try:
+                # Enquanto este lote grava numa thread, as conexões seguem enchendo a fila
+                await asyncio.to_thread(self.gravar, dados)
+                self._registrar_commit(len(dados), (time.perf_counter() - inicio) * 1000)
+            except Exception as e:
+                self.erros += 1
+                print("Erro ao gravar lote do protocolo de linhas:", e)
+            finally:
+                for _ in dados:
+                    self.fila.task_done()
+
+    def _registrar_commit(self, n, latencia_ms):
+        self.lotes_gravados += 1
+        self.leituras_gravadas += n
+        self.max_latencia_commit_ms = max(self.max_latencia_commit_ms, latencia_ms)
+        self._soma_latencia_commit_ms += latencia_ms
+
+    # ----------------------
+    # Métricas
+    # ----------------------
+    def status(self):
+        return {
+            "porta_tcp": self.porta_tcp,
+            "porta_udp": self.porta_udp,
+            "conexoes_abertas": self.conexoes_abertas,
+            "conexoes_total": self.conexoes_total,
+            "profundidade_fila": self.fila.qsize() if self.fila is not None else 0,
+            "linhas_recebidas": self.linhas_recebidas,
+            "invalidas": self.invalidas,
+            "descartadas_udp": self.descartadas_udp,
+            "lotes_gravados": self.lotes_gravados,
+            "leituras_gravadas": self.leituras_gravadas,
+            "lote_medio": round(self.leituras_gravadas / self.lotes_gravados, 2) if self.lotes_gravados else 0.0,
+            "erros": self.erros,
+            "latencia_commit_ms": {
+                "media": round(self._soma_latencia_commit_ms / self.lotes_gravados, 3) if self.lotes_gravados else 0.0,
+                "max": round(self.max_latencia_commit_ms, 3),
+            },
+        }
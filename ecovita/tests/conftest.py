@@ -0,0 +1,34 @@
+# conftest.py
+# Os módulos do backend leem a configuração do ambiente na importação
+# (bd.py abre o banco de ECOVITA_DB, inferencia.py procura os modelos em
+# ECOVITA_MODELOS_DIR): o ambiente de teste é montado aqui, antes deles.
+# Banco temporário, sem modelos treinados, sem limite de taxa por placa e
+# sem a fila de ingestão assíncrona (ECOVITA_DB_ASSINCRONO pode vir do ambiente).
+# Uso: cd ecovita && python -m pytest -q
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+PASTA_CODIGO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASTA_TESTES = tempfile.mkdtemp(prefix="ecovita-testes-")
+
+os.environ.update(
+    ECOVITA_DB=os.path.join(PASTA_TESTES, "ecovita.db"),
+    ECOVITA_MODELOS_DIR=os.path.join(PASTA_TESTES, "sem_modelos"),
+    ECOVITA_ARQUIVO_DIR=os.path.join(PASTA_TESTES, "arquivo"),
+    ECOVITA_ADMISSAO_TAXA="0",
+    ECOVITA_INGESTAO_ASSINCRONA="0",   # respostas com o resultado, não 202
+)
+sys.path.insert(0, PASTA_CODIGO)
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    """TestClient da API com startup (init_db) e shutdown rodados."""
+    from fastapi.testclient import TestClient
+    import api
+    with TestClient(api.app) as c:
+        yield c
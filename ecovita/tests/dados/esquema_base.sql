@@ -0,0 +1,75 @@
+CREATE TABLE testes (
+	id INTEGER NOT NULL, 
+	data_inicio DATE, 
+	descricao VARCHAR(255), 
+	data_fim DATE, 
+	status VARCHAR(12), 
+	nome_experimento VARCHAR(100), 
+	PRIMARY KEY (id)
+);
+CREATE TABLE composteira_dados (
+	id INTEGER NOT NULL, 
+	id_teste INTEGER, 
+	registro_em DATETIME, 
+	tipo_cov VARCHAR(100), 
+	ppm FLOAT, 
+	temperatura_c FLOAT, 
+	umidade_relativa FLOAT, 
+	ph FLOAT, 
+	presenca_chorume VARCHAR(12), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(id_teste) REFERENCES testes (id) ON DELETE SET NULL
+);
+CREATE TABLE site_dados (
+	id INTEGER NOT NULL, 
+	id_teste INTEGER, 
+	composto_verde VARCHAR(100), 
+	peso_verde_kg FLOAT, 
+	composto_marrom VARCHAR(100), 
+	peso_marrom_kg FLOAT, 
+	temp_alvo_c FLOAT, 
+	umidade_alvo_pct FLOAT, 
+	data_registro DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(id_teste) REFERENCES testes (id) ON DELETE SET NULL
+);
+CREATE TABLE ml_resultados (
+	id INTEGER NOT NULL, 
+	id_teste INTEGER, 
+	composto_verde_toxico VARCHAR(100), 
+	composto_marrom_toxico VARCHAR(100), 
+	toxicidade_geral VARCHAR(8), 
+	covs_predominantes TEXT, 
+	melhor_composto_verde VARCHAR(100), 
+	melhor_composto_marrom VARCHAR(100), 
+	recomendacao TEXT, 
+	dupla_atoxica VARCHAR(200), 
+	dupla_toxica VARCHAR(200), 
+	data_registro DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(id_teste) REFERENCES testes (id) ON DELETE SET NULL
+);
+CREATE TABLE sensor_leituras (
+	id INTEGER NOT NULL, 
+	id_teste INTEGER, 
+	temperatura FLOAT, 
+	umidade FLOAT, 
+	o2 FLOAT, 
+	ph FLOAT, 
+	gases TEXT, 
+	data_registro DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(id_teste) REFERENCES testes (id) ON DELETE SET NULL
+);
+CREATE TABLE ml3_resultados (
+	id INTEGER NOT NULL, 
+	id_leitura INTEGER NOT NULL, 
+	fase_predita VARCHAR(11), 
+	prob_fase_inicial FLOAT, 
+	prob_fase_termofilica FLOAT, 
+	prob_fase_maturacao FLOAT, 
+	score_coerencia FLOAT, 
+	data_analise DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(id_leitura) REFERENCES sensor_leituras (id) ON DELETE CASCADE
+);
@@ -0,0 +1,139 @@
+# test_admissao.py
+# Controle de admissão (admissao.py): balde de fichas por dispositivo com
+# relógio falso, Retry-After, vaga de inferência devolvida mesmo com
+# exceção, e o 429 das rotas de ingestão.
+
+import asyncio
+
+import pytest
+
+import admissao
+import api
+from admissao import BaldesDispositivo, LimiteInferencia, retry_after
+from benchmark import payload_arduino
+
+
+class _Relogio:
+    def __init__(self):
+        self.agora = 1000.0
+
+    def monotonic(self):
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = _Relogio()
+    monkeypatch.setattr(admissao, "time", relogio)
+    return relogio
+
+
+def test_balde_esvazia_e_enche_na_taxa(relogio):
+    baldes = BaldesDispositivo(taxa=2, rajada=4)
+    assert [baldes.admitir("placa") for _ in range(4)] == [0.0] * 4
+    assert baldes.admitir("placa") == pytest.approx(0.5)
+    assert baldes.admitir("outra") == 0.0          # cada origem tem o seu balde
+
+    relogio.agora += 0.5
+    assert baldes.admitir("placa") == 0.0
+    assert baldes.admitir("placa", custo=3) == pytest.approx(1.5)
+
+    # Parado por muito tempo, o balde enche só até a rajada
+    relogio.agora += 100
+    assert baldes.admitir("placa", custo=4) == 0.0
+    assert baldes.admitir("placa") == pytest.approx(0.5)
+    assert baldes.status()["admitidas"] == 10
+    assert baldes.status()["recusadas"] == 5
+
+
+def test_lote_maior_que_a_rajada_deixa_divida(relogio):
+    baldes = BaldesDispositivo(taxa=2, rajada=4)
+    assert baldes.admitir("placa", custo=10) == 0.0    # balde cheio: passa
+    assert baldes.admitir("placa") == pytest.approx(3.5)   # (1 - (-6)) / 2
+    relogio.agora += 3.5
+    assert baldes.admitir("placa") == 0.0
+
+
+def test_taxa_zero_desliga(relogio):
+    baldes = BaldesDispositivo(taxa=0, rajada=1)
+    assert not baldes.ativo
+    assert all(baldes.admitir("placa", custo=100) == 0.0 for _ in range(10))
+
+
+def test_baldes_parados_sao_descartados(relogio, monkeypatch):
+    monkeypatch.setattr(admissao, "LIMPEZA_A_CADA", 3)
+    baldes = BaldesDispositivo(taxa=1, rajada=2)
+    baldes.admitir("parada")
+    relogio.agora += 2
+    baldes.admitir("ativa")
+    baldes.admitir("ativa")
+    assert baldes.status()["origens"] == 1
+
+
+@pytest.mark.parametrize("espera, cabecalho", [(0.001, "1"), (1.0, "1"), (1.2, "2"), (3.5, "4")])
+def test_retry_after(espera, cabecalho):
+    assert retry_after(espera) == cabecalho
+
+
+def test_limite_de_inferencia():
+    limite = LimiteInferencia(maximo=2, espera_s=0.01)
+    assert limite.entrar() and limite.tentar()
+    assert not limite.tentar()
+    assert not limite.entrar()
+    limite.sair()
+    assert limite.entrar()
+    assert limite.status() == {"maximo": 2, "em_uso": 2, "pico": 2, "recusadas": 1}
+    assert LimiteInferencia(maximo=0).entrar()
+
+
+@pytest.fixture
+def uma_vaga(monkeypatch):
+    limite = LimiteInferencia(maximo=1, espera_s=0.01)
+    monkeypatch.setattr(api, "limite_inferencia", limite)
+    return limite
+
+
+def test_vaga_volta_depois_de_excecao(uma_vaga):
+    with pytest.raises(RuntimeError):
+        with api.vaga_inferencia([]):
+            assert uma_vaga.em_uso == 1
+            raise RuntimeError("falha no ML-2")
+    assert uma_vaga.em_uso == 0
+
+    async def rota():
+        async with api.vaga_inferencia_async([]):
+            raise RuntimeError("falha no ML-3")
+    with pytest.raises(RuntimeError):
+        asyncio.run(rota())
+    assert uma_vaga.em_uso == 0
+    assert uma_vaga.tentar()
+
+
+def _lote(device_id, seqs):
+    return [{**payload_arduino(), "device_id": device_id, "seq": s} for s in seqs]
+
+
+def test_rota_responde_429_com_retry_after(cliente, monkeypatch):
+    monkeypatch.setattr(api, "baldes", BaldesDispositivo(taxa=1, rajada=3))
+    assert cliente.post("/esp32/leituras/lote", json=_lote("t-admissao", range(3))).status_code == 200
+
+    r = cliente.post("/esp32/leituras/lote", json=_lote("t-admissao", range(3, 5)))
+    assert r.status_code == 429
+    assert r.headers["retry-after"] == "2"     # 2 fichas a 1/s
+    assert cliente.post("/esp32/leitura", json=_lote("t-admissao-outra", [0])[0]).status_code == 200
+
+    itens = cliente.get("/esp32/leitura", params={"device_id": "t-admissao"}).json()["itens"]
+    assert [i["seq"] for i in itens] == [0, 1, 2]
+
+
+def test_rota_sobrecarregada_responde_429_e_libera_as_seqs(cliente, uma_vaga):
+    assert uma_vaga.entrar()    # outra requisição ocupando a única vaga
+    r = cliente.post("/esp32/leitura", json=_lote("t-sobrecarga", [0])[0])
+    assert r.status_code == 429
+    assert r.headers["retry-after"] == "1"
+    uma_vaga.sair()
+
+    # O reenvio da mesma seq é gravado, não tratado como repetição
+    r = cliente.post("/esp32/leitura", json=_lote("t-sobrecarga", [0])[0])
+    assert r.status_code == 200 and r.json()["duplicada"] is False
+    assert uma_vaga.em_uso == 0
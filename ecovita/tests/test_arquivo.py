@@ -0,0 +1,132 @@
+# test_arquivo.py
+# Arquivo frio: leituras antigas vão para Parquet em tmp_path e as
+# páginas, a exportação e as agregações continuam vendo os dois níveis
+# como antes do arquivamento. Banco próprio, fora do da API.
+
+from datetime import datetime, timedelta
+from random import Random
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip("pyarrow")
+
+import arquivo
+from api import nova_leitura
+from benchmark import banco_temporario, payload_arduino
+from bd import ArquivoLote, ML3Resultado, SensorLeitura
+from consultas import (
+    COLUNAS_EXPORTACAO, agregar_gases, agregar_leituras, exportar_leituras, paginar,
+)
+
+AGORA = datetime(2026, 10, 18, 12, 0)
+
+
+@pytest.fixture
+def db(cliente, tmp_path, monkeypatch):
+    # cliente: nova_leitura consulta a pilha da placa no banco da API
+    monkeypatch.setattr(arquivo, "ARQUIVO_DIR", str(tmp_path / "arquivo"))
+    engine, _ = banco_temporario(str(tmp_path))
+    sessao = sessionmaker(bind=engine)()
+    sessao.engine = engine
+    yield sessao
+    sessao.close()
+    engine.dispose()
+
+
+def _gravar(db, datas, device_id="t-arquivo", seq=0):
+    rng = Random(seq)
+    novas = [nova_leitura({**payload_arduino(rng), "device_id": device_id, "seq": seq + i}, d)
+             for i, d in enumerate(datas)]
+    db.add_all(novas)
+    db.commit()
+    return novas
+
+
+def _historico(db):
+    # Meses diferentes e vários instantes repetidos (desempate por id)
+    antigas = [datetime(2026, 1, 31, 23, 59) + timedelta(seconds=20 * (i // 2)) for i in range(24)]
+    recentes = [AGORA - timedelta(minutes=i) for i in range(8, 0, -1)]
+    return _gravar(db, antigas), _gravar(db, recentes, seq=100)
+
+
+def _todas_as_paginas(db, limite=5):
+    query = db.query(SensorLeitura)
+    vistos, cursor = [], None
+    while True:
+        itens, cursor = paginar(query, SensorLeitura, cursor, limite,
+                                lambda depois: arquivo.leituras_arquivadas(db, depois=depois))
+        vistos += [i.id for i in itens]
+        if cursor is None:
+            return vistos
+
+def _exportar(db, formato):
+    colunas = [getattr(SensorLeitura, c) for c in COLUNAS_EXPORTACAO]
+    query = db.query(*colunas).order_by(SensorLeitura.data_registro, SensorLeitura.id)
+    arquivadas = arquivo.leituras_arquivadas(db, colunas=COLUNAS_EXPORTACAO)
+    return "".join(exportar_leituras(query, formato, arquivadas))
+
+
+def _aproximado(valor):
+    if isinstance(valor, dict):
+        return {k: _aproximado(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        return [_aproximado(v) for v in valor]
+    return pytest.approx(valor) if isinstance(valor, float) else valor
+
+
+def test_arquivamento_preserva_paginas_exportacao_e_agregados(db):
+    antigas, recentes = _historico(db)
+    db.add_all([ML3Resultado(id_leitura=l.id, score_coerencia=0.5) for l in (antigas[0], recentes[0])])
+    db.commit()
+    esperado = [l.id for l in sorted(antigas + recentes, key=lambda l: (l.data_registro, l.id))]
+    antes = {
+        "paginas": _todas_as_paginas(db),
+        "ndjson": _exportar(db, "ndjson"),
+        "csv": _exportar(db, "csv"),
+        "leituras": {b: agregar_leituras(db, b) for b in ("1m", "1h", "1d")},
+        "gases": {b: agregar_gases(db, b) for b in ("1m", "1d")},
+    }
+    assert antes["paginas"] == esperado
+
+    lotes = arquivo.arquivar(dias=90, agora=AGORA, engine_alvo=db.engine)
+    db.expire_all()
+    assert sorted(l.mes for l in lotes) == ["2026-01", "2026-02"]
+    assert sum(l.linhas for l in lotes) == len(antigas)
+    assert db.query(ArquivoLote).count() == 2
+    assert sorted(i for (i,) in db.query(SensorLeitura.id)) == [l.id for l in recentes]
+    # Resultados do ML-3 saem junto com a leitura, como no CASCADE do modelo
+    assert [r.id_leitura for r in db.query(ML3Resultado)] == [recentes[0].id]
+
+    assert _todas_as_paginas(db) == esperado
+    assert _todas_as_paginas(db, limite=3) == esperado
+    assert _exportar(db, "ndjson") == antes["ndjson"]
+    assert _exportar(db, "csv") == antes["csv"]
+    for bucket, agregado in antes["leituras"].items():
+        assert agregar_leituras(db, bucket) == _aproximado(agregado)
+    for bucket, agregado in antes["gases"].items():
+        assert agregar_gases(db, bucket) == _aproximado(agregado)
+
+
+def test_leitura_de_maior_id_fica_no_sqlite(db):
+    antigas, recentes = _historico(db)
+    ultima = max(antigas + recentes, key=lambda l: l.id)
+
+    # Um ano depois tudo passa da idade, menos a leitura de maior id
+    lotes = arquivo.arquivar(dias=90, agora=AGORA + timedelta(days=365), engine_alvo=db.engine)
+    db.expire_all()
+    assert sum(l.linhas for l in lotes) == len(antigas) + len(recentes) - 1
+    assert [i for (i,) in db.query(SensorLeitura.id)] == [ultima.id]
+
+    # O rowid continua depois do arquivo: nenhum id volta a ser usado
+    nova, = _gravar(db, [AGORA + timedelta(minutes=1)], seq=200)
+    assert nova.id > max(l.id_max for l in lotes)
+    ids = _todas_as_paginas(db, limite=4)
+    assert len(ids) == len(set(ids)) == len(antigas) + len(recentes) + 1
+    assert ids[-2:] == [ultima.id, nova.id]
+
+
+def test_arquivar_de_novo_nao_move_nada(db):
+    _historico(db)
+    assert arquivo.arquivar(dias=90, agora=AGORA, engine_alvo=db.engine)
+    assert arquivo.arquivar(dias=90, agora=AGORA, engine_alvo=db.engine) == []
@@ -0,0 +1,136 @@
+# test_binario.py
+# Decodificação do formato binário (binario.py): ida e volta com o
+# encoder da API (v1) e o do ESP32 (v2/v3), e recusa de corpos malformados
+# com FormatoInvalido (422 na rota), já que os bytes vêm da rede.
+
+from random import Random
+
+import pytest
+
+import esp
+from benchmark import payload_arduino
+from binario import CABECALHO, ORIGEM_V3, RESUMO_V2, TIPO_BINARIO, FormatoInvalido, codificar, decodificar
+from bd import GASES_ARDUINO
+
+
+def _ppm(dado):
+    return {g["composto"]: g["ppm"] for g in dado["gases"]}
+
+
+def _confere(decodificado, dado):
+    for campo in ("temperatura", "umidade", "ph", "umidSolo"):
+        assert decodificado[campo] == pytest.approx(dado[campo], abs=0.005)
+    assert decodificado["gases"] == pytest.approx(_ppm(dado), abs=0.005)
+
+
+def _registros_esp(leituras):
+    # Um resumo de 3 amostras por leitura: média, mínimo, máximo e último
+    return b"".join(
+        esp.codificar_registro(3, [esp.valores_da_leitura(d) for d in (d, minimo, maximo, d)])
+        for d, minimo, maximo in leituras
+    )
+
+
+def _leituras(n, semente=0):
+    rng = Random(semente)
+    return [(payload_arduino(rng), payload_arduino(rng), payload_arduino(rng)) for _ in range(n)]
+
+
+def _corpo_v3(n=2, device_id="placa-7", seq=40):
+    return esp.cabecalho(n, device_id, seq) + _registros_esp(_leituras(n))
+
+
+def test_v1_ida_e_volta():
+    dados = [payload_arduino(Random(i)) for i in range(5)]
+    decodificados = decodificar(codificar(dados))
+    assert len(decodificados) == 5
+    for decodificado, dado in zip(decodificados, dados):
+        _confere(decodificado, dado)
+        assert "device_id" not in decodificado
+
+
+def test_v1_ausentes_e_fora_da_faixa():
+    decodificado, = decodificar(codificar([
+        {"temperatura": -500.0, "umidade": 60.0, "gases": {"Metano": 12.5, "CO": 1e12}},
+    ]))
+    assert decodificado["temperatura"] == -327.68     # limitado ao int16
+    assert decodificado["ph"] is None and decodificado["umidSolo"] is None
+    assert decodificado["gases"] == {"Metano": 12.5, "CO": (0xFFFFFFFF - 1) / 100}
+
+
+def test_v2_resumos_do_esp():
+    leituras = _leituras(3)
+    decodificados = decodificar(CABECALHO.pack(2, 3) + _registros_esp(leituras))
+    for decodificado, (media, minimo, maximo) in zip(decodificados, leituras):
+        assert decodificado["amostras"] == 3
+        _confere(decodificado, media)
+        _confere(decodificado["min"], minimo)
+        _confere(decodificado["max"], maximo)
+        _confere(decodificado["ultimo"], media)
+
+
+def test_v3_origem_do_esp():
+    decodificados = decodificar(_corpo_v3(3, "placa-7", 40))
+    assert [(d["device_id"], d["seq"]) for d in decodificados] == [("placa-7", 40), ("placa-7", 41), ("placa-7", 42)]
+    assert esp.TAMANHO_REGISTRO == RESUMO_V2.size
+    assert set(esp.COMPOSTOS) == set(GASES_ARDUINO)
+
+
+def test_lote_vazio():
+    assert decodificar(CABECALHO.pack(1, 0)) == []
+    assert decodificar(esp.cabecalho(0, "placa-7", 0)) == []
+
+
+MALFORMADOS = {
+    "vazio": b"",
+    "menor que o cabeçalho": b"\x03",
+    "só o cabeçalho": CABECALHO.pack(1, 1),
+    "registro truncado": codificar([payload_arduino()])[:-1],
+    "byte sobrando": codificar([payload_arduino()]) + b"\0",
+    "quantidade maior": CABECALHO.pack(2, 4) + _registros_esp(_leituras(3)),
+    "v3 sem preâmbulo": CABECALHO.pack(3, 1) + _registros_esp(_leituras(1)),
+    "v3 preâmbulo truncado": _corpo_v3(0)[:-1],
+    "versão 0": CABECALHO.pack(0, 0),
+    "versão 4": CABECALHO.pack(4, 1) + _registros_esp(_leituras(1)),
+    "versão 255": b"\xff" + _corpo_v3()[1:],
+    "device_id não ASCII": CABECALHO.pack(3, 1) + ORIGEM_V3.pack("placa-ç".encode(), 0) + _registros_esp(_leituras(1)),
+}
+
+
+@pytest.mark.parametrize("corpo", MALFORMADOS.values(), ids=MALFORMADOS.keys())
+def test_malformado(corpo):
+    with pytest.raises(FormatoInvalido):
+        decodificar(corpo)
+
+
+def test_bytes_aleatorios_so_levantam_formato_invalido():
+    rng = Random(14)
+    validos = [codificar([payload_arduino(rng)] * 2), CABECALHO.pack(2, 1) + _registros_esp(_leituras(1)), _corpo_v3()]
+    for _ in range(2000):
+        corpo = bytearray(rng.choice(validos))
+        for _ in range(rng.randint(1, 4)):
+            corpo[rng.randrange(len(corpo))] = rng.randrange(256)
+        corpo = bytes(corpo[:rng.randint(0, len(corpo) + 1)])
+        try:
+            dados = decodificar(corpo)
+        except FormatoInvalido:
+            continue
+        assert isinstance(dados, list)
+
+
+@pytest.mark.parametrize("caso", ["vazio", "registro truncado", "versão 4", "device_id não ASCII"])
+def test_rota_responde_422(cliente, caso):
+    r = cliente.post("/esp32/leituras/bin", content=MALFORMADOS[caso], headers={"Content-Type": TIPO_BINARIO})
+    assert r.status_code == 422
+
+
+def test_rota_grava_v3(cliente):
+    r = cliente.post("/esp32/leituras/bin", content=_corpo_v3(2, "t-binario", 0), headers={"Content-Type": TIPO_BINARIO})
+    assert r.status_code == 200
+    itens = cliente.get("/esp32/leitura", params={"device_id": "t-binario"}).json()["itens"]
+    assert [(i["seq"], i["amostras"]) for i in itens] == [(0, 3), (1, 3)]
+
+
+def test_rota_exige_o_tipo_binario(cliente):
+    r = cliente.post("/esp32/leituras/bin", content=_corpo_v3(), headers={"Content-Type": "application/octet-stream"})
+    assert r.status_code == 415
@@ -0,0 +1,102 @@
+# test_cache.py
+# Cache de respostas (cache.py) pelas rotas GET /site_dados e
+# /ml_resultados: ETag/304, invalidação no commit que grava na tabela e
+# versões intactas quando a sessão faz rollback.
+
+from datetime import datetime
+
+import pytest
+
+from cache import _casa, versoes
+
+SITE_DADO = {
+    "composto_verde": "Grama", "peso_verde_kg": 2.0, "composto_marrom": "Serragem",
+    "peso_marrom_kg": 1.0, "temp_alvo_c": 55.0, "umidade_alvo_pct": 55.0,
+}
+
+
+@pytest.fixture
+def listar(cliente):
+    def listar(device_id, etag=None, rota="/site_dados"):
+        cabecalhos = {"If-None-Match": etag} if etag else {}
+        return cliente.get(rota, params={"device_id": device_id}, headers=cabecalhos)
+    return listar
+
+
+def _falhas(cliente):
+    return cliente.get("/cache/status").json()["falhas"]
+
+
+def test_etag_e_304_sem_consultar_o_banco(cliente, listar):
+    primeira = listar("t-cache-304")
+    assert primeira.status_code == 200
+    assert primeira.headers["cache-control"] == "no-cache"
+    etag = primeira.headers["etag"]
+
+    falhas = _falhas(cliente)
+    repetida = listar("t-cache-304", etag)
+    assert repetida.status_code == 304 and repetida.content == b""
+    assert repetida.headers["etag"] == etag
+    assert listar("t-cache-304", f"W/{etag}").status_code == 304
+    assert listar("t-cache-304", f'"outro", {etag}').status_code == 304
+
+    sem_etag = listar("t-cache-304")
+    assert sem_etag.status_code == 200 and sem_etag.content == primeira.content
+    assert _falhas(cliente) == falhas   # tudo servido da memória
+
+    # Outros parâmetros são outra entrada
+    assert listar("t-cache-304-outra", etag).status_code in (200, 304)
+    assert _falhas(cliente) == falhas + 1
+
+
+def test_commit_na_tabela_invalida(cliente, listar):
+    etag = listar("t-cache-commit").headers["etag"]
+    versao = versoes.de(["site_dados"])
+
+    assert cliente.post("/site_dados", json={**SITE_DADO, "device_id": "t-cache-commit"}).status_code == 200
+    assert versoes.de(["site_dados"]) > versao
+
+    depois = listar("t-cache-commit", etag)
+    assert depois.status_code == 200
+    assert depois.headers["etag"] != etag
+    assert [i["device_id"] for i in depois.json()["itens"]] == ["t-cache-commit"]
+    assert listar("t-cache-commit", depois.headers["etag"]).status_code == 304
+
+
+def test_escrita_em_outra_tabela_nao_invalida(cliente, listar):
+    from bd import SessionLocal, SiteDado
+    etag = listar("t-cache-outra", rota="/ml_resultados").headers["etag"]
+
+    db = SessionLocal()
+    try:
+        db.add(SiteDado(**SITE_DADO, device_id="t-cache-outra", data_registro=datetime.now()))
+        db.commit()
+    finally:
+        db.close()
+    assert listar("t-cache-outra", etag, rota="/ml_resultados").status_code == 304
+
+
+def test_rollback_nao_muda_as_versoes(cliente, listar):
+    from bd import SessionLocal, SiteDado
+    etag = listar("t-cache-rollback").headers["etag"]
+    versao = versoes.de(["site_dados"])
+
+    db = SessionLocal()
+    try:
+        db.add(SiteDado(**SITE_DADO, device_id="t-cache-rollback", data_registro=datetime.now()))
+        db.flush()
+        db.rollback()
+        # O próximo commit da mesma sessão não leva o site_dados descartado
+        db.commit()
+    finally:
+        db.close()
+    assert versoes.de(["site_dados"]) == versao
+    assert listar("t-cache-rollback", etag).status_code == 304
+
+
+@pytest.mark.parametrize("if_none_match, casa", [
+    (None, False), ("", False), ('"abc"', True), ('W/"abc"', True),
+    ('"x", "abc"', True), ("*", True), ('"abcd"', False), ("abc", False),
+])
+def test_if_none_match(if_none_match, casa):
+    assert _casa('"abc"', if_none_match) is casa
@@ -0,0 +1,63 @@
+# test_consultas.py
+# Planos das consultas quentes (o mesmo que `python consultas.py`) e a
+# paginação por cursor (keyset) de GET /esp32/leitura.
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmark import payload_arduino
+
+
+@pytest.fixture
+def db(cliente):
+    from bd import SessionLocal
+    sessao = SessionLocal()
+    yield sessao
+    sessao.close()
+
+
+def test_consultas_quentes_usam_indice(db):
+    from consultas import verificar_indices
+    assert verificar_indices(db) == []
+
+
+def test_janela_das_ultimas_24h(db):
+    from consultas import consultas_quentes
+    consulta = next(q for descricao, q, _ in consultas_quentes(db) if descricao == "últimas 24 h de um teste")
+    datas = [v for v in consulta.statement.compile().params.values() if isinstance(v, datetime)]
+    assert datas
+    assert all(timedelta(hours=23) < datetime.now() - d <= timedelta(days=1, minutes=1) for d in datas)
+
+
+def test_paginacao_por_cursor_percorre_tudo_sem_repetir(cliente, db):
+    from api import nova_leitura
+    base = datetime(2026, 1, 1, 12, 0)
+    # Várias leituras no mesmo instante: o desempate é pelo id
+    datas = [base + timedelta(seconds=i // 3) for i in range(23)]
+    novas = [nova_leitura({**payload_arduino(), "device_id": "t-pagina", "seq": i}, d) for i, d in enumerate(datas)]
+    db.add_all(novas)
+    db.commit()
+    esperado = [n.id for n in sorted(novas, key=lambda n: (n.data_registro, n.id))]
+
+    vistos, cursor = [], None
+    while True:
+        params = {"device_id": "t-pagina", "limit": 5, **({"cursor": cursor} if cursor else {})}
+        pagina = cliente.get("/esp32/leitura", params=params).json()
+        assert len(pagina["itens"]) <= 5
+        vistos += [item["id"] for item in pagina["itens"]]
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            break
+    assert vistos == esperado
+
+    # Cursor a partir do meio: começa logo depois do item do cursor
+    from consultas import codificar_cursor
+    meio = sorted(novas, key=lambda n: (n.data_registro, n.id))[10]
+    pagina = cliente.get("/esp32/leitura", params={
+        "device_id": "t-pagina", "limit": 3, "cursor": codificar_cursor(meio.data_registro, meio.id)}).json()
+    assert [item["id"] for item in pagina["itens"]] == esperado[11:14]
+
+
+def test_cursor_invalido(cliente):
+    assert cliente.get("/esp32/leitura", params={"cursor": "nao-e-cursor"}).status_code == 400
@@ -0,0 +1,35 @@
+# test_esp.py
+# Agregação na borda do esp.py com as formas de "gases" que a API aceita
+# (esquemas.LeituraEntrada): lista do Mega, dict composto -> ppm e texto JSON.
+
+import json
+
+import pytest
+
+import esp
+
+LISTA = [{"composto": "Metano", "ppm": 40.0}, {"composto": "H2S", "ppm": 6.5}, {"composto": "CO2", "ppm": None}]
+DICT = {"Metano": 40.0, "H2S": 6.5, "CO2": None}
+
+
+@pytest.mark.parametrize("gases", [LISTA, DICT, json.dumps(LISTA), json.dumps(DICT), {"CH4": 40.0, "H2S": 6.5}])
+def test_formas_de_gases(gases):
+    valores = esp.valores_da_leitura({"temperatura": 50.0, "umidade": 60.0, "gases": gases})
+    ppm = dict(zip(esp.COMPOSTOS, valores[len(esp.CAMPOS):]))
+    assert ppm["Metano"] == 40.0
+    assert ppm["H2S"] == 6.5
+    assert ppm["CO2"] is None
+
+
+@pytest.mark.parametrize("gases", [None, "", "não é json", 12, ["Metano"]])
+def test_gases_ausentes_ou_invalidos(gases):
+    valores = esp.valores_da_leitura({"temperatura": 50.0, "umidade": 60.0, "gases": gases})
+    assert valores[len(esp.CAMPOS):] == [None] * len(esp.COMPOSTOS)
+
+
+def test_agregador_aceita_dict_de_gases():
+    agregador = esp.Agregador()
+    agregador.adicionar({"temperatura": 50.0, "umidade": 60.0, "gases": {"Metano": 10.0}})
+    agregador.adicionar({"temperatura": 52.0, "umidade": 62.0, "gases": json.dumps({"Metano": 30.0})})
+    i = len(esp.CAMPOS) + esp.COMPOSTOS.index("Metano")
+    assert (agregador.minimo[i], agregador.maximo[i], agregador.ultimo[i]) == (10.0, 30.0, 30.0)
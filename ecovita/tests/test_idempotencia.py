@@ -0,0 +1,85 @@
+# test_idempotencia.py
+# Ingestão idempotente por (device_id, seq) pelas rotas da API, e o
+# recomeço da numeração de uma placa regravada (409 + X-Proxima-Seq).
+
+from benchmark import payload_arduino
+from esp import BufferFlash, Cliente
+
+
+def _leitura(device_id, seq):
+    return {**payload_arduino(), "device_id": device_id, "seq": seq}
+
+
+def test_reenvio_nao_grava_de_novo(cliente):
+    primeira = cliente.post("/esp32/leitura", json=_leitura("t-dedup", 0))
+    assert primeira.status_code == 200
+    assert primeira.json()["duplicada"] is False
+
+    reenvio = cliente.post("/esp32/leitura", json=_leitura("t-dedup", 0))
+    assert reenvio.status_code == 200
+    assert reenvio.json() == {"leitura": None, "ml2_resultado": None, "ml3_validacao": None, "duplicada": True}
+
+    lote = cliente.post("/esp32/leituras/lote", json=[_leitura("t-dedup", s) for s in (0, 1, 1, 2)])
+    assert [r["duplicada"] for r in lote.json()] == [True, False, True, False]
+
+    itens = cliente.get("/esp32/leitura", params={"device_id": "t-dedup"}).json()["itens"]
+    assert sorted(i["seq"] for i in itens) == [0, 1, 2]
+
+
+def test_device_id_sem_seq_e_recusado(cliente):
+    r = cliente.post("/esp32/leitura", json={**payload_arduino(), "device_id": "t-dedup"})
+    assert r.status_code == 422
+
+
+def test_seq_reiniciada_responde_409_com_a_proxima(cliente):
+    from idempotencia import REINICIO
+    cliente.post("/esp32/leituras/lote", json=[_leitura("t-reinicio", s) for s in range(REINICIO + 10)])
+
+    # Reenvio do último lote: ainda é repetição
+    r = cliente.post("/esp32/leitura", json=_leitura("t-reinicio", REINICIO + 5))
+    assert r.status_code == 200 and r.json()["duplicada"] is True
+
+    # Placa regravada recomeçando do zero: recusa explícita, nada gravado
+    r = cliente.post("/esp32/leituras/lote", json=[_leitura("t-reinicio", s) for s in range(3)])
+    assert r.status_code == 409
+    assert r.headers["x-proxima-seq"] == str(REINICIO + 10)
+
+    # Renumerado a partir da seq indicada, o lote entra
+    proxima = int(r.headers["x-proxima-seq"])
+    r = cliente.post("/esp32/leituras/lote", json=[_leitura("t-reinicio", proxima + s) for s in range(3)])
+    assert r.status_code == 200
+    assert [x["duplicada"] for x in r.json()] == [False] * 3
+
+
+class _EnviadorReiniciado:
+    """Responde 409 com X-Proxima-Seq uma vez e depois aceita."""
+
+    def __init__(self, proxima):
+        self.proxima_seq = proxima
+        self.retry_after_ms = None
+        self.backoff_ms = 0
+        self.cabecalhos = []
+
+    def post(self, corpo):
+        self.cabecalhos.append(corpo[:23])
+        return 409 if len(self.cabecalhos) == 1 else 200
+
+    def sucesso(self):
+        pass
+
+
+def test_esp_renumera_o_buffer_depois_do_409(tmp_path):
+    import esp
+    buffer = BufferFlash(str(tmp_path / "buffer.bin"), capacidade=8)
+    buffer.adicionar([esp.codificar_registro(1, [esp.valores_da_leitura(payload_arduino())] * 4)] * 3)
+    assert buffer.seq == 0
+
+    cliente = Cliente(uart=None, buffer=buffer, enviador=_EnviadorReiniciado(700), device_id="placa")
+    cliente.enviar_lote(0)
+    assert (buffer.seq, buffer.quantidade) == (700, 3)   # renumerado, nada descartado
+    cliente.enviar_lote(0)
+    assert (buffer.seq, buffer.quantidade, cliente.enviadas) == (703, 0, 3)
+    assert cliente.enviador.cabecalhos[1] == esp.cabecalho(3, "placa", 700)
+
+    # O índice na flash guarda a nova numeração
+    assert BufferFlash(str(tmp_path / "buffer.bin"), capacidade=8).seq == 703
@@ -0,0 +1,83 @@
+# test_inferencia.py
+# ML-1 com encoders ajustados como no ml1.py (pares i < j da tabela de
+# compostos) e um modelo de mentira: sem TensorFlow nem artefatos.
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import LabelEncoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bd import Base, MLResultado
+from inferencia import COMPOSTOS_ML1, COMPOSTOS_NITROGENADOS, ServidorModelos, classificar_tipo_cov
+
+COMPOSTOS = list(COMPOSTOS_ML1)
+
+
+def _ajustado(valores):
+    return LabelEncoder().fit(list(valores))
+
+
+class _Identidade:
+    def transform(self, x):
+        return x
+
+
+@pytest.fixture
+def servidor(tmp_path):
+    # Como no ml1.py: o último composto nunca é verde e o primeiro nunca é marrom
+    verdes, marrons = COMPOSTOS[:-1], COMPOSTOS[1:]
+    servidor = ServidorModelos(str(tmp_path))
+    servidor.ml1 = {
+        "modelo": lambda X, training: (np.array([[0.1, 0.8, 0.1]]), np.array([[0.7, 0.2, 0.1]])),
+        "scaler": _Identidade(),
+        "encoders": {
+            "verde": _ajustado(verdes),
+            "marrom": _ajustado(marrons),
+            "tipo_verde": _ajustado(classificar_tipo_cov(COMPOSTOS_ML1[c][0]) for c in verdes),
+            "tipo_marrom": _ajustado(classificar_tipo_cov(COMPOSTOS_ML1[c][0]) for c in marrons),
+            "CN_verde": _ajustado("N" if c in COMPOSTOS_NITROGENADOS else "C" for c in verdes),
+            "CN_marrom": _ajustado("N" if c in COMPOSTOS_NITROGENADOS else "C" for c in marrons),
+            "toxicidade": _ajustado(["alta", "baixa", "média"]),
+            "fase": _ajustado(["Inicial", "Maturacao", "Termofilica"]),
+        },
+    }
+    return servidor
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    sessao = sessionmaker(bind=engine)()
+    yield sessao
+    sessao.close()
+
+
+def _site_dado(verde, marrom):
+    return SimpleNamespace(composto_verde=verde, composto_marrom=marrom, id_teste=None, device_id=None)
+
+
+def test_par_visto_no_treino(servidor, db):
+    res = servidor.prever_toxicidade(_site_dado(COMPOSTOS[0], COMPOSTOS[-1]), db)
+    assert res["toxicidade"] == "baixa"
+    assert res["fase"] == "Inicial"
+    assert db.get(MLResultado, res["id_resultado"]).dupla_atoxica == f"{COMPOSTOS[0]} + {COMPOSTOS[-1]}"
+
+
+@pytest.mark.parametrize("verde, marrom", [
+    (COMPOSTOS[-1], COMPOSTOS[1]),    # nunca foi verde no treino
+    (COMPOSTOS[0], COMPOSTOS[0]),     # nunca foi marrom no treino
+])
+def test_composto_fora_do_treino_nao_levanta(servidor, db, verde, marrom):
+    res = servidor.prever_toxicidade(_site_dado(verde, marrom), db)
+    assert res["toxicidade"] == "desconhecido"
+    assert "motivo" in res
+    assert db.query(MLResultado).count() == 0
+
+
+def test_composto_fora_da_tabela(servidor, db):
+    res = servidor.prever_toxicidade(_site_dado("Serragem", COMPOSTOS[1]), db)
+    assert res == {"toxicidade": "desconhecido", "motivo": "composto fora da base do ML-1"}
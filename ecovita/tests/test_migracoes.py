@@ -0,0 +1,62 @@
+# test_migracoes.py
+# Atualização de um banco antigo pelo init_db da API. Cada caso roda num
+# processo próprio: bd.py abre o banco de ECOVITA_DB na importação.
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+from conftest import PASTA_CODIGO
+
+ESQUEMA_BASE = os.path.join(os.path.dirname(__file__), "dados", "esquema_base.sql")
+
+GASES = '[{"composto":"Metano","ppm":3.5},{"composto":"H2S","ppm":1.2}]'
+
+
+def _init_db(arquivo):
+    return subprocess.run(
+        [sys.executable, "-c", "import bd; bd.init_db()"],
+        cwd=PASTA_CODIGO, env=dict(os.environ, ECOVITA_DB=arquivo),
+        capture_output=True, text=True,
+    )
+
+
+def _banco_base(tmp_path):
+    """Banco com o esquema do commit inicial (sem migrações) e duas leituras."""
+    arquivo = str(tmp_path / "base.db")
+    conexao = sqlite3.connect(arquivo)
+    with open(ESQUEMA_BASE, encoding="utf-8") as f:
+        conexao.executescript(f.read())
+    conexao.executemany(
+        "INSERT INTO sensor_leituras (temperatura, umidade, o2, ph, gases, data_registro) VALUES (?, ?, ?, ?, ?, ?)",
+        [(50.0, 60.0, 20.0, 7.0, GASES, "2026-10-01 10:00:00"),
+         (52.0, 58.0, 20.0, 7.2, GASES, "2026-10-01 10:00:30")],
+    )
+    conexao.commit()
+    conexao.close()
+    return arquivo
+
+
+def test_atualiza_banco_do_commit_inicial(tmp_path):
+    arquivo = _banco_base(tmp_path)
+    processo = _init_db(arquivo)
+    assert processo.returncode == 0, processo.stderr
+
+    from bd import MIGRACOES
+    conexao = sqlite3.connect(arquivo)
+    assert conexao.execute("PRAGMA user_version").fetchone()[0] == MIGRACOES[-1][0]
+    # As duas leituras caem no mesmo minuto do rollup, sem device_id
+    assert conexao.execute("SELECT device_id, n FROM rollup_minuto").fetchall() == [("", 2)]
+    indices = {nome for (nome,) in conexao.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"ix_rollup_minuto_device", "ix_rollup_hora_device", "ix_rollup_dia_device"} <= indices
+    assert conexao.execute("SELECT COUNT(*) FROM leitura_gases").fetchone()[0] == 4
+    conexao.close()
+
+
+def test_init_db_repetido_nao_migra_de_novo(tmp_path):
+    arquivo = _banco_base(tmp_path)
+    assert _init_db(arquivo).returncode == 0
+    processo = _init_db(arquivo)
+    assert processo.returncode == 0, processo.stderr
+    assert "Migração" not in processo.stdout